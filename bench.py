@@ -0,0 +1,418 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+
+import psycopg2
+import psycopg2.extensions
+from dotenv import load_dotenv
+
+import main
+from cache import TTLCache
+from database import Database
+from member import MemberRepository
+from queries import registry
+from router import CommandRouter
+from server import ServerRepository
+from sprintathon import SprintathonRepository
+from sprintathonbot import SprintathonBot
+from storage import SQLITE_PREFIX
+from stub_gateway import StubBot, StubGuild
+from submission_buffer import SubmissionBuffer
+
+# Load-testing harness: drives SprintathonBot's commands through fake contexts on the stub gateway, against a throwaway
+# Postgres database (or an SQLite one), and compares each scenario's results with a saved baseline.
+#
+#     python bench.py --dsn postgresql://localhost/postgres --guilds 20 --members 25 --concurrency 64
+#     python bench.py --dsn sqlite://:memory:  # the bot's own overhead, without a database server
+#     python bench.py --save-baseline          # after a change that's meant to move the numbers
+#
+# The baseline holds one set of results per storage engine, along with the settings they were run with, as results
+# from a different engine or load aren't comparable. bench_baseline.json is the committed one.
+
+scenarios = ['checkin', 'leaderboard', 'lifecycle']
+default_baseline = 'bench_baseline.json'
+# Latencies may also be this much worse than the baseline, so sub-millisecond scenarios don't fail on timer noise.
+latency_slack_ms = 1.0
+
+
+class BenchUser:
+    def __init__(self, user_id, name) -> None:
+        self.id = user_id
+        self.name = name
+
+
+class BenchMessage:
+    def __init__(self, author, content) -> None:
+        self.author = author
+        self.content = content
+
+
+class BenchContext:
+    # The parts of commands.Context the cog's commands use.
+    def __init__(self, guild, channel, author, content='') -> None:
+        self.guild = guild
+        self.channel = channel
+        self.message = BenchMessage(author, content)
+        self.author = author
+        self.command = None
+        self.command_failed = False
+
+
+class BenchGuild:
+    def __init__(self, index, member_count) -> None:
+        # Spread across shards the same way real snowflakes would be.
+        self.guild = StubGuild((index + 1) << 22, f'bench-guild-{index}')
+        self.members = [BenchUser(index * 100000 + number + 1, f'bench-member-{index}-{number}')
+                        for number in range(member_count)]
+        self.channel_id = None
+
+    @property
+    def id(self) -> int:
+        return self.guild.id
+
+
+class ScenarioResult:
+    def __init__(self, name, latencies, errors, elapsed, queries) -> None:
+        self.name = name
+        self.latencies = sorted(latencies)
+        self.errors = errors
+        self.elapsed = elapsed
+        self.queries = queries
+
+    def percentile(self, percent) -> float:
+        if not self.latencies:
+            return 0.0
+        return self.latencies[min(len(self.latencies) - 1, int(round(percent / 100 * (len(self.latencies) - 1))))]
+
+    def as_dict(self) -> dict:
+        operations = len(self.latencies)
+        return {
+            'operations': operations,
+            'errors': self.errors,
+            'throughput': operations / self.elapsed if self.elapsed else 0.0,
+            'p50_ms': self.percentile(50) * 1000,
+            'p99_ms': self.percentile(99) * 1000,
+            'queries': self.queries,
+            'queries_per_operation': self.queries / operations if operations else 0.0,
+        }
+
+    def __repr__(self) -> str:
+        return f'ScenarioResult{{name={self.name},{self.as_dict()}}}'
+
+
+class Bench:
+    def __init__(self, cog, bot, concurrency) -> None:
+        self.cog = cog
+        self.bot = bot
+        self.concurrency = concurrency
+        self._channel_ids = iter(range(1, 1 << 40))
+
+    def new_channel(self, guild) -> None:
+        # Each scenario gets fresh channels, so nothing left running by the last one gets in the way.
+        guild.channel_id = next(self._channel_ids)
+
+    async def command(self, name, guild, user, *args) -> float:
+        ctx = BenchContext(guild.guild, self.bot.get_channel(guild.channel_id), user, f'!{name}')
+        started_at = time.perf_counter()
+        await getattr(self.cog, name).callback(self.cog, ctx, *args)
+        return time.perf_counter() - started_at
+
+    def fast_forward(self, kind, entity_id) -> bool:
+        # Compresses time: the pending phase of the sprint or Spr*ntathon fires now rather than at its deadline.
+        entry = self.cog.scheduler.get((kind, entity_id))
+        if entry is None:
+            return False
+        self.cog.scheduler.schedule(entry.key, time.time(), entry.callback, *entry.args)
+        return True
+
+    def pending_phase(self, kind, entity_id):
+        entry = self.cog.scheduler.get((kind, entity_id))
+        return entry.args[2] if entry is not None else None
+
+    @staticmethod
+    async def wait_until(predicate, timeout=30.0) -> None:
+        deadline = time.monotonic() + timeout
+        while not predicate():
+            if time.monotonic() > deadline:
+                raise TimeoutError('Timed out waiting on the bot.')
+            await asyncio.sleep(0.001)
+
+    async def run_all(self, operations) -> tuple:
+        # Runs every operation, at most concurrency at a time, returning their latencies and how many failed.
+        semaphore = asyncio.Semaphore(self.concurrency)
+        latencies = []
+        errors = 0
+
+        async def run(operation):
+            nonlocal errors
+            async with semaphore:
+                try:
+                    latencies.append(await operation())
+                except Exception:
+                    errors += 1
+                    logging.getLogger('sprintathon.bench').exception('Operation failed.')
+
+        await asyncio.gather(*[run(operation) for operation in operations])
+        return latencies, errors
+
+    async def checkin_all(self, guild, word_counts) -> list:
+        latencies, errors = await self.run_all([
+            lambda user=user, word_count=word_count: self.command('sprint', guild, user, str(word_count))
+            for user, word_count in zip(guild.members, word_counts)])
+        if errors:
+            raise RuntimeError(f'{errors} check-ins failed in {guild.guild}.')
+        return latencies
+
+    async def sprint_lifecycle(self, guild) -> None:
+        # A whole sprint: start it, every member checks in, the timer ends it, every member checks in again, and the
+        # grace period ends with the results being posted. Each timer fires as soon as the bot gets to it.
+        await self.command('start_sprint', guild, guild.members[0], 15)
+        sprint_id = self.cog.registry.get_sprint(guild.id, guild.channel_id).sprint.id
+        await self.checkin_all(guild, [1000 * number for number in range(len(guild.members))])
+        self.fast_forward('SPRINT', sprint_id)
+        await self.wait_until(lambda: self.pending_phase('SPRINT', sprint_id) == 'CHECKIN_END')
+        await self.checkin_all(guild, [1000 * number + 250 + number for number in range(len(guild.members))])
+        self.fast_forward('SPRINT', sprint_id)
+        await self.wait_until(lambda: self.cog.registry.get_sprint_by_id(sprint_id) is None and
+                              self.pending_phase('SPRINT', sprint_id) is None)
+
+
+async def checkin(bench, guilds, rounds) -> tuple:
+    # Check-in throughput: every member of every guild checks into a running sprint, rounds times.
+    for guild in guilds:
+        bench.new_channel(guild)
+        await bench.command('start_sprint', guild, guild.members[0], 60)
+
+    started_at = time.perf_counter()
+    latencies, errors = await bench.run_all([
+        lambda guild=guild, user=user, number=number: bench.command('sprint', guild, user, str(number * 100))
+        for number in range(rounds) for guild in guilds for user in guild.members])
+    await bench.cog.dispatcher.flush()
+    elapsed = time.perf_counter() - started_at
+
+    for guild in guilds:
+        await bench.command('stop_sprint', guild, guild.members[0])
+    return latencies, errors, elapsed
+
+
+async def leaderboard(bench, guilds, rounds) -> tuple:
+    # Leaderboard reads: every member asks for the leaderboard of a running Spr*ntathon with a finished sprint behind
+    # it, alternating between their own view and the whole thing.
+    for guild in guilds:
+        bench.new_channel(guild)
+        await bench.command('start_sprintathon', guild, guild.members[0], 24)
+    await bench.run_all([lambda guild=guild: bench.sprint_lifecycle(guild) for guild in guilds])
+
+    started_at = time.perf_counter()
+    latencies, errors = await bench.run_all([
+        lambda guild=guild, user=user, view=('all' if (number + index) % 2 else ''):
+        bench.command('print_leaderboard', guild, user, view)
+        for number in range(rounds) for guild in guilds for index, user in enumerate(guild.members)])
+    await bench.cog.dispatcher.flush()
+    elapsed = time.perf_counter() - started_at
+
+    for guild in guilds:
+        await bench.command('stop_sprintathon', guild, guild.members[0])
+    return latencies, errors, elapsed
+
+
+async def lifecycle(bench, guilds, rounds) -> tuple:
+    # End-to-end sprints: each operation is one guild's whole sprint, run concurrently across guilds, inside a
+    # Spr*ntathon which ends (with its final leaderboard) once they're done.
+    sprintathon_ids = dict()
+    for guild in guilds:
+        bench.new_channel(guild)
+        await bench.command('start_sprintathon', guild, guild.members[0], 1)
+        sprintathon_ids[guild] = bench.cog.registry.get_sprintathon(guild.id, guild.channel_id).id
+
+    started_at = time.perf_counter()
+
+    async def run(guild):
+        operation_started_at = time.perf_counter()
+        for _ in range(rounds):
+            await bench.sprint_lifecycle(guild)
+        return time.perf_counter() - operation_started_at
+
+    latencies, errors = await bench.run_all([lambda guild=guild: run(guild) for guild in guilds])
+    for sprintathon_id in sprintathon_ids.values():
+        bench.fast_forward('SPRINTATHON', sprintathon_id)
+    await bench.wait_until(lambda: all(bench.cog.registry.get_sprintathon_by_id(sprintathon_id) is None
+                                       for sprintathon_id in sprintathon_ids.values()))
+    await bench.cog.dispatcher.flush()
+    elapsed = time.perf_counter() - started_at
+    return latencies, errors, elapsed
+
+
+def _query_count() -> int:
+    return sum(query.stats.calls for query in registry.queries())
+
+
+def _create_database(dsn) -> tuple:
+    # A throwaway database on the given server, so runs never see each other's (or anyone else's) data.
+    name = f'sprintathon_bench_{os.getpid()}'
+    connection = psycopg2.connect(dsn)
+    connection.autocommit = True
+    with connection.cursor() as cursor:
+        cursor.execute(f'CREATE DATABASE {name}')
+    connection.close()
+    return name, psycopg2.extensions.make_dsn(dsn, dbname=name)
+
+
+def _drop_database(dsn, name) -> None:
+    connection = psycopg2.connect(dsn)
+    connection.autocommit = True
+    with connection.cursor() as cursor:
+        cursor.execute(f'DROP DATABASE IF EXISTS {name}')
+    connection.close()
+
+
+async def run_scenarios(args) -> list:
+    bot = StubBot()
+    guilds = [BenchGuild(index, args.members) for index in range(args.guilds)]
+    bot.guilds = [guild.guild for guild in guilds]
+    database = Database(main.pool)
+    submission_buffer = None
+    if args.write_behind:
+        submission_buffer = SubmissionBuffer(database)
+    cog = SprintathonBot(bot, database, CommandRouter(False, [], []), 'bench', submission_buffer,
+                         args.leaderboard_rate_limit)
+    bot.add_cog(cog)
+    await cog.on_ready()
+
+    bench = Bench(cog, bot, args.concurrency)
+    functions = {'checkin': checkin, 'leaderboard': leaderboard, 'lifecycle': lifecycle}
+    results = []
+    try:
+        for name in args.scenarios:
+            # The best of several runs, as it's the least disturbed by whatever else the machine is doing.
+            best = None
+            for _ in range(args.repeat):
+                queries_before = _query_count()
+                latencies, errors, elapsed = await functions[name](bench, guilds, args.rounds)
+                result = ScenarioResult(name, latencies, errors, elapsed, _query_count() - queries_before)
+                if best is None or result.as_dict()['throughput'] > best.as_dict()['throughput']:
+                    best = result
+            results.append(best)
+    finally:
+        cog.scheduler.stop()
+        database.executor.shutdown(wait=True)
+    return results
+
+
+def _settings(args) -> dict:
+    return {'guilds': args.guilds, 'members': args.members, 'rounds': args.rounds, 'concurrency': args.concurrency,
+            'repeat': args.repeat, 'pool_size': args.pool_size, 'write_behind': args.write_behind,
+            'leaderboard_rate_limit': args.leaderboard_rate_limit}
+
+
+def compare(results, baseline, tolerance) -> list:
+    # Anything more than tolerance worse than the baseline is a regression, and so is a scenario with no baseline.
+    regressions = []
+    for result in results:
+        expected = baseline.get(result.name)
+        if expected is None:
+            regressions.append(f'{result.name}: no baseline, run with --save-baseline to create one')
+            continue
+        actual = result.as_dict()
+        if actual['throughput'] < expected['throughput'] * (1 - tolerance):
+            regressions.append(f'{result.name}: throughput {actual["throughput"]:.1f}/s, baseline '
+                               f'{expected["throughput"]:.1f}/s')
+        for key, slack in (('p50_ms', latency_slack_ms), ('p99_ms', latency_slack_ms), ('queries_per_operation', 0)):
+            if actual[key] > expected[key] * (1 + tolerance) + slack:
+                regressions.append(f'{result.name}: {key} {actual[key]:.2f}, baseline {expected[key]:.2f}')
+        if actual['errors'] > expected['errors']:
+            regressions.append(f'{result.name}: {actual["errors"]} errors, baseline {expected["errors"]}')
+    return regressions
+
+
+def bench():
+    parser = argparse.ArgumentParser(description='Spr*ntathon load-testing benchmarks.')
+    parser.add_argument('--dsn', default=None,
+                        help='Postgres server to create the throwaway database on, or sqlite://<path> '
+                             '(default: $SPRINTATHON_BENCH_DSN, then $SPRINTATHON_PGSQL_CONNECTION_STRING)')
+    parser.add_argument('--scenarios', nargs='+', choices=scenarios, default=scenarios)
+    parser.add_argument('--guilds', type=int, default=10)
+    parser.add_argument('--members', type=int, default=20, help='members per guild')
+    parser.add_argument('--rounds', type=int, default=3, help='times each member repeats the operation')
+    parser.add_argument('--concurrency', type=int, default=50, help='operations in flight at once')
+    parser.add_argument('--repeat', type=int, default=3, help='runs of each scenario, keeping the best')
+    parser.add_argument('--pool-size', type=int, default=10)
+    parser.add_argument('--write-behind', action='store_true', help='buffer check-ins with SubmissionBuffer')
+    parser.add_argument('--leaderboard-rate-limit', type=float, default=0.0,
+                        help='seconds to coalesce repeated !leaderboard requests for (default: off)')
+    parser.add_argument('--baseline', default=default_baseline)
+    parser.add_argument('--save-baseline', action='store_true', help='write these results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='fraction a result may be worse than the baseline before failing')
+    args = parser.parse_args()
+
+    load_dotenv()
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    dsn = args.dsn or os.environ.get('SPRINTATHON_BENCH_DSN') or \
+        os.environ.get('SPRINTATHON_PGSQL_CONNECTION_STRING')
+    if not dsn:
+        parser.error('no database given, use --dsn or set SPRINTATHON_BENCH_DSN')
+
+    MemberRepository.cache = TTLCache(4096, 300)
+    ServerRepository.cache = TTLCache(4096, 300)
+    ServerRepository.members_cache = TTLCache(4096 * 16, 300)
+    SprintathonRepository.leaderboard_cache.clear()
+
+    # SQLite databases are used as they are, so give it :memory: for a clean one.
+    name, bench_dsn = (None, dsn) if dsn.startswith(SQLITE_PREFIX) else _create_database(dsn)
+    try:
+        if not main.initialize_database(bench_dsn, min_size=1, max_size=args.pool_size):
+            print('Failed to migrate the benchmark database.', file=sys.stderr)
+            return 1
+        engine = main.pool.engine.name
+        try:
+            results = asyncio.run(run_scenarios(args))
+        finally:
+            main.pool.close()
+    finally:
+        if name is not None:
+            _drop_database(dsn, name)
+
+    print(f'{"scenario":<12} {"ops":>7} {"errors":>6} {"ops/s":>9} {"p50 ms":>9} {"p99 ms":>9} {"queries":>9} '
+          f'{"q/op":>6}')
+    for result in results:
+        row = result.as_dict()
+        print(f'{result.name:<12} {row["operations"]:>7} {row["errors"]:>6} {row["throughput"]:>9.1f} '
+              f'{row["p50_ms"]:>9.2f} {row["p99_ms"]:>9.2f} {row["queries"]:>9} {row["queries_per_operation"]:>6.2f}')
+
+    baseline = dict()
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+    expected = baseline.get(engine)
+
+    if args.save_baseline:
+        if expected is None or expected['settings'] != _settings(args):
+            # Results run with other settings can't be kept alongside these.
+            expected = baseline[engine] = {'settings': _settings(args), 'scenarios': dict()}
+        expected['scenarios'].update({result.name: result.as_dict() for result in results})
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump(baseline, baseline_file, indent=2, sort_keys=True)
+            baseline_file.write('\n')
+        print(f'Saved {engine} baseline to {args.baseline}.')
+        return 0
+
+    if expected is None:
+        print(f'No {engine} baseline in {args.baseline}, run with --save-baseline to create one.', file=sys.stderr)
+        return 1
+    if expected['settings'] != _settings(args):
+        print(f'The {engine} baseline in {args.baseline} was run with {expected["settings"]}, not '
+              f'{_settings(args)}, so the results can\'t be compared.', file=sys.stderr)
+        return 1
+    regressions = compare(results, expected['scenarios'], args.tolerance)
+    for regression in regressions:
+        print(f'REGRESSION {regression}', file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(bench())
@@ -0,0 +1,276 @@
+import asyncio
+import functools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+
+class PoolError(Exception):
+    pass
+
+
+class PoolTimeout(PoolError):
+    pass
+
+
+class PoolStats:
+    def __init__(self) -> None:
+        self.checkouts = 0
+        self.checkout_wait_total = 0.0
+        self.checkout_wait_max = 0.0
+        self.timeouts = 0
+        self.connects = 0
+        self.reconnects = 0
+        self.health_check_failures = 0
+
+    def record_checkout(self, wait) -> None:
+        self.checkouts += 1
+        self.checkout_wait_total += wait
+        self.checkout_wait_max = max(self.checkout_wait_max, wait)
+
+    def as_dict(self) -> dict:
+        return {
+            'checkouts': self.checkouts,
+            'checkout_wait_total': self.checkout_wait_total,
+            'checkout_wait_avg': self.checkout_wait_total / self.checkouts if self.checkouts else 0.0,
+            'checkout_wait_max': self.checkout_wait_max,
+            'timeouts': self.timeouts,
+            'connects': self.connects,
+            'reconnects': self.reconnects,
+            'health_check_failures': self.health_check_failures,
+        }
+
+    def __repr__(self) -> str:
+        return f'PoolStats{self.as_dict()}'
+
+
+class ConnectionPool:
+    def __init__(self, engine, min_size=1, max_size=10, checkout_timeout=30.0, health_check_interval=60.0,
+                 reconnect_attempts=5, reconnect_delay=1.0) -> None:
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError(f'Invalid pool size min_size={min_size}, max_size={max_size}.')
+        self.logger = logging.getLogger('sprintathon.ConnectionPool')
+        # The storage.StorageEngine connections are opened with.
+        self.engine = engine
+        if engine.max_connections is not None and max_size > engine.max_connections:
+            self.logger.info('%s allows at most %i connection(s), shrinking the pool from %i.', engine,
+                             engine.max_connections, max_size)
+            max_size = engine.max_connections
+            min_size = min(min_size, max_size)
+        self.min_size = min_size
+        self.max_size = max_size
+        self.checkout_timeout = checkout_timeout
+        self.health_check_interval = health_check_interval
+        self.reconnect_attempts = reconnect_attempts
+        self.reconnect_delay = reconnect_delay
+        self.stats = PoolStats()
+        self._condition = threading.Condition()
+        # Idle connections, paired with the monotonic time they were last known to be healthy.
+        self._idle = []
+        self._size = 0
+        self._closed = False
+        self._local = threading.local()
+
+        for _ in range(self.min_size):
+            self._idle.append((self._connect(), time.monotonic()))
+            self._size += 1
+
+    def _connect(self):
+        attempt = 0
+        while True:
+            try:
+                connection = self.engine.connect()
+                self.stats.connects += 1
+                return connection
+            except self.engine.connection_errors as e:
+                attempt += 1
+                if attempt >= self.reconnect_attempts:
+                    raise
+                delay = self.reconnect_delay * 2 ** (attempt - 1)
+                self.logger.warning('Failed to connect to database (attempt %i of %i), retrying in %.1fs: %r',
+                                    attempt, self.reconnect_attempts, delay, e)
+                time.sleep(delay)
+
+    def _is_healthy(self, connection, last_used) -> bool:
+        if connection.closed:
+            return False
+        if time.monotonic() - last_used < self.health_check_interval:
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            connection.rollback()
+            return True
+        except self.engine.error as e:
+            self.logger.warning('Pooled connection failed its health check: %r', e)
+            return False
+
+    def getconn(self, timeout=None):
+        if timeout is None:
+            timeout = self.checkout_timeout
+        requested_at = time.monotonic()
+        deadline = requested_at + timeout
+        with self._condition:
+            while True:
+                if self._closed:
+                    raise PoolError('Attempted to check out a connection from a closed pool.')
+                if self._idle:
+                    connection, last_used = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    # Reserve the slot now, and open the connection outside of the lock.
+                    self._size += 1
+                    connection, last_used = None, None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.stats.timeouts += 1
+                    raise PoolTimeout(f'Timed out after {timeout}s waiting for a database connection '
+                                      f'({self._size} of {self.max_size} in use).')
+                self._condition.wait(remaining)
+
+        try:
+            if connection is None:
+                connection = self._connect()
+            elif not self._is_healthy(connection, last_used):
+                self.stats.health_check_failures += 1
+                self.stats.reconnects += 1
+                self._close_quietly(connection)
+                connection = self._connect()
+        except Exception:
+            with self._condition:
+                self._size -= 1
+                self._condition.notify()
+            raise
+
+        with self._condition:
+            self.stats.record_checkout(time.monotonic() - requested_at)
+        return connection
+
+    def putconn(self, connection, discard=False) -> None:
+        if not discard and not connection.closed:
+            try:
+                if self.engine.in_transaction(connection):
+                    connection.rollback()
+            except self.engine.error:
+                discard = True
+        if discard or connection.closed or self._closed:
+            self._close_quietly(connection)
+            with self._condition:
+                self._size -= 1
+                self._condition.notify()
+            return
+        with self._condition:
+            self._idle.append((connection, time.monotonic()))
+            self._condition.notify()
+
+    @contextmanager
+    def connection(self):
+        # Re-entrant per thread, so nested model calls share the same connection (and transaction).
+        bound = getattr(self._local, 'connection', None)
+        if bound is not None:
+            self._local.depth += 1
+            try:
+                yield bound
+            finally:
+                self._local.depth -= 1
+            return
+
+        connection = self.getconn()
+        self._local.connection = connection
+        self._local.depth = 1
+        discard = False
+        try:
+            yield connection
+        except Exception as e:
+            if self.engine.is_disconnect(e):
+                discard = True
+            elif not connection.closed:
+                connection.rollback()
+            raise
+        finally:
+            self._local.connection = None
+            self._local.depth = 0
+            self.putconn(connection, discard=discard or connection.closed)
+
+    def _bound(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            raise PoolError('No database connection is checked out on this thread; wrap database access in '
+                            'ConnectionPool.connection() or Database.run().')
+        return connection
+
+    # The pool stands in for a database connection on every Dbo, delegating to whichever connection is checked out on
+    # the calling thread.
+    def cursor(self, *args, **kwargs):
+        return self._bound().cursor(*args, **kwargs)
+
+    def commit(self) -> None:
+        self._bound().commit()
+
+    def rollback(self) -> None:
+        self._bound().rollback()
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    @property
+    def idle(self) -> int:
+        return len(self._idle)
+
+    def close(self) -> None:
+        with self._condition:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._condition.notify_all()
+        for connection, _ in idle:
+            self._close_quietly(connection)
+        self.logger.debug('Connection pool closed. %s', self.stats)
+
+    def _close_quietly(self, connection) -> None:
+        try:
+            connection.close()
+        except self.engine.error:
+            pass
+
+
+class Database:
+    def __init__(self, connection, max_workers=None, metrics=None) -> None:
+        self.logger = logging.getLogger('sprintathon.Database')
+        self.connection = connection
+        # One worker per pooled connection, so concurrent guilds can run their queries in parallel.
+        if max_workers is None:
+            max_workers = connection.max_size
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='sprintathon-db')
+        # Chosen once here, so unmeasured calls don't pay for a check on every run().
+        self._call = self._run_with_connection
+        if metrics is not None:
+            self._call_seconds = metrics.histogram('sprintathon_db_call_duration_seconds',
+                                                   'Time spent running each model method on a database worker, '
+                                                   'including the connection checkout.', ['method'])
+            self._call = self._run_measured
+
+    def _run_with_connection(self, function, *args, **kwargs):
+        with self.connection.connection():
+            return function(*args, **kwargs)
+
+    def _run_measured(self, function, *args, **kwargs):
+        started_at = time.perf_counter()
+        try:
+            return self._run_with_connection(function, *args, **kwargs)
+        finally:
+            self._call_seconds.observe(time.perf_counter() - started_at,
+                                       getattr(function, '__qualname__', type(function).__name__))
+
+    async def run(self, function, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(self._call, function, *args, **kwargs))
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=True)
+        self.logger.debug('Database executor shut down.')
+        self.connection.close()
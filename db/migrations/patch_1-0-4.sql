@@ -0,0 +1,50 @@
+-- sprintathon: no-transaction
+-- CREATE INDEX CONCURRENTLY can't run inside of a transaction block, so each statement in this file is run (and --
+--     committed) on its own. Every statement is idempotent, so a failed migration is just retried on the next --
+--     startup. If an index build fails part way through, Postgres leaves an INVALID index behind, which needs to be --
+--     dropped by hand before retrying. --
+
+-- Merge any MEMBER rows that were created more than once for the same Discord user, so that DISCORD_USER_ID can be --
+--     made UNIQUE. --
+UPDATE SUBMISSION SET MEMBER_ID = DUPLICATE.KEEP_ID
+    FROM (SELECT ID, MIN(ID) OVER (PARTITION BY DISCORD_USER_ID) AS KEEP_ID FROM MEMBER) AS DUPLICATE
+    WHERE SUBMISSION.MEMBER_ID = DUPLICATE.ID AND DUPLICATE.ID <> DUPLICATE.KEEP_ID;
+UPDATE SPRINT_MEMBER SET MEMBER_ID = DUPLICATE.KEEP_ID
+    FROM (SELECT ID, MIN(ID) OVER (PARTITION BY DISCORD_USER_ID) AS KEEP_ID FROM MEMBER) AS DUPLICATE
+    WHERE SPRINT_MEMBER.MEMBER_ID = DUPLICATE.ID AND DUPLICATE.ID <> DUPLICATE.KEEP_ID;
+UPDATE SERVER_MEMBER SET MEMBER_ID = DUPLICATE.KEEP_ID
+    FROM (SELECT ID, MIN(ID) OVER (PARTITION BY DISCORD_USER_ID) AS KEEP_ID FROM MEMBER) AS DUPLICATE
+    WHERE SERVER_MEMBER.MEMBER_ID = DUPLICATE.ID AND DUPLICATE.ID <> DUPLICATE.KEEP_ID;
+DELETE FROM MEMBER WHERE ID NOT IN (SELECT MIN(ID) FROM MEMBER GROUP BY DISCORD_USER_ID);
+
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS MEMBER_DISCORD_USER_ID_KEY ON MEMBER(DISCORD_USER_ID);
+-- Discord names aren't unique (and change over time), so MEMBER.NAME only gets a plain index. Members are looked up --
+--     by DISCORD_USER_ID instead. --
+CREATE INDEX CONCURRENTLY IF NOT EXISTS MEMBER_NAME_IDX ON MEMBER(NAME);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS SERVER_DISCORD_GUILD_ID_IDX ON SERVER(DISCORD_GUILD_ID, NAME);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS SUBMISSION_MEMBER_ID_DATETIME_IDX ON SUBMISSION(MEMBER_ID, DATETIME DESC);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS SPRINT_ACTIVE_SERVER_ID_DISCORD_CHANNEL_ID_IDX
+    ON SPRINT(SERVER_ID, DISCORD_CHANNEL_ID, START DESC) WHERE ACTIVE = TRUE;
+CREATE INDEX CONCURRENTLY IF NOT EXISTS SPRINT_SPRINTATHON_ID_IDX ON SPRINT(SPRINTATHON_ID);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS SPRINTATHON_ACTIVE_DISCORD_CHANNEL_ID_IDX
+    ON SPRINTATHON(DISCORD_CHANNEL_ID, START DESC) WHERE ACTIVE = TRUE;
+CREATE INDEX CONCURRENTLY IF NOT EXISTS SPRINTATHON_DISCORD_CHANNEL_ID_IDX
+    ON SPRINTATHON(DISCORD_CHANNEL_ID, START DESC);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS SPRINT_MEMBER_SPRINT_ID_IDX ON SPRINT_MEMBER(SPRINT_ID);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS SPRINT_MEMBER_MEMBER_ID_IDX ON SPRINT_MEMBER(MEMBER_ID);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS SERVER_MEMBER_SERVER_ID_IDX ON SERVER_MEMBER(SERVER_ID);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS SERVER_MEMBER_MEMBER_ID_IDX ON SERVER_MEMBER(MEMBER_ID);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS SPRINT_SUBMISSION_SPRINT_ID_IDX ON SPRINT_SUBMISSION(SPRINT_ID);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS SPRINT_SUBMISSION_SUBMISSION_ID_IDX ON SPRINT_SUBMISSION(SUBMISSION_ID);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS SPRINTATHON_SUBMISSION_SPRINTATHON_ID_IDX
+    ON SPRINTATHON_SUBMISSION(SPRINTATHON_ID);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS SPRINTATHON_SUBMISSION_SUBMISSION_ID_IDX
+    ON SPRINTATHON_SUBMISSION(SUBMISSION_ID);
+
+-- A single UPDATE, so there is never a moment where _VERSION is empty outside of a transaction. --
+UPDATE _VERSION SET MAJOR = 1, MINOR = 0, PATCH = 4;
@@ -0,0 +1,20 @@
+-- Remove duplicate membership rows (left behind by the old SELECT-then-INSERT race, or by merging duplicate members --
+--     in v1.0.4), so that the join tables can get composite primary keys. --
+DELETE FROM SPRINT_MEMBER WHERE SPRINT_ID IS NULL OR MEMBER_ID IS NULL;
+DELETE FROM SPRINT_MEMBER AS DUPLICATE USING SPRINT_MEMBER AS ORIGINAL
+    WHERE DUPLICATE.ctid > ORIGINAL.ctid AND DUPLICATE.SPRINT_ID = ORIGINAL.SPRINT_ID
+    AND DUPLICATE.MEMBER_ID = ORIGINAL.MEMBER_ID;
+ALTER TABLE SPRINT_MEMBER ADD PRIMARY KEY (SPRINT_ID, MEMBER_ID);
+-- Now covered by the primary key. --
+DROP INDEX IF EXISTS SPRINT_MEMBER_SPRINT_ID_IDX;
+
+DELETE FROM SERVER_MEMBER WHERE SERVER_ID IS NULL OR MEMBER_ID IS NULL;
+DELETE FROM SERVER_MEMBER AS DUPLICATE USING SERVER_MEMBER AS ORIGINAL
+    WHERE DUPLICATE.ctid > ORIGINAL.ctid AND DUPLICATE.SERVER_ID = ORIGINAL.SERVER_ID
+    AND DUPLICATE.MEMBER_ID = ORIGINAL.MEMBER_ID;
+ALTER TABLE SERVER_MEMBER ADD PRIMARY KEY (SERVER_ID, MEMBER_ID);
+-- Now covered by the primary key. --
+DROP INDEX IF EXISTS SERVER_MEMBER_SERVER_ID_IDX;
+
+DELETE FROM _VERSION;
+INSERT INTO _VERSION(MAJOR, MINOR, PATCH) VALUES(1, 0, 5);
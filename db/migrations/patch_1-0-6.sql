@@ -0,0 +1,26 @@
+-- The next phase (and when it fires) of every running sprint and Spr*ntathon, so that startup only needs to load the --
+--     jobs that are due soon, instead of reviving every ACTIVE row. KIND is SPRINT or SPRINTATHON, and PHASE is one --
+--     of END or CHECKIN_END for sprints, and WARNING or END for Spr*ntathons. --
+CREATE TABLE SCHEDULED_JOB(
+    ID SERIAL PRIMARY KEY,
+    KIND VARCHAR(32) NOT NULL,
+    ENTITY_ID INT NOT NULL,
+    PHASE VARCHAR(32) NOT NULL,
+    FIRE_AT TIMESTAMP WITH TIME ZONE NOT NULL,
+    UNIQUE (KIND, ENTITY_ID)
+);
+
+CREATE INDEX SCHEDULED_JOB_FIRE_AT_IDX ON SCHEDULED_JOB(FIRE_AT);
+
+-- Backfill jobs for everything that is running right now. --
+INSERT INTO SCHEDULED_JOB(KIND, ENTITY_ID, PHASE, FIRE_AT)
+    SELECT 'SPRINT', ID, 'END', START + DURATION FROM SPRINT WHERE ACTIVE = TRUE;
+INSERT INTO SCHEDULED_JOB(KIND, ENTITY_ID, PHASE, FIRE_AT)
+    SELECT 'SPRINTATHON', ID,
+           CASE WHEN START + DURATION - INTERVAL '1 hour' > NOW() THEN 'WARNING' ELSE 'END' END,
+           CASE WHEN START + DURATION - INTERVAL '1 hour' > NOW() THEN START + DURATION - INTERVAL '1 hour'
+                ELSE START + DURATION END
+    FROM SPRINTATHON WHERE ACTIVE = TRUE;
+
+DELETE FROM _VERSION;
+INSERT INTO _VERSION(MAJOR, MINOR, PATCH) VALUES(1, 0, 6);
@@ -0,0 +1,96 @@
+-- Running DELTA and BONUS word counts of each member of each Spr*ntathon, so leaderboards are a primary key lookup --
+--     per member instead of summing every submission the Spr*ntathon has ever had. Kept up to date by the triggers --
+--     below, and can be rebuilt from SPRINTATHON_SUBMISSION with REBUILD_SPRINTATHON_MEMBER_TOTALS(). --
+CREATE TABLE SPRINTATHON_MEMBER_TOTALS(
+    SPRINTATHON_ID INTEGER REFERENCES SPRINTATHON(ID),
+    MEMBER_ID INTEGER REFERENCES MEMBER(ID),
+    WORD_COUNT BIGINT NOT NULL DEFAULT 0,
+    BONUS_WORD_COUNT BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (SPRINTATHON_ID, MEMBER_ID)
+);
+
+-- Adds a submission's word count to (or with a sign of -1, removes it from) a member's totals. --
+CREATE FUNCTION APPLY_SPRINTATHON_MEMBER_TOTALS(P_SPRINTATHON_ID INTEGER, P_MEMBER_ID INTEGER,
+                                                P_TYPE SUBMISSION_TYPE, P_WORD_COUNT INTEGER, P_SIGN INTEGER)
+    RETURNS VOID AS $$
+BEGIN
+    IF P_TYPE NOT IN ('DELTA', 'BONUS') OR P_SPRINTATHON_ID IS NULL OR P_MEMBER_ID IS NULL THEN
+        RETURN;
+    END IF;
+    INSERT INTO SPRINTATHON_MEMBER_TOTALS(SPRINTATHON_ID, MEMBER_ID, WORD_COUNT, BONUS_WORD_COUNT)
+        VALUES(P_SPRINTATHON_ID, P_MEMBER_ID,
+               CASE WHEN P_TYPE = 'DELTA' THEN P_SIGN * P_WORD_COUNT ELSE 0 END,
+               CASE WHEN P_TYPE = 'BONUS' THEN P_SIGN * P_WORD_COUNT ELSE 0 END)
+        ON CONFLICT (SPRINTATHON_ID, MEMBER_ID) DO UPDATE SET
+            WORD_COUNT = SPRINTATHON_MEMBER_TOTALS.WORD_COUNT + EXCLUDED.WORD_COUNT,
+            BONUS_WORD_COUNT = SPRINTATHON_MEMBER_TOTALS.BONUS_WORD_COUNT + EXCLUDED.BONUS_WORD_COUNT;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE FUNCTION SPRINTATHON_SUBMISSION_TOTALS_TRIGGER() RETURNS TRIGGER AS $$
+DECLARE
+    LINK SPRINTATHON_SUBMISSION;
+    LINKED SUBMISSION;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        LINK := OLD;
+    ELSE
+        LINK := NEW;
+    END IF;
+    SELECT * INTO LINKED FROM SUBMISSION WHERE ID = LINK.SUBMISSION_ID;
+    IF FOUND THEN
+        PERFORM APPLY_SPRINTATHON_MEMBER_TOTALS(LINK.SPRINTATHON_ID, LINKED.MEMBER_ID, LINKED.TYPE, LINKED.WORD_COUNT,
+                                                CASE WHEN TG_OP = 'DELETE' THEN -1 ELSE 1 END);
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER SPRINTATHON_SUBMISSION_TOTALS AFTER INSERT OR DELETE ON SPRINTATHON_SUBMISSION
+    FOR EACH ROW EXECUTE PROCEDURE SPRINTATHON_SUBMISSION_TOTALS_TRIGGER();
+
+-- Submissions already attached to a Spr*ntathon can still be edited through Submission.update(). --
+CREATE FUNCTION SUBMISSION_TOTALS_TRIGGER() RETURNS TRIGGER AS $$
+DECLARE
+    LINKED_SPRINTATHON_ID INTEGER;
+BEGIN
+    FOR LINKED_SPRINTATHON_ID IN
+        SELECT SPRINTATHON_ID FROM SPRINTATHON_SUBMISSION WHERE SUBMISSION_ID = NEW.ID
+    LOOP
+        PERFORM APPLY_SPRINTATHON_MEMBER_TOTALS(LINKED_SPRINTATHON_ID, OLD.MEMBER_ID, OLD.TYPE, OLD.WORD_COUNT, -1);
+        PERFORM APPLY_SPRINTATHON_MEMBER_TOTALS(LINKED_SPRINTATHON_ID, NEW.MEMBER_ID, NEW.TYPE, NEW.WORD_COUNT, 1);
+    END LOOP;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER SUBMISSION_TOTALS AFTER UPDATE OF MEMBER_ID, WORD_COUNT, TYPE ON SUBMISSION
+    FOR EACH ROW WHEN (OLD.MEMBER_ID IS DISTINCT FROM NEW.MEMBER_ID OR OLD.WORD_COUNT IS DISTINCT FROM NEW.WORD_COUNT
+                       OR OLD.TYPE IS DISTINCT FROM NEW.TYPE)
+    EXECUTE PROCEDURE SUBMISSION_TOTALS_TRIGGER();
+
+-- Recomputes the totals of one Spr*ntathon, or with NULL, of all of them. --
+CREATE FUNCTION REBUILD_SPRINTATHON_MEMBER_TOTALS(P_SPRINTATHON_ID INTEGER) RETURNS VOID AS $$
+BEGIN
+    -- Holds off new links and edits (but not reads) until the rebuild commits, so none of them are counted twice. --
+    LOCK TABLE SPRINTATHON_SUBMISSION, SUBMISSION IN SHARE MODE;
+    DELETE FROM SPRINTATHON_MEMBER_TOTALS
+        WHERE P_SPRINTATHON_ID IS NULL OR SPRINTATHON_ID = P_SPRINTATHON_ID;
+    INSERT INTO SPRINTATHON_MEMBER_TOTALS(SPRINTATHON_ID, MEMBER_ID, WORD_COUNT, BONUS_WORD_COUNT)
+        SELECT SPRINTATHON_SUBMISSION.SPRINTATHON_ID, SUBMISSION.MEMBER_ID,
+               COALESCE(SUM(SUBMISSION.WORD_COUNT) FILTER (WHERE SUBMISSION.TYPE = 'DELTA'), 0),
+               COALESCE(SUM(SUBMISSION.WORD_COUNT) FILTER (WHERE SUBMISSION.TYPE = 'BONUS'), 0)
+        FROM SPRINTATHON_SUBMISSION
+        INNER JOIN SUBMISSION ON SPRINTATHON_SUBMISSION.SUBMISSION_ID = SUBMISSION.ID
+        WHERE SUBMISSION.TYPE IN ('DELTA', 'BONUS') AND SUBMISSION.MEMBER_ID IS NOT NULL
+            AND SPRINTATHON_SUBMISSION.SPRINTATHON_ID IS NOT NULL
+            AND (P_SPRINTATHON_ID IS NULL OR SPRINTATHON_SUBMISSION.SPRINTATHON_ID = P_SPRINTATHON_ID)
+        GROUP BY SPRINTATHON_SUBMISSION.SPRINTATHON_ID, SUBMISSION.MEMBER_ID;
+END
+$$ LANGUAGE plpgsql;
+
+-- Backfill from every Spr*ntathon so far. --
+SELECT REBUILD_SPRINTATHON_MEMBER_TOTALS(NULL);
+
+DELETE FROM _VERSION;
+INSERT INTO _VERSION(MAJOR, MINOR, PATCH) VALUES(1, 0, 7);
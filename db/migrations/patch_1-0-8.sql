@@ -0,0 +1,44 @@
+-- Before 1.0.7, a member who had only checked in (START/FINISH) to a Spr*ntathon's sprints was still on its --
+--     leaderboard with 0 words, so every attached submission now gives its member a totals row, even if it adds --
+--     nothing to it. Detaching a START/FINISH submission leaves the row alone. --
+CREATE OR REPLACE FUNCTION APPLY_SPRINTATHON_MEMBER_TOTALS(P_SPRINTATHON_ID INTEGER, P_MEMBER_ID INTEGER,
+                                                           P_TYPE SUBMISSION_TYPE, P_WORD_COUNT INTEGER,
+                                                           P_SIGN INTEGER)
+    RETURNS VOID AS $$
+BEGIN
+    IF P_SPRINTATHON_ID IS NULL OR P_MEMBER_ID IS NULL OR (P_TYPE NOT IN ('DELTA', 'BONUS') AND P_SIGN < 0) THEN
+        RETURN;
+    END IF;
+    INSERT INTO SPRINTATHON_MEMBER_TOTALS(SPRINTATHON_ID, MEMBER_ID, WORD_COUNT, BONUS_WORD_COUNT)
+        VALUES(P_SPRINTATHON_ID, P_MEMBER_ID,
+               CASE WHEN P_TYPE = 'DELTA' THEN P_SIGN * P_WORD_COUNT ELSE 0 END,
+               CASE WHEN P_TYPE = 'BONUS' THEN P_SIGN * P_WORD_COUNT ELSE 0 END)
+        ON CONFLICT (SPRINTATHON_ID, MEMBER_ID) DO UPDATE SET
+            WORD_COUNT = SPRINTATHON_MEMBER_TOTALS.WORD_COUNT + EXCLUDED.WORD_COUNT,
+            BONUS_WORD_COUNT = SPRINTATHON_MEMBER_TOTALS.BONUS_WORD_COUNT + EXCLUDED.BONUS_WORD_COUNT;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION REBUILD_SPRINTATHON_MEMBER_TOTALS(P_SPRINTATHON_ID INTEGER) RETURNS VOID AS $$
+BEGIN
+    -- Holds off new links and edits (but not reads) until the rebuild commits, so none of them are counted twice. --
+    LOCK TABLE SPRINTATHON_SUBMISSION, SUBMISSION IN SHARE MODE;
+    DELETE FROM SPRINTATHON_MEMBER_TOTALS
+        WHERE P_SPRINTATHON_ID IS NULL OR SPRINTATHON_ID = P_SPRINTATHON_ID;
+    INSERT INTO SPRINTATHON_MEMBER_TOTALS(SPRINTATHON_ID, MEMBER_ID, WORD_COUNT, BONUS_WORD_COUNT)
+        SELECT SPRINTATHON_SUBMISSION.SPRINTATHON_ID, SUBMISSION.MEMBER_ID,
+               COALESCE(SUM(SUBMISSION.WORD_COUNT) FILTER (WHERE SUBMISSION.TYPE = 'DELTA'), 0),
+               COALESCE(SUM(SUBMISSION.WORD_COUNT) FILTER (WHERE SUBMISSION.TYPE = 'BONUS'), 0)
+        FROM SPRINTATHON_SUBMISSION
+        INNER JOIN SUBMISSION ON SPRINTATHON_SUBMISSION.SUBMISSION_ID = SUBMISSION.ID
+        WHERE SUBMISSION.MEMBER_ID IS NOT NULL AND SPRINTATHON_SUBMISSION.SPRINTATHON_ID IS NOT NULL
+            AND (P_SPRINTATHON_ID IS NULL OR SPRINTATHON_SUBMISSION.SPRINTATHON_ID = P_SPRINTATHON_ID)
+        GROUP BY SPRINTATHON_SUBMISSION.SPRINTATHON_ID, SUBMISSION.MEMBER_ID;
+END
+$$ LANGUAGE plpgsql;
+
+-- Adds the members who only checked in. --
+SELECT REBUILD_SPRINTATHON_MEMBER_TOTALS(NULL);
+
+DELETE FROM _VERSION;
+INSERT INTO _VERSION(MAJOR, MINOR, PATCH) VALUES(1, 0, 8);
@@ -0,0 +1,167 @@
+-- The SQLite equivalent of db/schema.sql with every migration up to the version inserted at the bottom applied. --
+--     Timestamps are stored as UTC ISO 8601 text, durations as seconds, and the declared types TIMESTAMPTZ, --
+--     INTERVAL and BOOLEAN are converted back to Python types by storage.SqliteEngine. --
+CREATE TABLE IF NOT EXISTS MEMBER(
+    ID INTEGER PRIMARY KEY,
+    NAME TEXT NOT NULL,
+    DISCORD_USER_ID BIGINT NOT NULL
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS MEMBER_DISCORD_USER_ID_KEY ON MEMBER(DISCORD_USER_ID);
+CREATE INDEX IF NOT EXISTS MEMBER_NAME_IDX ON MEMBER(NAME);
+
+CREATE TABLE IF NOT EXISTS SERVER(
+    ID INTEGER PRIMARY KEY,
+    NAME TEXT NOT NULL,
+    DISCORD_GUILD_ID BIGINT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS SERVER_DISCORD_GUILD_ID_IDX ON SERVER(DISCORD_GUILD_ID, NAME);
+
+CREATE TABLE IF NOT EXISTS SERVER_MEMBER(
+    SERVER_ID INTEGER REFERENCES SERVER(ID),
+    MEMBER_ID INTEGER REFERENCES MEMBER(ID),
+    PRIMARY KEY (SERVER_ID, MEMBER_ID)
+);
+
+CREATE INDEX IF NOT EXISTS SERVER_MEMBER_MEMBER_ID_IDX ON SERVER_MEMBER(MEMBER_ID);
+
+CREATE TABLE IF NOT EXISTS SUBMISSION(
+    ID INTEGER PRIMARY KEY,
+    MEMBER_ID INTEGER REFERENCES MEMBER(ID),
+    WORD_COUNT INTEGER NOT NULL,
+    TYPE TEXT NOT NULL CHECK (TYPE IN ('START', 'FINISH', 'DELTA', 'BONUS')),
+    DATETIME TIMESTAMPTZ
+);
+
+CREATE INDEX IF NOT EXISTS SUBMISSION_MEMBER_ID_DATETIME_IDX ON SUBMISSION(MEMBER_ID, DATETIME DESC);
+
+CREATE TABLE IF NOT EXISTS SPRINTATHON(
+    ID INTEGER PRIMARY KEY,
+    START TIMESTAMPTZ,
+    DURATION INTERVAL,
+    SERVER_ID INTEGER REFERENCES SERVER(ID),
+    ACTIVE BOOLEAN DEFAULT TRUE,
+    DISCORD_CHANNEL_ID BIGINT
+);
+
+CREATE INDEX IF NOT EXISTS SPRINTATHON_ACTIVE_DISCORD_CHANNEL_ID_IDX
+    ON SPRINTATHON(DISCORD_CHANNEL_ID, START DESC) WHERE ACTIVE = TRUE;
+CREATE INDEX IF NOT EXISTS SPRINTATHON_DISCORD_CHANNEL_ID_IDX ON SPRINTATHON(DISCORD_CHANNEL_ID, START DESC);
+
+CREATE TABLE IF NOT EXISTS SPRINT(
+    ID INTEGER PRIMARY KEY,
+    START TIMESTAMPTZ,
+    DURATION INTERVAL,
+    SERVER_ID INTEGER REFERENCES SERVER(ID),
+    ACTIVE BOOLEAN DEFAULT TRUE,
+    SPRINTATHON_ID INTEGER REFERENCES SPRINTATHON(ID),
+    DISCORD_CHANNEL_ID BIGINT
+);
+
+CREATE INDEX IF NOT EXISTS SPRINT_ACTIVE_SERVER_ID_DISCORD_CHANNEL_ID_IDX
+    ON SPRINT(SERVER_ID, DISCORD_CHANNEL_ID, START DESC) WHERE ACTIVE = TRUE;
+CREATE INDEX IF NOT EXISTS SPRINT_SPRINTATHON_ID_IDX ON SPRINT(SPRINTATHON_ID);
+
+CREATE TABLE IF NOT EXISTS SPRINT_MEMBER(
+    SPRINT_ID INTEGER REFERENCES SPRINT(ID),
+    MEMBER_ID INTEGER REFERENCES MEMBER(ID),
+    PRIMARY KEY (SPRINT_ID, MEMBER_ID)
+);
+
+CREATE INDEX IF NOT EXISTS SPRINT_MEMBER_MEMBER_ID_IDX ON SPRINT_MEMBER(MEMBER_ID);
+
+CREATE TABLE IF NOT EXISTS SPRINT_SUBMISSION(
+    SPRINT_ID INTEGER REFERENCES SPRINT(ID),
+    SUBMISSION_ID INTEGER REFERENCES SUBMISSION(ID)
+);
+
+CREATE INDEX IF NOT EXISTS SPRINT_SUBMISSION_SPRINT_ID_IDX ON SPRINT_SUBMISSION(SPRINT_ID);
+CREATE INDEX IF NOT EXISTS SPRINT_SUBMISSION_SUBMISSION_ID_IDX ON SPRINT_SUBMISSION(SUBMISSION_ID);
+
+CREATE TABLE IF NOT EXISTS SPRINTATHON_SUBMISSION(
+    SPRINTATHON_ID INTEGER REFERENCES SPRINTATHON(ID),
+    SUBMISSION_ID INTEGER REFERENCES SUBMISSION(ID)
+);
+
+CREATE INDEX IF NOT EXISTS SPRINTATHON_SUBMISSION_SPRINTATHON_ID_IDX ON SPRINTATHON_SUBMISSION(SPRINTATHON_ID);
+CREATE INDEX IF NOT EXISTS SPRINTATHON_SUBMISSION_SUBMISSION_ID_IDX ON SPRINTATHON_SUBMISSION(SUBMISSION_ID);
+
+CREATE TABLE IF NOT EXISTS SCHEDULED_JOB(
+    ID INTEGER PRIMARY KEY,
+    KIND VARCHAR(32) NOT NULL,
+    ENTITY_ID INTEGER NOT NULL,
+    PHASE VARCHAR(32) NOT NULL,
+    FIRE_AT TIMESTAMPTZ NOT NULL,
+    UNIQUE (KIND, ENTITY_ID)
+);
+
+CREATE INDEX IF NOT EXISTS SCHEDULED_JOB_FIRE_AT_IDX ON SCHEDULED_JOB(FIRE_AT);
+
+CREATE TABLE IF NOT EXISTS SPRINTATHON_MEMBER_TOTALS(
+    SPRINTATHON_ID INTEGER REFERENCES SPRINTATHON(ID),
+    MEMBER_ID INTEGER REFERENCES MEMBER(ID),
+    WORD_COUNT BIGINT NOT NULL DEFAULT 0,
+    BONUS_WORD_COUNT BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (SPRINTATHON_ID, MEMBER_ID)
+);
+
+-- The same bookkeeping as the plpgsql triggers in patch_1-0-7.sql and patch_1-0-8.sql, with --
+--     APPLY_SPRINTATHON_MEMBER_TOTALS() inlined, as SQLite triggers can't call functions of their own. --
+CREATE TRIGGER IF NOT EXISTS SPRINTATHON_SUBMISSION_TOTALS_INSERT AFTER INSERT ON SPRINTATHON_SUBMISSION
+BEGIN
+    INSERT INTO SPRINTATHON_MEMBER_TOTALS(SPRINTATHON_ID, MEMBER_ID, WORD_COUNT, BONUS_WORD_COUNT)
+        SELECT NEW.SPRINTATHON_ID, MEMBER_ID, CASE WHEN TYPE = 'DELTA' THEN WORD_COUNT ELSE 0 END,
+               CASE WHEN TYPE = 'BONUS' THEN WORD_COUNT ELSE 0 END
+        FROM SUBMISSION
+        WHERE ID = NEW.SUBMISSION_ID AND MEMBER_ID IS NOT NULL AND NEW.SPRINTATHON_ID IS NOT NULL
+        ON CONFLICT (SPRINTATHON_ID, MEMBER_ID) DO UPDATE SET
+            WORD_COUNT = WORD_COUNT + EXCLUDED.WORD_COUNT,
+            BONUS_WORD_COUNT = BONUS_WORD_COUNT + EXCLUDED.BONUS_WORD_COUNT;
+END;
+
+CREATE TRIGGER IF NOT EXISTS SPRINTATHON_SUBMISSION_TOTALS_DELETE AFTER DELETE ON SPRINTATHON_SUBMISSION
+BEGIN
+    INSERT INTO SPRINTATHON_MEMBER_TOTALS(SPRINTATHON_ID, MEMBER_ID, WORD_COUNT, BONUS_WORD_COUNT)
+        SELECT OLD.SPRINTATHON_ID, MEMBER_ID, CASE WHEN TYPE = 'DELTA' THEN -WORD_COUNT ELSE 0 END,
+               CASE WHEN TYPE = 'BONUS' THEN -WORD_COUNT ELSE 0 END
+        FROM SUBMISSION
+        WHERE ID = OLD.SUBMISSION_ID AND TYPE IN ('DELTA', 'BONUS') AND MEMBER_ID IS NOT NULL
+            AND OLD.SPRINTATHON_ID IS NOT NULL
+        ON CONFLICT (SPRINTATHON_ID, MEMBER_ID) DO UPDATE SET
+            WORD_COUNT = WORD_COUNT + EXCLUDED.WORD_COUNT,
+            BONUS_WORD_COUNT = BONUS_WORD_COUNT + EXCLUDED.BONUS_WORD_COUNT;
+END;
+
+CREATE TRIGGER IF NOT EXISTS SUBMISSION_TOTALS AFTER UPDATE OF MEMBER_ID, WORD_COUNT, TYPE ON SUBMISSION
+    WHEN OLD.MEMBER_ID IS NOT NEW.MEMBER_ID OR OLD.WORD_COUNT IS NOT NEW.WORD_COUNT OR OLD.TYPE IS NOT NEW.TYPE
+BEGIN
+    INSERT INTO SPRINTATHON_MEMBER_TOTALS(SPRINTATHON_ID, MEMBER_ID, WORD_COUNT, BONUS_WORD_COUNT)
+        SELECT SPRINTATHON_ID, OLD.MEMBER_ID, CASE WHEN OLD.TYPE = 'DELTA' THEN -OLD.WORD_COUNT ELSE 0 END,
+               CASE WHEN OLD.TYPE = 'BONUS' THEN -OLD.WORD_COUNT ELSE 0 END
+        FROM SPRINTATHON_SUBMISSION
+        WHERE SUBMISSION_ID = NEW.ID AND OLD.TYPE IN ('DELTA', 'BONUS') AND OLD.MEMBER_ID IS NOT NULL
+            AND SPRINTATHON_ID IS NOT NULL
+        ON CONFLICT (SPRINTATHON_ID, MEMBER_ID) DO UPDATE SET
+            WORD_COUNT = WORD_COUNT + EXCLUDED.WORD_COUNT,
+            BONUS_WORD_COUNT = BONUS_WORD_COUNT + EXCLUDED.BONUS_WORD_COUNT;
+    INSERT INTO SPRINTATHON_MEMBER_TOTALS(SPRINTATHON_ID, MEMBER_ID, WORD_COUNT, BONUS_WORD_COUNT)
+        SELECT SPRINTATHON_ID, NEW.MEMBER_ID, CASE WHEN NEW.TYPE = 'DELTA' THEN NEW.WORD_COUNT ELSE 0 END,
+               CASE WHEN NEW.TYPE = 'BONUS' THEN NEW.WORD_COUNT ELSE 0 END
+        FROM SPRINTATHON_SUBMISSION
+        WHERE SUBMISSION_ID = NEW.ID AND NEW.MEMBER_ID IS NOT NULL AND SPRINTATHON_ID IS NOT NULL
+        ON CONFLICT (SPRINTATHON_ID, MEMBER_ID) DO UPDATE SET
+            WORD_COUNT = WORD_COUNT + EXCLUDED.WORD_COUNT,
+            BONUS_WORD_COUNT = BONUS_WORD_COUNT + EXCLUDED.BONUS_WORD_COUNT;
+END;
+
+CREATE TABLE IF NOT EXISTS _VERSION(
+    MAJOR INTEGER,
+    MINOR INTEGER,
+    PATCH INTEGER
+);
+
+CREATE VIEW IF NOT EXISTS VERSION AS
+    SELECT _VERSION.MAJOR AS MAJOR, _VERSION.MINOR AS MINOR, _VERSION.PATCH AS PATCH FROM _VERSION LIMIT 1;
+
+INSERT INTO _VERSION(MAJOR, MINOR, PATCH) SELECT 1, 0, 8 WHERE NOT EXISTS (SELECT 1 FROM _VERSION);
@@ -1,15 +1,46 @@
 
 class Dbo:
-    connection = None
+    # Models are slotted records of their columns, and nothing else: they're read and written by their Repository, so
+    # they never hold a connection, and can be handed between the event loop and the database threads freely.
+    __slots__ = ()
+
+
+class UnloadedRelationError(LookupError):
+    # Raised on reading a related model that was only given by ID, instead of querying for it on whatever thread
+    # happens to ask. Repositories load them explicitly, e.g. SprintRepository.load_relations().
+    pass
+
+
+class Repository:
+    # Runs a model's queries on a connection: either one opened by a storage.StorageEngine, or a
+    # database.ConnectionPool, which delegates to the connection checked out by the calling thread. Only ever used on a
+    # database thread, e.g. through Database.run().
+    __slots__ = ('connection',)
 
     def __init__(self, connection) -> None:
         self.connection = connection
 
-    def create(self) -> int:
+    def create(self, entity) -> int:
         pass
 
-    def update(self) -> None:
+    def update(self, entity) -> None:
         pass
 
-    def delete(self) -> None:
+    def delete(self, entity) -> None:
         pass
+
+
+class IdentityMap:
+    # Shared while hydrating the results of one request, so each (type, ID) pair is only built once.
+    __slots__ = ('_objects',)
+
+    def __init__(self) -> None:
+        self._objects = dict()
+
+    def get_or_create(self, cls, _id, factory):
+        key = (cls, _id)
+        obj = self._objects.get(key)
+        if obj is None:
+            obj = factory()
+            self._objects[key] = obj
+        return obj
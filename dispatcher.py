@@ -0,0 +1,140 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+from messages import DISCORD_MESSAGE_LIMIT
+
+
+class OutboundMessage:
+    def __init__(self, channel_id, content, priority, sequence, coalesce=True) -> None:
+        self.channel_id = channel_id
+        self.content = content
+        self.priority = priority
+        self.sequence = sequence
+        # Whether it may be sent as part of one message with its neighbours.
+        self.coalesce = coalesce
+        self.enqueued_at = time.monotonic()
+
+    def __lt__(self, other) -> bool:
+        # Lower priorities go first, and messages of the same priority in the order they were queued.
+        return (self.priority, self.sequence) < (other.priority, other.sequence)
+
+    def __repr__(self) -> str:
+        return f'OutboundMessage{{channel_id={self.channel_id},priority={self.priority},length={len(self.content)}}}'
+
+
+class DispatcherStats:
+    def __init__(self) -> None:
+        self.queued = 0
+        self.sent = 0
+        self.coalesced = 0
+        self.failed = 0
+        self.depth = 0
+        self.max_depth = 0
+        self.delay_total = 0.0
+        self.delay_max = 0.0
+
+    def record_delay(self, delay) -> None:
+        self.delay_total += delay
+        self.delay_max = max(self.delay_max, delay)
+
+    def as_dict(self) -> dict:
+        delivered = self.sent + self.coalesced
+        return {
+            'queued': self.queued,
+            'sent': self.sent,
+            'coalesced': self.coalesced,
+            'failed': self.failed,
+            'depth': self.depth,
+            'max_depth': self.max_depth,
+            'delay_avg': self.delay_total / delivered if delivered else 0.0,
+            'delay_max': self.delay_max,
+        }
+
+    def __repr__(self) -> str:
+        return f'DispatcherStats{self.as_dict()}'
+
+
+class MessageDispatcher:
+    # Time-critical notices, like the end of a sprint, jump ahead of anything else queued for their channel.
+    PRIORITY_URGENT = 0
+    PRIORITY_NORMAL = 1
+
+    def __init__(self, bot, limit=DISCORD_MESSAGE_LIMIT) -> None:
+        self.logger = logging.getLogger('sprintathon.MessageDispatcher')
+        self.bot = bot
+        self.limit = limit
+        self.stats = DispatcherStats()
+        # Each channel with pending messages has a heap of them, drained by its own task, so a channel stuck behind
+        # Discord's rate limits never holds up the others, or whoever queued the messages.
+        self._queues = dict()
+        self._workers = dict()
+        self._sequence = itertools.count()
+
+    def send(self, channel_id, content, priority=PRIORITY_NORMAL, coalesce=True) -> None:
+        # Messages whose boundaries matter, like the separate messages of a MessageBuilder, are queued with
+        # coalesce=False, so they're always sent on their own.
+        if not content:
+            return
+        queue = self._queues.setdefault(channel_id, [])
+        heapq.heappush(queue, OutboundMessage(channel_id, content, priority, next(self._sequence), coalesce))
+        self.stats.queued += 1
+        self.stats.depth += 1
+        self.stats.max_depth = max(self.stats.max_depth, self.stats.depth)
+        if channel_id not in self._workers:
+            self._workers[channel_id] = asyncio.get_running_loop().create_task(self._drain(channel_id))
+
+    def depth(self, channel_id=None) -> int:
+        if channel_id is None:
+            return self.stats.depth
+        return len(self._queues.get(channel_id, ()))
+
+    def _next_batch(self, queue) -> tuple:
+        # Adjacent messages of the same priority are sent as one, as long as they fit in a single message and all of
+        # them allow it.
+        batch = [heapq.heappop(queue)]
+        content = batch[0].content
+        while batch[0].coalesce and queue and queue[0].coalesce and queue[0].priority == batch[0].priority:
+            separator = '' if content.endswith('\n') else '\n'
+            if len(content) + len(separator) + len(queue[0].content) > self.limit:
+                break
+            batch.append(heapq.heappop(queue))
+            content += separator + batch[-1].content
+        return batch, content
+
+    async def _drain(self, channel_id) -> None:
+        queue = self._queues[channel_id]
+        try:
+            while queue:
+                batch, content = self._next_batch(queue)
+                self.stats.depth -= len(batch)
+                channel = self.bot.get_channel(channel_id)
+                if channel is None:
+                    self.logger.warning('Dropping %i messages for unknown channel %s.', len(batch), channel_id)
+                    self.stats.failed += len(batch)
+                    continue
+                try:
+                    await channel.send(content)
+                except Exception:
+                    self.logger.exception('Failed to send %i messages to channel %s.', len(batch), channel_id)
+                    self.stats.failed += len(batch)
+                    continue
+                now = time.monotonic()
+                self.stats.sent += 1
+                self.stats.coalesced += len(batch) - 1
+                for message in batch:
+                    self.stats.record_delay(now - message.enqueued_at)
+        finally:
+            del self._workers[channel_id]
+            del self._queues[channel_id]
+            self.stats.depth -= len(queue)
+
+    async def flush(self) -> None:
+        # Waits until everything queued so far has been sent.
+        while self._workers:
+            await asyncio.gather(*self._workers.values(), return_exceptions=True)
+
+    def __repr__(self) -> str:
+        return f'MessageDispatcher{{channels={len(self._queues)},stats={self.stats}}}'
@@ -0,0 +1,123 @@
+import csv
+import datetime
+import io
+import json
+
+# The columns of each exported submission, in order.
+EXPORT_COLUMNS = ['id', 'type', 'word_count', 'datetime', 'sprint_id', 'sprint_minutes']
+EXPORT_FORMATS = ('csv', 'json')
+
+
+class HistoryStats:
+    # A member's lifetime stats, added up one SubmissionRepository.stream_history() row at a time, so they cost the same
+    # memory however long the history is. Only DELTA submissions count as words written in a sprint.
+    def __init__(self) -> None:
+        self.submissions = 0
+        self.sprints = 0
+        self.lifetime_words = 0
+        self.bonus_words = 0
+        self.best_sprint_words = None
+        self.best_sprint_at = None
+        self.longest_streak = 0
+        self._wpm_total = 0.0
+        self._wpm_count = 0
+        # The run of consecutive (UTC) days with a sprint, up to the last one seen.
+        self._streak = 0
+        self._last_day = None
+
+    def record(self, row) -> None:
+        _id, submission_type, word_count, submitted_at, sprint_id, duration = row
+        self.submissions += 1
+        if submission_type == 'BONUS':
+            self.bonus_words += word_count
+            return
+        if submission_type != 'DELTA':
+            return
+        self.sprints += 1
+        self.lifetime_words += word_count
+        if self.best_sprint_words is None or word_count > self.best_sprint_words:
+            self.best_sprint_words = word_count
+            self.best_sprint_at = submitted_at
+        if duration:
+            self._wpm_total += word_count / (duration.total_seconds() / 60)
+            self._wpm_count += 1
+        # Submissions from before v1.0.1 have no DATETIME, and can't be placed in a streak.
+        if submitted_at is not None:
+            day = submitted_at.astimezone(datetime.timezone.utc).date()
+            if self._last_day is None or day - self._last_day > datetime.timedelta(days=1):
+                self._streak = 1
+            elif day != self._last_day:
+                self._streak += 1
+            self._last_day = day
+            self.longest_streak = max(self.longest_streak, self._streak)
+
+    @property
+    def average_wpm(self) -> float:
+        return self._wpm_total / self._wpm_count if self._wpm_count else 0.0
+
+    def current_streak(self, today=None) -> int:
+        # A streak is still going until a whole day passes without a sprint.
+        if today is None:
+            today = datetime.datetime.now(datetime.timezone.utc).date()
+        if self._last_day is None or today - self._last_day > datetime.timedelta(days=1):
+            return 0
+        return self._streak
+
+    def as_dict(self) -> dict:
+        return {
+            'submissions': self.submissions,
+            'sprints': self.sprints,
+            'lifetime_words': self.lifetime_words,
+            'bonus_words': self.bonus_words,
+            'best_sprint_words': self.best_sprint_words,
+            'best_sprint_at': self.best_sprint_at,
+            'average_wpm': self.average_wpm,
+            'current_streak': self.current_streak(),
+            'longest_streak': self.longest_streak,
+        }
+
+    def __repr__(self) -> str:
+        return f'HistoryStats{self.as_dict()}'
+
+
+def member_stats(submissions, member, batch_size=500) -> HistoryStats:
+    stats = HistoryStats()
+    for rows in submissions.stream_history(member, batch_size):
+        for row in rows:
+            stats.record(row)
+    return stats
+
+
+def _export_row(row) -> list:
+    _id, submission_type, word_count, submitted_at, sprint_id, duration = row
+    return [_id, submission_type, word_count, submitted_at.isoformat() if submitted_at is not None else None,
+            sprint_id, int(duration.total_seconds() // 60) if duration is not None else None]
+
+
+def export_history(submissions, member, export_format, file, batch_size=500) -> int:
+    # Writes the member's whole history to file (opened in binary mode) as CSV or as a JSON array, a batch at a time,
+    # and returns how many submissions were written. Runs on a database thread, like the
+    # repository itself.
+    count = 0
+    if export_format == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_COLUMNS)
+        for rows in submissions.stream_history(member, batch_size):
+            writer.writerows(_export_row(row) for row in rows)
+            count += len(rows)
+            file.write(buffer.getvalue().encode())
+            buffer.seek(0)
+            buffer.truncate()
+        file.write(buffer.getvalue().encode())
+    elif export_format == 'json':
+        file.write(b'[')
+        for rows in submissions.stream_history(member, batch_size):
+            for row in rows:
+                file.write(b',\n' if count else b'\n')
+                file.write(json.dumps(dict(zip(EXPORT_COLUMNS, _export_row(row)))).encode())
+                count += 1
+        file.write(b'\n]\n')
+    else:
+        raise ValueError(f'Unknown export format {export_format}.')
+    return count
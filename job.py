@@ -0,0 +1,75 @@
+import logging
+
+from dbo import Dbo, Repository
+from queries import registry
+
+
+class Job(Dbo):
+    __slots__ = ('id', 'kind', 'entity_id', 'phase', 'fire_at', 'discord_guild_id')
+
+    def __init__(self, _id=None, kind='', entity_id=None, phase='', fire_at=None, discord_guild_id=None) -> None:
+        self.id = _id
+        self.kind = kind
+        self.entity_id = entity_id
+        self.phase = phase
+        self.fire_at = fire_at
+        # Not stored with the job, but looked up from its sprint's or Spr*ntathon's server by find_due().
+        self.discord_guild_id = discord_guild_id
+
+    def __repr__(self) -> str:
+        return f'Job{{id={self.id},kind={self.kind},entity_id={self.entity_id},phase={self.phase},' \
+               f'fire_at={self.fire_at}}}'
+
+
+class JobRepository(Repository):
+    __slots__ = ()
+    logger = logging.getLogger('sprintathon.JobRepository')
+
+    CREATE = registry.register('job_create',
+                               'INSERT INTO SCHEDULED_JOB(KIND, ENTITY_ID, PHASE, FIRE_AT) VALUES(%s, %s, %s, %s) '
+                               'ON CONFLICT (KIND, ENTITY_ID) DO UPDATE SET PHASE = EXCLUDED.PHASE, '
+                               'FIRE_AT = EXCLUDED.FIRE_AT RETURNING ID')
+    DELETE = registry.register('job_delete', 'DELETE FROM SCHEDULED_JOB WHERE KIND=%s AND ENTITY_ID=%s')
+    FIND_DUE = registry.register(
+        'job_find_due',
+        'SELECT SCHEDULED_JOB.ID, KIND, ENTITY_ID, PHASE, FIRE_AT, SERVER.DISCORD_GUILD_ID FROM SCHEDULED_JOB '
+        'LEFT JOIN SPRINT ON KIND=\'SPRINT\' AND SPRINT.ID=ENTITY_ID '
+        'LEFT JOIN SPRINTATHON ON KIND=\'SPRINTATHON\' AND SPRINTATHON.ID=ENTITY_ID '
+        'LEFT JOIN SERVER ON SERVER.ID=COALESCE(SPRINT.SERVER_ID, SPRINTATHON.SERVER_ID) '
+        'WHERE FIRE_AT <= %s ORDER BY FIRE_AT')
+    # Only the jobs for guilds on the given shards, using the same formula as router.shard_for_guild().
+    FIND_DUE_FOR_SHARDS = registry.register(
+        'job_find_due_for_shards',
+        'SELECT SCHEDULED_JOB.ID, KIND, ENTITY_ID, PHASE, FIRE_AT, SERVER.DISCORD_GUILD_ID FROM SCHEDULED_JOB '
+        'LEFT JOIN SPRINT ON KIND=\'SPRINT\' AND SPRINT.ID=ENTITY_ID '
+        'LEFT JOIN SPRINTATHON ON KIND=\'SPRINTATHON\' AND SPRINTATHON.ID=ENTITY_ID '
+        'LEFT JOIN SERVER ON SERVER.ID=COALESCE(SPRINT.SERVER_ID, SPRINTATHON.SERVER_ID) '
+        'WHERE FIRE_AT <= %s AND (COALESCE(SERVER.DISCORD_GUILD_ID, 0) >> 22) %% %s = ANY(%s) '
+        'ORDER BY FIRE_AT')
+
+    def create(self, job) -> int:
+        # Each sprint or Spr*ntathon only ever has one pending job, so scheduling its next phase replaces the last one.
+        with self.connection.cursor() as cursor:
+            JobRepository.CREATE.execute(cursor, [job.kind, job.entity_id, job.phase, job.fire_at])
+            job.id = cursor.fetchone()[0]
+            self.connection.commit()
+            self.logger.debug('Scheduling %s in database.', job)
+            return job.id
+
+    def update(self, job) -> None:
+        self.create(job)
+
+    def delete(self, job) -> None:
+        with self.connection.cursor() as cursor:
+            JobRepository.DELETE.execute(cursor, (job.kind, job.entity_id))
+            self.connection.commit()
+            self.logger.debug('Deleting %s from database.', job)
+
+    def find_due(self, before, shard_ids=None, shard_count=1):
+        with self.connection.cursor() as cursor:
+            if shard_count == 1:
+                JobRepository.FIND_DUE.execute(cursor, [before])
+            else:
+                JobRepository.FIND_DUE_FOR_SHARDS.execute(cursor, [before, shard_count, list(shard_ids)])
+            result = cursor.fetchall()
+            return [Job(item[0], item[1], item[2], item[3], item[4], item[5]) for item in result]
@@ -0,0 +1,77 @@
+import threading
+import time
+from collections import namedtuple
+
+from cache import TTLCache
+
+# entries is the ranked list of LeaderboardEntry returned by SprintathonRepository.get_leaderboard(), and messages its
+# rendered form, split to fit in Discord messages.
+CachedLeaderboard = namedtuple('CachedLeaderboard', ['generation', 'entries', 'messages'])
+
+
+class LeaderboardCache:
+    # Leaderboards keyed by SPRINTATHON.ID. Each Spr*ntathon has a generation, bumped whenever a submission is
+    # committed for it, and a leaderboard is only stored if its generation didn't change while it was being read, so a
+    # read racing a new submission can't cache stale totals.
+    def __init__(self, max_size=256, ttl=3600.0) -> None:
+        self._entries = TTLCache(max_size, ttl)
+        self._generations = dict()
+        self._lock = threading.Lock()
+
+    def generation(self, sprintathon_id) -> int:
+        with self._lock:
+            return self._generations.get(sprintathon_id, 0)
+
+    def get(self, sprintathon_id):
+        cached = self._entries.get(sprintathon_id)
+        if cached is None or cached.generation != self.generation(sprintathon_id):
+            return None
+        return cached
+
+    def set(self, sprintathon_id, generation, entries, messages) -> CachedLeaderboard:
+        cached = CachedLeaderboard(generation, entries, messages)
+        with self._lock:
+            if self._generations.get(sprintathon_id, 0) == generation:
+                self._entries.set(sprintathon_id, cached)
+        return cached
+
+    def invalidate(self, sprintathon_id) -> None:
+        with self._lock:
+            self._generations[sprintathon_id] = self._generations.get(sprintathon_id, 0) + 1
+        self._entries.invalidate(sprintathon_id)
+
+    def clear(self) -> None:
+        with self._lock:
+            for sprintathon_id in self._generations:
+                self._generations[sprintathon_id] += 1
+        self._entries.clear()
+
+    def __repr__(self) -> str:
+        return f'LeaderboardCache{{entries={self._entries}}}'
+
+
+class CoalescingRateLimiter:
+    # Lets one request per key through at a time, and drops repeats of it within interval seconds unless the version
+    # (e.g. a leaderboard generation) has changed since, as the response already posted still answers them.
+    def __init__(self, interval=10.0) -> None:
+        self.interval = interval
+        self.coalesced = 0
+        self._in_flight = set()
+        self._last = dict()
+
+    async def run(self, key, version, function) -> bool:
+        now = time.monotonic()
+        last = self._last.get(key)
+        if key in self._in_flight or (last is not None and last[1] == version and now - last[0] < self.interval):
+            self.coalesced += 1
+            return False
+        self._in_flight.add(key)
+        try:
+            await function()
+        finally:
+            self._in_flight.discard(key)
+            self._last[key] = (time.monotonic(), version)
+            if len(self._last) > 1024:
+                self._last = {item_key: item for item_key, item in self._last.items()
+                              if now - item[0] < self.interval}
+        return True
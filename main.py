@@ -1,3 +1,4 @@
+import argparse
 import logging
 import os
 import re
@@ -5,14 +6,30 @@ import re
 import psycopg2
 from dotenv import load_dotenv
 from discord.ext import commands
+
+from cache import TTLCache
+from database import ConnectionPool, Database
+from member import MemberRepository
+from metrics import Metrics, MetricsServer
+from queries import registry
+from router import CommandRouter, parse_guild_list, parse_shard_ids
+from sharding import ShardedRunner
+from server import ServerRepository
+from storage import create_engine
+from submission_buffer import SubmissionBuffer
+from sprintathon import SprintathonRepository
 from sprintathonbot import SprintathonBot
+from stub_gateway import StubBot
 
-connection = None
+pool = None
 
 debug_mode_enabled: bool
 
-__version__ = [1, 0, 3]
+__version__ = [1, 0, 8]
 migrations_directory = 'db/migrations'
+# Migrations starting with this line are run one statement at a time outside of a transaction, which is required for
+# statements like CREATE INDEX CONCURRENTLY.
+no_transaction_migration_marker = '-- sprintathon: no-transaction'
 
 
 def is_version_string_greater(a, b):
@@ -37,10 +54,41 @@ def is_version_string_greater(a, b):
     return False
 
 
-def initialize_database(connection_uri):
-    global connection
-    connection = psycopg2.connect(connection_uri)
+def split_sql_statements(sql):
+    lines = [line for line in sql.splitlines() if not line.strip().startswith('--')]
+    return [statement.strip() for statement in '\n'.join(lines).split(';') if statement.strip()]
+
+
+def apply_no_transaction_migration(connection, migration_file_sql):
+    # Everything migrated so far has to be committed first, as these statements can't share its transaction.
+    connection.commit()
+    connection.autocommit = True
+    try:
+        with connection.cursor() as cursor:
+            for statement in split_sql_statements(migration_file_sql):
+                cursor.execute(statement)
+    finally:
+        connection.autocommit = False
+
+
+def _create_pool(connection_uri, **pool_settings):
+    # Session-level prepared statements don't work behind a transaction-pooling proxy like PgBouncer.
+    engine = create_engine(connection_uri, os.environ.get('SPRINTATHON_PREPARED_STATEMENTS', 'True') == 'True')
+    registry.use(engine)
+    return ConnectionPool(engine, **pool_settings)
 
+
+def initialize_database(connection_uri, min_size=1, max_size=10, checkout_timeout=30.0):
+    global pool
+    pool = _create_pool(connection_uri, min_size=min_size, max_size=max_size, checkout_timeout=checkout_timeout)
+
+    with pool.connection() as connection:
+        if pool.engine.migrations:
+            return _migrate_database(connection)
+        return pool.engine.create_schema(connection, __version__)
+
+
+def _migrate_database(connection):
     with open('db/schema.sql') as schema_file:
         schema = schema_file.read()
 
@@ -67,19 +115,19 @@ def initialize_database(connection_uri):
         schema_version_dashed = schema_version.replace('.', '-')
 
         if is_version_string_greater(schema_version, target_version):
-            logger.warning(f'Attempting to run application v{target_version} on database schema v{schema_version}, '
-                           f'which is greater. Aborting migration.')
+            logger.warning('Attempting to run application v%s on database schema v%s, which is greater. Aborting '
+                           'migration.', target_version, schema_version)
             return False
 
         if schema_version == target_version:
-            logger.info(f'Schema version v{schema_version} is identical to application version v{target_version}. '
-                        f'No migrations to apply.')
+            logger.info('Schema version v%s is identical to application version v%s. No migrations to apply.',
+                        schema_version, target_version)
             return True
 
         if schema_is_blank:
-            logger.info(f'Migrating database schema from blank to v{target_version}.')
+            logger.info('Migrating database schema from blank to v%s.', target_version)
         else:
-            logger.info(f'Migrating database schema from v{schema_version} to v{target_version}.')
+            logger.info('Migrating database schema from v%s to v%s.', schema_version, target_version)
 
         migration_files = sorted(os.listdir(migrations_directory))
         try:
@@ -88,7 +136,7 @@ def initialize_database(connection_uri):
             else:
                 migration_file_list_start = migration_files.index(f'patch_{schema_version_dashed}.sql') + 1
             if migration_file_list_start >= len(migration_files):
-                logger.info(f'No migrations to apply.')
+                logger.info('No migrations to apply.')
                 return True
                 # I'm not sure I really want to make a migration for each version released, even if it is just to
                 # update _VERSION logger.error(f'Migration of database schema with version {schema_version} to {
@@ -98,39 +146,177 @@ def initialize_database(connection_uri):
             for migration_filename in migration_files[migration_file_list_start:]:
                 migration_filename_regex = re.search(r'patch_((\d+-){2}\d+)\.sql', migration_filename)
                 if not migration_filename_regex:
-                    logger.warning(f'Skipping invalid migration filename {migration_filename}.')
+                    logger.warning('Skipping invalid migration filename %s.', migration_filename)
                     continue
                 migration_version = migration_filename_regex.group(1).replace('-', '.')
                 if is_version_string_greater(migration_version, target_version):
-                    logger.info(f'Migration filename {migration_filename} (v{migration_version}) is greater than '
-                                f'target version {target_version}. Skipping migration file {migration_filename}.')
+                    logger.info('Migration filename %s (v%s) is greater than target version %s. Skipping migration '
+                                'file %s.', migration_filename, migration_version, target_version, migration_filename)
                     continue
                 try:
                     with open(f'{migrations_directory}/{migration_filename}') as migration_file:
                         migration_file_sql = migration_file.read()
-                        if len(migration_file_sql) > 0:
-                            cursor.execute(migration_file_sql)
+                        if len(migration_file_sql) == 0:
+                            logger.warning('Skipping empty migration file %s.', migration_filename)
+                        elif migration_file_sql.startswith(no_transaction_migration_marker):
+                            logger.info('Applying migration %s outside of a transaction.', migration_filename)
+                            try:
+                                apply_no_transaction_migration(connection, migration_file_sql)
+                            except psycopg2.Error as e:
+                                # Every migration before this one has already been committed, and no-transaction
+                                # migrations are idempotent, so this one is simply retried on the next startup.
+                                logger.error('Failed to apply migration %s, exception thrown was: %r. Migrations '
+                                             'before %s were committed.', migration_filename, e, migration_filename)
+                                return False
                         else:
-                            logger.warning(f'Skipping empty migration file {migration_filename}.')
+                            cursor.execute(migration_file_sql)
                 except (OSError, psycopg2.DataError) as e:
-                    logger.error(f'Failed to apply migration {migration_filename}, exception thrown was: {repr(e)}.')
-                    logger.info(f'Rolling back migrations, reverting back to v{schema_version}.')
+                    logger.error('Failed to apply migration %s, exception thrown was: %r.', migration_filename, e)
+                    logger.info('Rolling back migrations, reverting back to v%s.', schema_version)
                     connection.rollback()
                     return False
         except ValueError as e:
-            logger.error(f'Migration of database schema with version '
-                         f'{schema_version} to {target_version} '
-                         f'failed. Could not find a file in {migrations_directory} named '
-                         f'patch_{target_version_dashed}.sql. [{repr(e)}]')
+            logger.error('Migration of database schema with version %s to %s failed. Could not find a file in %s '
+                         'named patch_%s.sql. [%r]', schema_version, target_version, migrations_directory,
+                         target_version_dashed, e)
             return False
 
-    logger.info(f'Migration from v{schema_version} to v{target_version} was successful, committing transaction.')
+    logger.info('Migration from v%s to v%s was successful, committing transaction.', schema_version, target_version)
     connection.commit()
 
     return True
 
 
+def _connection_string():
+    # Either a Postgres connection string, or sqlite://<path> (sqlite://:memory: for a throwaway database).
+    return os.environ.get('SPRINTATHON_DATABASE_URL', os.environ.get('SPRINTATHON_PGSQL_CONNECTION_STRING'))
+
+
+def _pool_settings():
+    return {
+        'min_size': int(os.environ.get('SPRINTATHON_PGSQL_POOL_MIN_SIZE', 1)),
+        'max_size': int(os.environ.get('SPRINTATHON_PGSQL_POOL_MAX_SIZE', 10)),
+        'checkout_timeout': float(os.environ.get('SPRINTATHON_PGSQL_POOL_CHECKOUT_TIMEOUT', 30)),
+    }
+
+
+def _export_stats(metrics, database_pool):
+    # Read from the stats the pool and query registry already keep, only when scraped.
+    metrics.callback('sprintathon_query_calls_total', 'Executions of each model query.', 'counter',
+                     lambda: {(query.name,): query.stats.calls for query in registry.queries()}, ['query'])
+    metrics.callback('sprintathon_query_errors_total', 'Executions of each model query which raised an error.',
+                     'counter', lambda: {(query.name,): query.stats.errors for query in registry.queries()}, ['query'])
+    metrics.callback('sprintathon_query_rows_total', 'Rows returned or affected by each model query.', 'counter',
+                     lambda: {(query.name,): query.stats.rows for query in registry.queries()}, ['query'])
+    metrics.callback('sprintathon_query_seconds_total', 'Time spent executing each model query.', 'counter',
+                     lambda: {(query.name,): query.stats.total_time for query in registry.queries()}, ['query'])
+    metrics.callback('sprintathon_pool_connections', 'Open database connections, by state.', 'gauge',
+                     lambda: {('idle',): database_pool.idle, ('in_use',): database_pool.size - database_pool.idle},
+                     ['state'])
+    metrics.callback('sprintathon_pool_checkout_wait_seconds_total', 'Time spent waiting for a pooled connection.',
+                     'counter', lambda: database_pool.stats.checkout_wait_total)
+    metrics.callback('sprintathon_pool_checkout_timeouts_total', 'Connection checkouts which timed out.', 'counter',
+                     lambda: database_pool.stats.timeouts)
+
+
+def run_bot(shard_ids=None, shard_count=1):
+    # Runs the bot for the given shards (all of them by default) in this process, using the global pool.
+    logger = logging.getLogger('sprintathon')
+    discord_token = os.environ.get('SPRINTATHON_DISCORD_TOKEN')
+
+    global debug_mode_enabled
+    debug_mode_enabled = os.environ.get('SPRINTATHON_DEBUG_MODE') == 'True'
+    enabled_or_disabled = 'disabled'
+    if debug_mode_enabled:
+        enabled_or_disabled = 'enabled'
+    logger.info('Debug mode is %s.', enabled_or_disabled)
+
+    # SPRINTATHON_DEBUG_GUILD is still read for backwards compatibility.
+    debug_guilds = parse_guild_list(os.environ.get('SPRINTATHON_DEBUG_GUILDS',
+                                                   os.environ.get('SPRINTATHON_DEBUG_GUILD')))
+    disabled_guilds = parse_guild_list(os.environ.get('SPRINTATHON_DISABLED_GUILDS'))
+    router = CommandRouter(debug_mode_enabled, debug_guilds, disabled_guilds, shard_ids, shard_count)
+    logger.info('Routing commands with %s.', router)
+
+    cache_max_size = int(os.environ.get('SPRINTATHON_CACHE_MAX_SIZE', 1024))
+    cache_ttl = float(os.environ.get('SPRINTATHON_CACHE_TTL', 300))
+    MemberRepository.cache = TTLCache(cache_max_size, cache_ttl)
+    ServerRepository.cache = TTLCache(cache_max_size, cache_ttl)
+    ServerRepository.members_cache = TTLCache(cache_max_size * 16, cache_ttl)
+
+    # Left off, nothing is instrumented at all.
+    metrics = None
+    metrics_server = None
+    if os.environ.get('SPRINTATHON_METRICS') == 'True':
+        metrics = Metrics()
+        _export_stats(metrics, pool)
+        # Each worker process of a sharded deployment serves its own endpoint, offset by its first shard.
+        metrics_server = MetricsServer(metrics, os.environ.get('SPRINTATHON_METRICS_HOST', '127.0.0.1'),
+                                       int(os.environ.get('SPRINTATHON_METRICS_PORT', 9108)) + min(shard_ids or [0]))
+        metrics_server.start()
+
+    database = Database(pool, metrics=metrics)
+
+    submission_buffer = None
+    if os.environ.get('SPRINTATHON_WRITE_BEHIND') == 'True':
+        submission_buffer = SubmissionBuffer(
+            database, float(os.environ.get('SPRINTATHON_WRITE_BEHIND_FLUSH_INTERVAL', 0.25)),
+            int(os.environ.get('SPRINTATHON_WRITE_BEHIND_BATCH_SIZE', 50)),
+            int(os.environ.get('SPRINTATHON_WRITE_BEHIND_MAX_ATTEMPTS', 5)))
+        logger.info('Write-behind buffering of submissions is enabled.')
+
+    if os.environ.get('SPRINTATHON_GATEWAY') == 'stub':
+        bot = StubBot(shard_ids=shard_ids, shard_count=shard_count)
+    elif shard_count > 1:
+        bot = commands.AutoShardedBot(command_prefix=commands.when_mentioned_or('!'), help_command=None,
+                                      shard_ids=shard_ids, shard_count=shard_count)
+    else:
+        bot = commands.Bot(command_prefix=commands.when_mentioned_or('!'), help_command=None)
+    leaderboard_rate_limit = float(os.environ.get('SPRINTATHON_LEADERBOARD_RATE_LIMIT', 10))
+    cog = SprintathonBot(bot, database, router, f'{__version__[0]}.{__version__[1]}.{__version__[2]}',
+                         submission_buffer, leaderboard_rate_limit, metrics)
+    bot.add_cog(cog)
+
+    try:
+        bot.run(discord_token)
+    finally:
+        logger.info('Shutting down sprintathon.')
+        if submission_buffer is not None:
+            submission_buffer.close()
+        if metrics_server is not None:
+            metrics_server.close()
+
+    database.close()
+    logger.info('Disconnected from database. Connection pool stats: %s', pool.stats)
+    logger.info('Entity cache stats: Member %s, Server %s, Server members %s, Leaderboards %s.', MemberRepository.cache,
+                ServerRepository.cache, ServerRepository.members_cache, SprintathonRepository.leaderboard_cache)
+    logger.info('Outbound message stats: %s', cog.dispatcher.stats)
+    logger.info('Busiest queries: %s', registry.summary())
+
+
+def run_worker(shard_ids, shard_count):
+    # Entry point of each ShardedRunner worker process. Connections can't be shared across processes, so every worker
+    # opens its own pool.
+    global pool
+    pool = _create_pool(_connection_string(), **_pool_settings())
+    run_bot(shard_ids, shard_count)
+
+
 def main():
+    parser = argparse.ArgumentParser(description='Spr*ntathon Discord bot.')
+    parser.add_argument('--rebuild-totals', action='store_true',
+                        help='recompute the Spr*ntathon leaderboard totals from their submissions, then exit')
+    parser.add_argument('--sprintathon', type=int, metavar='ID',
+                        help='with --rebuild-totals, only rebuild the totals of this Spr*ntathon')
+    parser.add_argument('--list-queries', action='store_true',
+                        help='print every registered model query and its SQL, then exit')
+    args = parser.parse_args()
+
+    if args.list_queries:
+        for query in registry.queries():
+            print(f'{query.name}{"" if query.prepare else " (not prepared)"}: {query.sql}')
+        return
+
     formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
     logger = logging.getLogger('sprintathon')
     logger.setLevel(logging.DEBUG)
@@ -143,34 +329,34 @@ def main():
 
     load_dotenv()
     logger.info('Loaded environment variables from .env.')
-    discord_token = os.environ.get('SPRINTATHON_DISCORD_TOKEN')
+    # Messages below this level are dropped before their arguments are ever formatted.
+    logger.setLevel(os.environ.get('SPRINTATHON_LOG_LEVEL', 'DEBUG').upper())
 
-    connection_string = os.environ.get('SPRINTATHON_PGSQL_CONNECTION_STRING')
-    if not initialize_database(connection_string):
-        connection.close()
+    if not initialize_database(_connection_string(), **_pool_settings()):
+        pool.close()
         logger.critical('Failed to initialize database, exiting...')
         return
-    logger.info('Connected to database.')
-
-    global debug_mode_enabled
-    debug_mode_enabled = os.environ.get('SPRINTATHON_DEBUG_MODE') == 'True'
-    enabled_or_disabled = 'disabled'
-    if debug_mode_enabled:
-        enabled_or_disabled = 'enabled'
-    logger.info('Debug mode is %s.', enabled_or_disabled)
-
-    debug_guild = os.environ.get('SPRINTATHON_DEBUG_GUILD')
-
-    bot = commands.Bot(command_prefix=commands.when_mentioned_or('!'), help_command=None)
-    bot.add_cog(SprintathonBot(bot, connection, debug_mode_enabled, debug_guild,
-                               f'{__version__[0]}.{__version__[1]}.{__version__[2]}'))
-
-    bot.run(discord_token)
-
-    logger.info('Shutting down sprintathon.')
+    logger.info('Connected to database with a pool of %i-%i connections.', pool.min_size, pool.max_size)
+
+    if args.rebuild_totals:
+        with pool.connection() as connection:
+            SprintathonRepository(connection).rebuild_totals(args.sprintathon)
+        pool.close()
+        logger.info('Rebuilt Spr*ntathon totals for %s.',
+                    f'Spr*ntathon {args.sprintathon}' if args.sprintathon is not None else 'every Spr*ntathon')
+        return
 
-    connection.close()
-    logger.info('Disconnected from database.')
+    shard_count = int(os.environ.get('SPRINTATHON_SHARD_COUNT', 1))
+    process_count = int(os.environ.get('SPRINTATHON_SHARD_PROCESSES', 1))
+    if process_count > 1:
+        # The migrations are done, so the coordinator doesn't need its own connections while the workers run.
+        pool.close()
+        logger.info('Running %i shards across %i worker processes.', shard_count, process_count)
+        ShardedRunner(run_worker, shard_count, process_count).run()
+    else:
+        # A single process can still be limited to some of the shards, to split guilds across hosts by hand.
+        shard_ids = parse_shard_ids(os.environ.get('SPRINTATHON_SHARD_IDS', os.environ.get('SPRINTATHON_SHARD_ID')))
+        run_bot(shard_ids, shard_count)
 
     logger.info('Sprintathon terminated.')
 
@@ -1,78 +1,102 @@
 import logging
 
-from dbo import Dbo
+from cache import TTLCache
+from dbo import Dbo, Repository
+from queries import registry
 
 
 class Member(Dbo):
-    def __init__(self, connection, _id=None, name='', discord_user_id=0) -> None:
-        self.logger = logging.getLogger('sprintathon.Member')
-        super().__init__(connection)
+    __slots__ = ('id', 'name', 'discord_user_id')
+
+    def __init__(self, _id=None, name='', discord_user_id=0) -> None:
         self.id = _id
         self.name = name
         self.discord_user_id = discord_user_id
 
-    def create(self) -> int:
+    def __repr__(self) -> str:
+        return f'Member{{id={self.id},name={self.name},discord_user_id={self.discord_user_id}}}'
+
+
+class MemberRepository(Repository):
+    __slots__ = ()
+    logger = logging.getLogger('sprintathon.MemberRepository')
+    # Keyed by MEMBER.DISCORD_USER_ID.
+    cache = TTLCache()
+
+    CREATE = registry.register('member_create', 'INSERT INTO MEMBER(NAME, DISCORD_USER_ID) VALUES(%s, %s) RETURNING ID')
+    UPDATE = registry.register('member_update', 'UPDATE MEMBER SET NAME = %s, DISCORD_USER_ID = %s WHERE ID=%s')
+    DELETE = registry.register('member_delete', 'DELETE FROM MEMBER WHERE ID=%s')
+    FIND_BY_ID = registry.register('member_find_by_id', 'SELECT NAME, DISCORD_USER_ID FROM MEMBER WHERE ID=%s')
+    FIND_BY_NAME = registry.register('member_find_by_name', 'SELECT ID, DISCORD_USER_ID FROM MEMBER WHERE NAME=%s')
+    FIND_BY_DISCORD_USER_ID = registry.register('member_find_by_discord_user_id',
+                                                'SELECT ID, NAME FROM MEMBER WHERE DISCORD_USER_ID=%s')
+    FIND_OR_CREATE = registry.register(
+        'member_find_or_create', 'INSERT INTO MEMBER(NAME, DISCORD_USER_ID) VALUES(%s, %s) '
+                                 'ON CONFLICT (DISCORD_USER_ID) DO UPDATE SET NAME = EXCLUDED.NAME RETURNING ID')
+
+    def create(self, member) -> int:
         with self.connection.cursor() as cursor:
-            cursor.execute('INSERT INTO MEMBER(NAME, DISCORD_USER_ID) VALUES(%s, %s) RETURNING ID',
-                           [self.name, self.discord_user_id])
-            self.id = cursor.fetchone()[0]
+            MemberRepository.CREATE.execute(cursor, [member.name, member.discord_user_id])
+            member.id = cursor.fetchone()[0]
             self.connection.commit()
-            self.logger.debug('Inserting %s into database.', self)
-            return self.id
+            MemberRepository.cache.set(member.discord_user_id, Member(member.id, member.name, member.discord_user_id))
+            self.logger.debug('Inserting %s into database.', member)
+            return member.id
 
-    def update(self) -> None:
+    def update(self, member) -> None:
         with self.connection.cursor() as cursor:
-            cursor.execute('UPDATE MEMBER SET NAME = %s, DISCORD_USER_ID = %s WHERE ID=%s',
-                           (self.name, self.discord_user_id, self.id))
+            MemberRepository.UPDATE.execute(cursor, (member.name, member.discord_user_id, member.id))
             self.connection.commit()
-            self.logger.debug('Updating %s in database.', self)
+            MemberRepository.cache.invalidate(member.discord_user_id)
+            self.logger.debug('Updating %s in database.', member)
 
-    def delete(self) -> None:
+    def delete(self, member) -> None:
+        # Imported here, as server imports this module (through sprint and sprintathon too).
+        from server import ServerRepository
         with self.connection.cursor() as cursor:
-            cursor.execute('DELETE FROM MEMBER WHERE ID=%s', [self.id])
+            MemberRepository.DELETE.execute(cursor, [member.id])
             self.connection.commit()
-            self.logger.debug('Deleting %s from database.', self)
+            MemberRepository.cache.invalidate(member.discord_user_id)
+            ServerRepository.members_cache.invalidate_matching(lambda key: key[1] == member.id)
+            self.logger.debug('Deleting %s from database.', member)
 
     def find_by_id(self, _id):
-        self.id = _id
         with self.connection.cursor() as cursor:
-            cursor.execute('SELECT NAME, DISCORD_USER_ID FROM MEMBER WHERE ID=%s', [self.id])
+            MemberRepository.FIND_BY_ID.execute(cursor, [_id])
             result = cursor.fetchone()
-            self.name = result[0]
-            self.discord_user_id = result[1]
-        return self
+            return Member(_id, result[0], result[1])
 
     def find_by_name(self, name):
-        self.name = name
         with self.connection.cursor() as cursor:
-            cursor.execute('SELECT ID, DISCORD_USER_ID FROM MEMBER WHERE NAME=%s', [self.name])
+            MemberRepository.FIND_BY_NAME.execute(cursor, [name])
             result = cursor.fetchone()
-            # TODO: I should really force a UNIQUE constraint on the MEMBER.NAME column, or handle duplicates better...
+            # MEMBER.NAME isn't UNIQUE (Discord names aren't), so prefer find_by_discord_user_id() instead.
             if result is None:
                 return None
-            self.id = result[0]
-            self.discord_user_id = result[1]
-        return self
+            return Member(result[0], name, result[1])
 
     def find_by_discord_user_id(self, discord_user_id):
-        self.discord_user_id = discord_user_id
+        cached = MemberRepository.cache.get(discord_user_id)
+        if cached is not None:
+            return Member(cached.id, cached.name, discord_user_id)
         with self.connection.cursor() as cursor:
-            cursor.execute('SELECT ID, NAME FROM MEMBER WHERE DISCORD_USER_ID=%s', [self.discord_user_id])
+            MemberRepository.FIND_BY_DISCORD_USER_ID.execute(cursor, [discord_user_id])
             result = cursor.fetchone()
-            # TODO: MEMBER.DISCORD_USER_ID should never be duplicate, possibly add a UNIQUE constraint just in case?
             if result is None:
                 return None
-            self.id = result[0]
-            self.name = result[1]
-        return self
+            member = Member(result[0], result[1], discord_user_id)
+        MemberRepository.cache.set(discord_user_id, Member(member.id, member.name, discord_user_id))
+        return member
 
-    def has_submission_in(self, sprint):
+    def find_or_create(self, member):
+        # Looks the member up by DISCORD_USER_ID, creating them (or updating their name) in a single statement.
+        cached = MemberRepository.cache.get(member.discord_user_id)
+        if cached is not None and cached.name == member.name:
+            member.id = cached.id
+            return member
         with self.connection.cursor() as cursor:
-            cursor.execute(
-                'SELECT COUNT(*) FROM SUBMISSION INNER JOIN SPRINT_SUBMISSION ON SUBMISSION.ID=SPRINT_SUBMISSION.SUBMISSION_ID INNER JOIN SPRINT ON SPRINT_SUBMISSION.SPRINT_ID=SPRINT.ID WHERE SUBMISSION.MEMBER_ID=%s AND SPRINT.ID=%s',
-                (self.id, sprint.id))
-            result = cursor.fetchone()
-            return int(result[0]) > 0
-
-    def __repr__(self) -> str:
-        return f'Member{{id={self.id},name={self.name},discord_user_id={self.discord_user_id}}}'
+            MemberRepository.FIND_OR_CREATE.execute(cursor, [member.name, member.discord_user_id])
+            member.id = cursor.fetchone()[0]
+            self.connection.commit()
+            MemberRepository.cache.set(member.discord_user_id, Member(member.id, member.name, member.discord_user_id))
+            return member
@@ -0,0 +1,63 @@
+# Discord rejects messages longer than this many characters.
+DISCORD_MESSAGE_LIMIT = 2000
+
+
+def ordinal(number) -> str:
+    if 10 <= number % 100 <= 20:
+        suffix = 'th'
+    else:
+        suffix = {1: 'st', 2: 'nd', 3: 'rd'}.get(number % 10, 'th')
+    return f'{number}{suffix}'
+
+
+def mention_list(members) -> str:
+    mentions = [f'<@{_member.discord_user_id}>' for _member in members]
+    if len(mentions) < 2:
+        return ''.join(mentions)
+    return f'{", ".join(mentions[:-1])} and {mentions[-1]}'
+
+
+class MessageBuilder:
+    # Builds up output line by line, and splits it into messages of at most limit characters, breaking between lines
+    # wherever it can. Finished messages can be taken with ready() while the rest is still being built.
+    def __init__(self, limit=DISCORD_MESSAGE_LIMIT) -> None:
+        self.limit = limit
+        self._messages = []
+        self._lines = []
+        self._length = 0
+
+    def add_line(self, line='') -> 'MessageBuilder':
+        return self.add(f'{line}\n')
+
+    def add(self, text) -> 'MessageBuilder':
+        if self._length + len(text) > self.limit:
+            self.end_message()
+        # Only a single line longer than a whole message has to be broken mid-line.
+        while len(text) > self.limit:
+            self._messages.append(text[:self.limit])
+            text = text[self.limit:]
+        if text:
+            self._lines.append(text)
+            self._length += len(text)
+        return self
+
+    def end_message(self) -> 'MessageBuilder':
+        # Whatever is added next starts a new message.
+        if self._lines:
+            self._messages.append(''.join(self._lines))
+            self._lines = []
+            self._length = 0
+        return self
+
+    def ready(self) -> list:
+        messages, self._messages = self._messages, []
+        return [message for message in messages if message.strip()]
+
+    def messages(self) -> list:
+        self.end_message()
+        return self.ready()
+
+    def dispatch(self, dispatcher, channel_id, *args) -> None:
+        # Queues every message on a MessageDispatcher, which keeps them apart just as they were built.
+        for message in self.messages():
+            dispatcher.send(channel_id, message, *args, coalesce=False)
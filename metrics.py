@@ -0,0 +1,177 @@
+import bisect
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Upper bounds, in seconds, of the default histogram buckets.
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Timers usually fire within milliseconds of their deadline, but a backed up event loop or a restart can make them
+# minutes late.
+DRIFT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 15.0, 60.0, 300.0)
+
+_content_type = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=()) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return f'{{{",".join(pairs)}}}' if pairs else ''
+
+
+def _value(value) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    def __init__(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        # Label values -> a count per bucket (plus one for anything above the last bucket), then the sum.
+        self._series = dict()
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def render(self) -> list:
+        with self._lock:
+            items = sorted((label_values, list(series)) for label_values, series in self._series.items())
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        for label_values, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{_labels(self.label_names, label_values, [("le", _value(bound))])} '
+                             f'{cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.label_names, label_values)} {_value(series[-1])}')
+            lines.append(f'{self.name}_count{_labels(self.label_names, label_values)} {cumulative}')
+        return lines
+
+
+class Counter:
+    def __init__(self, name, documentation, label_names=()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = dict()
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> list:
+        with self._lock:
+            items = sorted(self._values.items())
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        lines.extend(f'{self.name}{_labels(self.label_names, label_values)} {_value(value)}'
+                     for label_values, value in items)
+        return lines
+
+
+class CallbackMetric:
+    # A counter or gauge read from somewhere else (e.g. a stats object) only when scraped, so whatever it measures
+    # pays nothing for it. function returns a single value, or a dict of label values -> value.
+    def __init__(self, name, documentation, metric_type, function, label_names=()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.metric_type = metric_type
+        self.function = function
+        self.label_names = tuple(label_names)
+
+    def render(self) -> list:
+        values = self.function()
+        if not isinstance(values, dict):
+            values = {(): values}
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.metric_type}']
+        lines.extend(f'{self.name}{_labels(self.label_names, label_values)} {_value(value)}'
+                     for label_values, value in sorted(values.items()))
+        return lines
+
+
+class Metrics:
+    # Every metric the process exports. Instrumentation is only installed where one of these is passed in, so with
+    # metrics switched off the hot paths run exactly as they would without any.
+    def __init__(self) -> None:
+        self.logger = logging.getLogger('sprintathon.Metrics')
+        self._metrics = dict()
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def histogram(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, label_names, buckets))
+
+    def counter(self, name, documentation, label_names=()) -> Counter:
+        return self._register(Counter(name, documentation, label_names))
+
+    def callback(self, name, documentation, metric_type, function, label_names=()) -> CallbackMetric:
+        return self._register(CallbackMetric(name, documentation, metric_type, function, label_names))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+        lines = []
+        for metric in metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception:
+                self.logger.exception('Failed to collect metric %s.', metric.name)
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsServer:
+    # Serves Metrics.render() in the Prometheus text format on its own thread, so it can still be scraped while the
+    # event loop is stuck.
+    def __init__(self, metrics, host='127.0.0.1', port=9108) -> None:
+        self.logger = logging.getLogger('sprintathon.MetricsServer')
+        self.metrics = metrics
+        self.host = host
+        self.port = port
+        self._server = None
+        self._thread = None
+
+    def start(self) -> None:
+        metrics = self.metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', _content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name='sprintathon-metrics', daemon=True)
+        self._thread.start()
+        self.logger.info('Serving metrics on http://%s:%i/metrics.', self.host, self.port)
+
+    def close(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
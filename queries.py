@@ -0,0 +1,140 @@
+import logging
+import threading
+import time
+
+from storage import PostgresEngine
+
+
+class QueryStats:
+    def __init__(self) -> None:
+        self.calls = 0
+        self.errors = 0
+        self.rows = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def record(self, elapsed, rows) -> None:
+        self.calls += 1
+        # rowcount is -1 for statements it doesn't apply to.
+        self.rows += max(rows, 0)
+        self.total_time += elapsed
+        self.max_time = max(self.max_time, elapsed)
+
+    def as_dict(self) -> dict:
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'rows': self.rows,
+            'total_time': self.total_time,
+            'avg_time': self.total_time / self.calls if self.calls else 0.0,
+            'max_time': self.max_time,
+        }
+
+    def __repr__(self) -> str:
+        return f'QueryStats{self.as_dict()}'
+
+
+class Query:
+    def __init__(self, registry, name, sql, prepare=True, dialects=None) -> None:
+        self.registry = registry
+        self.name = name
+        # Either the SQL itself, or a function returning it, for statements built from model column lists which can't
+        # be evaluated until every model module has been imported.
+        self._sql = sql
+        # Multi-row statements built by execute_values() vary in length, so they can't be prepared.
+        self.prepare = prepare
+        # Storage engine name -> the statement in that engine's own dialect, for the few the engine can't translate.
+        self.dialects = dialects or dict()
+        self.stats = QueryStats()
+
+    @property
+    def sql(self) -> str:
+        if callable(self._sql):
+            self._sql = self._sql()
+        return self._sql
+
+    def execute(self, cursor, params=None) -> None:
+        self.registry.execute(cursor, self, params)
+
+    def execute_values(self, cursor, argslist, **kwargs):
+        return self.registry.execute_values(cursor, self, argslist, **kwargs)
+
+    def stream(self, connection, params=None, batch_size=500):
+        return self.registry.stream(connection, self, params, batch_size)
+
+    def __repr__(self) -> str:
+        return f'Query{{name={self.name},prepare={self.prepare},stats={self.stats}}}'
+
+
+class QueryRegistry:
+    # Every statement the models run, by name, written for Postgres. The storage engine decides how each one is
+    # actually run, e.g. prepared once per connection on Postgres, or translated for SQLite.
+    def __init__(self, engine=None) -> None:
+        self.logger = logging.getLogger('sprintathon.QueryRegistry')
+        self.engine = engine or PostgresEngine()
+        self._queries = dict()
+        # Queries run on every database executor thread.
+        self._lock = threading.Lock()
+
+    def use(self, engine) -> None:
+        self.logger.info('Running queries on %s.', engine)
+        self.engine = engine
+
+    def register(self, name, sql, prepare=True, dialects=None) -> Query:
+        if name in self._queries:
+            raise ValueError(f'A query named {name} is already registered.')
+        query = Query(self, name, sql, prepare, dialects)
+        self._queries[name] = query
+        return query
+
+    def get(self, name) -> Query:
+        return self._queries[name]
+
+    def queries(self) -> list:
+        return sorted(self._queries.values(), key=lambda query: query.name)
+
+    def _run(self, query, function, rows):
+        started_at = time.perf_counter()
+        try:
+            result = function()
+        except Exception:
+            with self._lock:
+                query.stats.errors += 1
+            raise
+        elapsed = time.perf_counter() - started_at
+        with self._lock:
+            query.stats.record(elapsed, rows())
+        return result
+
+    def execute(self, cursor, query, params=None) -> None:
+        engine = self.engine
+        self._run(query, lambda: engine.execute(cursor, query, params), lambda: cursor.rowcount)
+
+    def execute_values(self, cursor, query, argslist, **kwargs):
+        engine = self.engine
+        # rowcount only covers the last page of a multi-page execute_values().
+        return self._run(query, lambda: engine.execute_values(cursor, query, argslist, **kwargs),
+                         lambda: len(argslist))
+
+    def stream(self, connection, query, params=None, batch_size=500):
+        # Yields the query's rows in lists of up to batch_size from one of the engine's streaming cursors, which is
+        # closed once the rows run out or the generator is closed. The rows are counted as they're fetched, as the
+        # cursor can't know how many there are up front. Has to be consumed on the thread holding the connection.
+        engine = self.engine
+        with engine.stream_cursor(connection, query.name) as cursor:
+            self._run(query, lambda: engine.execute(cursor, query, params), lambda: 0)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    return
+                with self._lock:
+                    query.stats.rows += len(rows)
+                yield rows
+
+    def summary(self, limit=10) -> str:
+        busiest = sorted(self._queries.values(), key=lambda query: query.stats.total_time, reverse=True)[:limit]
+        return ', '.join(f'{query.name}={query.stats.calls} calls/{query.stats.total_time * 1000:.1f}ms'
+                         for query in busiest if query.stats.calls)
+
+
+registry = QueryRegistry()
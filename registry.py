@@ -0,0 +1,121 @@
+import logging
+
+from dbo import IdentityMap
+from sprint import ParticipantState, SprintRepository
+from sprintathon import SprintathonRepository
+
+
+def _key(entity):
+    # Sprints and Spr*ntathons from before v1.0.2 may not have a SERVER. Only ever called with the Server loaded, so
+    # this never queries on the event loop.
+    guild_id = entity.server.discord_guild_id if entity.server is not None else None
+    return guild_id, entity.discord_channel_id
+
+
+class ActiveSprintState:
+    def __init__(self, _sprint) -> None:
+        self.sprint = _sprint
+        # MEMBER.ID -> ParticipantState, the same as SprintRepository.get_participant_states() would return, kept up to
+        # date by every check-in so none of them have to ask the database.
+        self.participants = dict()
+
+    def record(self, member, submission_type, word_count) -> None:
+        participant = self.participants.get(member.id)
+        if participant is None:
+            participant = self.participants[member.id] = ParticipantState(member)
+        participant.record(submission_type, word_count)
+
+    def participant(self, member):
+        return self.participants.get(member.id)
+
+    def submission_type_for(self, member) -> str:
+        participant = self.participants.get(member.id)
+        return participant.next_submission_type if participant is not None else 'START'
+
+    @property
+    def members(self) -> list:
+        return [participant.member for participant in self.participants.values()]
+
+    def __repr__(self) -> str:
+        return f'ActiveSprintState{{sprint={self.sprint},members={len(self.participants)}}}'
+
+
+class ActiveSprintRegistry:
+    # The live state of every running sprint and Spr*ntathon, keyed by (Discord guild ID, Discord channel ID). The
+    # database stays the durable record: every change is still written through the repositories, and the registry is
+    # rebuilt from it on startup.
+    def __init__(self) -> None:
+        self.logger = logging.getLogger('sprintathon.ActiveSprintRegistry')
+        self._sprints = dict()
+        self._sprints_by_id = dict()
+        self._sprintathons = dict()
+        self._sprintathons_by_id = dict()
+        self.loaded = False
+
+    def get_sprint(self, guild_id, channel_id):
+        return self._sprints.get((guild_id, channel_id))
+
+    def get_sprint_by_id(self, sprint_id):
+        return self._sprints_by_id.get(sprint_id)
+
+    def add_sprint(self, _sprint) -> ActiveSprintState:
+        state = ActiveSprintState(_sprint)
+        self._sprints[_key(_sprint)] = state
+        self._sprints_by_id[_sprint.id] = state
+        return state
+
+    def remove_sprint(self, _sprint) -> None:
+        state = self._sprints_by_id.pop(_sprint.id, None)
+        if state is not None:
+            self._sprints.pop(_key(state.sprint), None)
+
+    def get_sprintathon(self, guild_id, channel_id):
+        return self._sprintathons.get((guild_id, channel_id))
+
+    def get_sprintathon_by_id(self, sprintathon_id):
+        return self._sprintathons_by_id.get(sprintathon_id)
+
+    def add_sprintathon(self, _sprintathon) -> None:
+        self._sprintathons[_key(_sprintathon)] = _sprintathon
+        self._sprintathons_by_id[_sprintathon.id] = _sprintathon
+
+    def remove_sprintathon(self, _sprintathon) -> None:
+        _sprintathon = self._sprintathons_by_id.pop(_sprintathon.id, None)
+        if _sprintathon is not None:
+            self._sprintathons.pop(_key(_sprintathon), None)
+
+    @property
+    def sprint_count(self) -> int:
+        return len(self._sprints_by_id)
+
+    @property
+    def sprintathon_count(self) -> int:
+        return len(self._sprintathons_by_id)
+
+    def load(self, connection, handles=None) -> None:
+        # Rebuilds the registry from the database with three queries, no matter how many sprints are running.
+        # handles(guild_id) filters out the sprints and Spr*ntathons belonging to other shards or instances.
+        identity_map = IdentityMap()
+        sprints_repository = SprintRepository(connection)
+        sprintathons = SprintathonRepository(connection).get_active(identity_map)
+        sprints = sprints_repository.get_active(identity_map)
+        participants = sprints_repository.get_active_participants()
+
+        # Built up on the side and swapped in at the end, as this runs on a database executor thread while the event
+        # loop may be reading the registry.
+        loaded = ActiveSprintRegistry()
+        for _sprintathon in sprintathons:
+            if handles is None or handles(_key(_sprintathon)[0]):
+                loaded.add_sprintathon(_sprintathon)
+        for _sprint in sprints:
+            if handles is None or handles(_key(_sprint)[0]):
+                loaded.add_sprint(_sprint)
+        for sprint_id, member, submission_type, word_count in participants:
+            state = loaded.get_sprint_by_id(sprint_id)
+            if state is not None:
+                state.record(member, submission_type, word_count)
+        self._sprints, self._sprints_by_id = loaded._sprints, loaded._sprints_by_id
+        self._sprintathons, self._sprintathons_by_id = loaded._sprintathons, loaded._sprintathons_by_id
+        self.loaded = True
+        self.logger.info('Loaded %i active sprints and %i active Spr*ntathons.', len(self._sprints_by_id),
+                         len(self._sprintathons_by_id))
@@ -0,0 +1,104 @@
+import logging
+
+
+class GuildRoute:
+    HANDLE = 'HANDLE'
+    # Left to the debug (or non-debug) instance of the bot.
+    DEBUG_ONLY = 'DEBUG_ONLY'
+    NOT_DEBUG = 'NOT_DEBUG'
+    DISABLED = 'DISABLED'
+    # Owned by another shard.
+    OTHER_SHARD = 'OTHER_SHARD'
+
+
+def parse_guild_list(value):
+    # A comma-separated list of guild IDs and/or guild names, as given in the environment.
+    if not value:
+        return set()
+    return {int(item) if item.isdigit() else item for item in (item.strip() for item in value.split(',')) if item}
+
+
+def parse_shard_ids(value):
+    if not value:
+        return None
+    return [int(item) for item in value.split(',') if item.strip()]
+
+
+def shard_for_guild(guild_id, shard_count) -> int:
+    # The same formula Discord uses to assign guilds to gateway shards.
+    return (guild_id >> 22) % shard_count
+
+
+class CommandRouter:
+    # Decides once per guild, when the guild becomes available, joins or changes, whether this process handles its
+    # commands. Commands then only need a dict lookup on the guild ID.
+    def __init__(self, debug_mode=False, debug_guilds=None, disabled_guilds=None, shard_ids=None,
+                 shard_count=1) -> None:
+        if shard_ids is None:
+            shard_ids = range(shard_count)
+        if shard_count < 1 or not shard_ids or not all(0 <= shard_id < shard_count for shard_id in shard_ids):
+            raise ValueError(f'Invalid shards {list(shard_ids)} of {shard_count}.')
+        self.logger = logging.getLogger('sprintathon.CommandRouter')
+        self.debug_mode = debug_mode
+        # Guilds can be given by ID or by name.
+        self.debug_guilds = set(debug_guilds or ())
+        self.disabled_guilds = set(disabled_guilds or ())
+        self.shard_ids = frozenset(shard_ids)
+        self.shard_count = shard_count
+        self._routes = dict()
+
+    @staticmethod
+    def _matches(guild, guilds) -> bool:
+        return guild.id in guilds or guild.name in guilds
+
+    def owns(self, guild_id) -> bool:
+        # Sprints and Spr*ntathons from before v1.0.2 have no guild, and are left to shard 0.
+        return self.shard_count == 1 or shard_for_guild(guild_id or 0, self.shard_count) in self.shard_ids
+
+    def resolve(self, guild) -> str:
+        if not self.owns(guild.id):
+            route = GuildRoute.OTHER_SHARD
+        elif self._matches(guild, self.disabled_guilds):
+            route = GuildRoute.DISABLED
+        elif self._matches(guild, self.debug_guilds):
+            route = GuildRoute.HANDLE if self.debug_mode else GuildRoute.DEBUG_ONLY
+        else:
+            route = GuildRoute.NOT_DEBUG if self.debug_mode else GuildRoute.HANDLE
+        previous = self._routes.get(guild.id)
+        self._routes[guild.id] = route
+        if route != previous:
+            self.logger.debug('Guild %s (%i) is routed as %s.', guild.name, guild.id, route)
+        return route
+
+    def resolve_all(self, guilds) -> None:
+        for guild in guilds:
+            self.resolve(guild)
+        self.logger.info('Handling commands for %i of %i guilds.', len(self.handled_guild_ids()), len(self._routes))
+
+    def forget(self, guild) -> None:
+        self._routes.pop(guild.id, None)
+
+    def route(self, guild) -> str:
+        route = self._routes.get(guild.id)
+        if route is None:
+            # Only for guilds whose events raced ahead of on_ready or on_guild_join.
+            route = self.resolve(guild)
+        return route
+
+    def should_handle(self, guild) -> bool:
+        # Direct messages aren't tied to a guild, and nothing in the bot supports them.
+        return guild is not None and self.route(guild) == GuildRoute.HANDLE
+
+    def handles_guild_id(self, guild_id) -> bool:
+        # For sprints and jobs loaded from the database, which only know their guild's ID. Those without a guild are
+        # left to the non-debug instance on shard 0.
+        if guild_id is None:
+            return not self.debug_mode and self.owns(None)
+        return self._routes.get(guild_id) == GuildRoute.HANDLE
+
+    def handled_guild_ids(self) -> set:
+        return {guild_id for guild_id, route in self._routes.items() if route == GuildRoute.HANDLE}
+
+    def __repr__(self) -> str:
+        return f'CommandRouter{{debug_mode={self.debug_mode},debug_guilds={self.debug_guilds},' \
+               f'disabled_guilds={self.disabled_guilds},shards={sorted(self.shard_ids)}/{self.shard_count}}}'
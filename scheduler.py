@@ -0,0 +1,122 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+
+class ScheduledCallback:
+    def __init__(self, key, when, sequence, callback, args) -> None:
+        self.key = key
+        self.when = when
+        self.sequence = sequence
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def __lt__(self, other) -> bool:
+        # Callbacks due at the same time run in the order they were scheduled.
+        return (self.when, self.sequence) < (other.when, other.sequence)
+
+    def __repr__(self) -> str:
+        return f'ScheduledCallback{{key={self.key},when={self.when},cancelled={self.cancelled}}}'
+
+
+class Scheduler:
+    def __init__(self, drift_observer=None) -> None:
+        self.logger = logging.getLogger('sprintathon.Scheduler')
+        # Called with each ScheduledCallback and how many seconds after its deadline it actually ran.
+        self.drift_observer = drift_observer
+        # A min-heap of every pending deadline. Cancelled entries are left in place and skipped when they reach the
+        # top, so cancelling is a dict lookup, and rescheduling a single heap push.
+        self._heap = []
+        self._pending = dict()
+        # Key -> how many of its callbacks are running. Counted from the moment their task is created, not when it
+        # first runs, so there's no gap in which a key is neither pending nor running.
+        self._running = dict()
+        self._cancelled_count = 0
+        self._sequence = itertools.count()
+        self._wakeup = None
+        self._task = None
+
+    def start(self) -> None:
+        if self._task is not None and not self._task.done():
+            return
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def schedule(self, key, when, callback, *args) -> ScheduledCallback:
+        # Schedules callback(*args) to be awaited at the time.time() timestamp when, replacing anything else that was
+        # scheduled under the same key.
+        self.cancel(key)
+        entry = ScheduledCallback(key, when, next(self._sequence), callback, args)
+        self._pending[key] = entry
+        heapq.heappush(self._heap, entry)
+        if self._heap[0] is entry and self._wakeup is not None:
+            self._wakeup.set()
+        return entry
+
+    def schedule_in(self, key, delay, callback, *args) -> ScheduledCallback:
+        return self.schedule(key, time.time() + delay, callback, *args)
+
+    def cancel(self, key) -> bool:
+        entry = self._pending.pop(key, None)
+        if entry is None:
+            return False
+        entry.cancelled = True
+        self._cancelled_count += 1
+        # Rebuild the heap once most of it is cancelled entries, so it can't grow without bound.
+        if self._cancelled_count > len(self._heap) // 2:
+            self._heap = [item for item in self._heap if not item.cancelled]
+            heapq.heapify(self._heap)
+            self._cancelled_count = 0
+        return True
+
+    def get(self, key):
+        return self._pending.get(key)
+
+    def is_running(self, key) -> bool:
+        return key in self._running
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    async def _run(self) -> None:
+        while True:
+            while self._heap and self._heap[0].cancelled:
+                heapq.heappop(self._heap)
+                self._cancelled_count -= 1
+
+            if not self._heap:
+                timeout = None
+            else:
+                timeout = self._heap[0].when - time.time()
+                if timeout <= 0:
+                    entry = heapq.heappop(self._heap)
+                    del self._pending[entry.key]
+                    self._running[entry.key] = self._running.get(entry.key, 0) + 1
+                    asyncio.get_running_loop().create_task(self._invoke(entry))
+                    continue
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _invoke(self, entry) -> None:
+        if self.drift_observer is not None:
+            self.drift_observer(entry, time.time() - entry.when)
+        try:
+            await entry.callback(*entry.args)
+        except Exception:
+            self.logger.exception('Scheduled callback %s raised an exception.', entry)
+        finally:
+            count = self._running.pop(entry.key) - 1
+            if count:
+                self._running[entry.key] = count
@@ -1,96 +1,149 @@
 import logging
 
-from dbo import Dbo
+from cache import TTLCache
+from dbo import Dbo, IdentityMap, Repository
 import member
+from queries import registry
 import sprint
 import sprintathon
 
 
 class Server(Dbo):
-    def __init__(self, connection, _id=None, name='', discord_guild_id=None) -> None:
-        self.logger = logging.getLogger('sprintathon.Server')
-        super().__init__(connection)
+    __slots__ = ('id', 'name', 'discord_guild_id')
+
+    def __init__(self, _id=None, name='', discord_guild_id=None) -> None:
         self.id = _id
         self.name = name
         self.discord_guild_id = discord_guild_id
 
-    def create(self) -> int:
+    def __repr__(self) -> str:
+        return f'Server{{id={self.id},name={self.name},discord_guild_id={self.discord_guild_id}}}'
+
+
+class ServerRepository(Repository):
+    __slots__ = ()
+    logger = logging.getLogger('sprintathon.ServerRepository')
+    # Keyed by SERVER.DISCORD_GUILD_ID.
+    cache = TTLCache()
+    # Keyed by (SERVER.ID, MEMBER.ID), for members already known to be in SERVER_MEMBER.
+    members_cache = TTLCache(max_size=16384)
+    # The number of columns selected by ServerRepository.columns(), for slicing joined rows.
+    COLUMN_COUNT = 3
+
+    CREATE = registry.register('server_create',
+                               'INSERT INTO SERVER(NAME, DISCORD_GUILD_ID) VALUES(%s, %s) RETURNING ID')
+    UPDATE = registry.register('server_update', 'UPDATE SERVER SET NAME = %s, DISCORD_GUILD_ID = %s WHERE ID=%s')
+    DELETE = registry.register('server_delete', 'DELETE FROM SERVER WHERE ID=%s')
+    FIND_BY_ID = registry.register('server_find_by_id', 'SELECT NAME, DISCORD_GUILD_ID FROM SERVER WHERE ID=%s')
+    FIND = registry.register('server_find', 'SELECT ID FROM SERVER WHERE NAME=%s AND DISCORD_GUILD_ID=%s')
+    ADD_MEMBER = registry.register('server_add_member',
+                                   'INSERT INTO SERVER_MEMBER(SERVER_ID, MEMBER_ID) VALUES(%s, %s) '
+                                   'ON CONFLICT DO NOTHING')
+    GET_MEMBERS = registry.register('server_get_members',
+                                    'SELECT MEMBER.ID, MEMBER.NAME, MEMBER.DISCORD_USER_ID FROM MEMBER '
+                                    'INNER JOIN SERVER_MEMBER ON MEMBER.ID=SERVER_MEMBER.MEMBER_ID '
+                                    'INNER JOIN SERVER ON SERVER_MEMBER.SERVER_ID=SERVER.ID WHERE SERVER.ID=%s')
+    GET_SPRINTS = registry.register('server_get_sprints',
+                                    'SELECT ID, START, DURATION, ACTIVE, DISCORD_CHANNEL_ID, SPRINTATHON_ID '
+                                    'FROM SPRINT WHERE SERVER_ID=%s')
+    GET_SPRINTATHONS = registry.register('server_get_sprintathons',
+                                         'SELECT ID, START, DURATION, ACTIVE, DISCORD_CHANNEL_ID FROM SPRINTATHON '
+                                         'WHERE SERVER_ID=%s')
+
+    def create(self, server) -> int:
         with self.connection.cursor() as cursor:
-            cursor.execute('INSERT INTO SERVER(NAME, DISCORD_GUILD_ID) VALUES(%s, %s) RETURNING ID',
-                           [self.name, self.discord_guild_id])
+            ServerRepository.CREATE.execute(cursor, [server.name, server.discord_guild_id])
             result = cursor.fetchone()
-            self.id = result[0]
+            server.id = result[0]
             self.connection.commit()
-            self.logger.debug('Inserting %s into database.', self)
-            return self.id
+            ServerRepository.cache.set(server.discord_guild_id, Server(server.id, server.name, server.discord_guild_id))
+            self.logger.debug('Inserting %s into database.', server)
+            return server.id
 
-    def update(self) -> None:
+    def update(self, server) -> None:
         with self.connection.cursor() as cursor:
-            cursor.execute('UPDATE SERVER SET NAME = %s, DISCORD_GUILD_ID = %s WHERE ID=%s',
-                           (self.name, self.discord_guild_id, self.id))
+            ServerRepository.UPDATE.execute(cursor, (server.name, server.discord_guild_id, server.id))
             self.connection.commit()
-            self.logger.debug('Updating %s in database.', self)
+            ServerRepository.cache.invalidate(server.discord_guild_id)
+            self.logger.debug('Updating %s in database.', server)
 
-    def delete(self) -> None:
+    def delete(self, server) -> None:
         with self.connection.cursor() as cursor:
-            cursor.execute('DELETE FROM SERVER WHERE ID=%s', [self.id])
+            ServerRepository.DELETE.execute(cursor, [server.id])
             self.connection.commit()
-            self.logger.debug('Deleting %s from database.', self)
+            ServerRepository.cache.invalidate(server.discord_guild_id)
+            ServerRepository.members_cache.invalidate_matching(lambda key: key[0] == server.id)
+            self.logger.debug('Deleting %s from database.', server)
 
     def find_by_id(self, _id):
-        self.id = _id
         with self.connection.cursor() as cursor:
-            cursor.execute('SELECT NAME, DISCORD_GUILD_ID FROM SERVER WHERE ID=%s', [self.id])
+            ServerRepository.FIND_BY_ID.execute(cursor, [_id])
             result = cursor.fetchone()
-            self.name = result[0]
-            self.discord_guild_id = result[1]
-        return self
-
-    def find_or_create(self):
-        if not self.name or not self.discord_guild_id:
-            self.logger.error(f'Attempted to call Server.find_or_create() without setting Server.name and '
-                              f'Server.discord_guild_id.')
+            return Server(_id, result[0], result[1])
+
+    @staticmethod
+    def columns(alias='SERVER'):
+        return f'{alias}.ID, {alias}.NAME, {alias}.DISCORD_GUILD_ID'
+
+    @staticmethod
+    def from_row(row, identity_map=None):
+        if row[0] is None:
+            return None
+        if identity_map is None:
+            identity_map = IdentityMap()
+        return identity_map.get_or_create(Server, row[0], lambda: Server(row[0], row[1], row[2]))
+
+    def find_or_create(self, server):
+        if not server.name or not server.discord_guild_id:
+            self.logger.error('Attempted to call ServerRepository.find_or_create() without setting Server.name and '
+                              'Server.discord_guild_id.')
             return None
 
+        cached = ServerRepository.cache.get(server.discord_guild_id)
+        # A renamed guild gets a new SERVER row, so only trust the cache if the name still matches.
+        if cached is not None and cached.name == server.name:
+            server.id = cached.id
+            return server
+
         with self.connection.cursor() as cursor:
-            cursor.execute('SELECT ID FROM SERVER WHERE NAME=%s AND DISCORD_GUILD_ID=%s',
-                           (self.name, self.discord_guild_id))
+            ServerRepository.FIND.execute(cursor, (server.name, server.discord_guild_id))
             result = cursor.fetchone()
 
             if result is None:
-                self.create()
+                self.create(server)
             else:
-                self.id = result[0]
-            return self
+                server.id = result[0]
+                ServerRepository.cache.set(server.discord_guild_id,
+                                           Server(server.id, server.name, server.discord_guild_id))
+            return server
 
-    def add_member(self, _member):
+    def add_member(self, server, _member):
+        # Don't add the same member to a server more than once. Returns whether the member was newly added.
+        if ServerRepository.members_cache.get((server.id, _member.id)):
+            return False
         with self.connection.cursor() as cursor:
-            cursor.execute('SELECT * FROM SERVER_MEMBER WHERE MEMBER_ID=%s AND SERVER_ID=%s', (_member.id, self.id))
-            result = cursor.fetchall()
-            # Don't add the same member to a server more than once
-            if not result:
-                cursor.execute('INSERT INTO SERVER_MEMBER(SERVER_ID, MEMBER_ID) VALUES(%s, %s)', (self.id, _member.id))
-                self.connection.commit()
+            ServerRepository.ADD_MEMBER.execute(cursor, (server.id, _member.id))
+            self.connection.commit()
+            ServerRepository.members_cache.set((server.id, _member.id), True)
+            return cursor.rowcount > 0
 
-    def get_members(self):
+    def get_members(self, server):
         with self.connection.cursor() as cursor:
-            cursor.execute('SELECT MEMBER.ID, MEMBER.NAME, MEMBER.DISCORD_USER_ID FROM MEMBER '
-                           'INNER JOIN SERVER_MEMBER ON MEMBER.ID=SERVER_MEMBER.MEMBER_ID '
-                           'INNER JOIN SERVER ON SERVER_MEMBER.SERVER_ID=SERVER.ID WHERE SERVER.ID=%s', [self.id])
+            ServerRepository.GET_MEMBERS.execute(cursor, [server.id])
             result = cursor.fetchall()
-            return [member.Member(self.connection, item[0], item[1], item[2]) for item in result]
+            return [member.Member(item[0], item[1], item[2]) for item in result]
 
-    def get_sprints(self):
+    def get_sprints(self, server):
         with self.connection.cursor() as cursor:
-            cursor.execute('SELECT ID, START, DURATION, SERVER_ID FROM SPRINT WHERE SERVER_ID=%s', [self.id])
+            ServerRepository.GET_SPRINTS.execute(cursor, [server.id])
             result = cursor.fetchall()
-            return [sprint.Sprint(self.connection, item[0], item[1], item[2], item[3]) for item in result]
+            # Each sprint's Spr*ntathon is only given by ID, see SprintRepository.load_relations().
+            return [sprint.Sprint(item[0], item[1], int(item[2].total_seconds() // 60), server, item[3],
+                                  discord_channel_id=item[4], sprintathon_id=item[5]) for item in result]
 
-    def get_sprintathons(self):
+    def get_sprintathons(self, server):
         with self.connection.cursor() as cursor:
-            cursor.execute('SELECT ID, START, DURATION, SERVER_ID FROM SPRINTATHON WHERE SERVER_ID=%s', [self.id])
+            ServerRepository.GET_SPRINTATHONS.execute(cursor, [server.id])
             result = cursor.fetchall()
-            return [sprintathon.Sprintathon(self.connection, item[0], item[1], item[2], item[3]) for item in result]
-
-    def __repr__(self) -> str:
-        return f'Server{{id={self.id},name={self.name},discord_guild_id={self.discord_guild_id}}}'
+            return [sprintathon.Sprintathon(item[0], item[1], int(item[2].total_seconds() // 3600), server, item[3],
+                                            item[4]) for item in result]
@@ -0,0 +1,114 @@
+import logging
+import multiprocessing
+import signal
+import time
+
+
+def shards_for_process(index, shard_count, process_count) -> list:
+    return [shard_id for shard_id in range(shard_count) if shard_id % process_count == index]
+
+
+def _run_worker(target, shard_ids, shard_count) -> None:
+    # terminate() sends SIGTERM; turn it into KeyboardInterrupt so the worker shuts down the same way it does on
+    # Ctrl+C, flushing buffered submissions and closing its connection pool.
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    target(shard_ids, shard_count)
+
+
+class ShardWorker:
+    def __init__(self, index, shard_ids) -> None:
+        self.index = index
+        self.shard_ids = shard_ids
+        self.process = None
+        self.started_at = None
+        self.failures = 0
+        self.restarts = 0
+        self.restart_at = None
+        self.finished = False
+
+    def __repr__(self) -> str:
+        return f'ShardWorker{{index={self.index},shard_ids={self.shard_ids},restarts={self.restarts}}}'
+
+
+class ShardedRunner:
+    # Runs target(shard_ids, shard_count) in one process per worker, each with its own event loop, connection pool and
+    # scheduler, and restarts any worker which dies. Guilds map to shards by ID, and SCHEDULED_JOB is the source of
+    # truth for every pending phase, so a restarted worker reclaims exactly the sprints and Spr*ntathons it orphaned.
+    def __init__(self, target, shard_count, process_count, restart_delay=1.0, max_restart_delay=60.0,
+                 stable_after=60.0, poll_interval=1.0) -> None:
+        if shard_count < 1 or not 1 <= process_count <= shard_count:
+            raise ValueError(f'Invalid shard_count={shard_count}, process_count={process_count}.')
+        self.logger = logging.getLogger('sprintathon.ShardedRunner')
+        self.target = target
+        self.shard_count = shard_count
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        # A worker which stays up this long has its restart backoff reset.
+        self.stable_after = stable_after
+        self.poll_interval = poll_interval
+        self.workers = [ShardWorker(index, shards_for_process(index, shard_count, process_count))
+                        for index in range(process_count)]
+
+    def _start(self, worker) -> None:
+        worker.process = multiprocessing.Process(target=_run_worker,
+                                                 args=(self.target, worker.shard_ids, self.shard_count),
+                                                 name=f'sprintathon-worker-{worker.index}')
+        worker.process.start()
+        worker.started_at = time.monotonic()
+        worker.restart_at = None
+        self.logger.info('Started worker %i (pid %i) for shards %s of %i.', worker.index, worker.process.pid,
+                         worker.shard_ids, self.shard_count)
+
+    def _check(self, worker) -> None:
+        if worker.finished:
+            return
+        if worker.process is None:
+            if time.monotonic() >= worker.restart_at:
+                worker.restarts += 1
+                self._start(worker)
+            return
+        if worker.process.is_alive():
+            return
+
+        exitcode = worker.process.exitcode
+        worker.process = None
+        if exitcode == 0:
+            self.logger.info('Worker %i for shards %s exited.', worker.index, worker.shard_ids)
+            worker.finished = True
+            return
+        if time.monotonic() - worker.started_at >= self.stable_after:
+            worker.failures = 0
+        worker.failures += 1
+        delay = min(self.restart_delay * 2 ** (worker.failures - 1), self.max_restart_delay)
+        worker.restart_at = time.monotonic() + delay
+        self.logger.warning('Worker %i for shards %s died with exit code %s, restarting it in %.1fs to reclaim its '
+                            'sprints and Spr*ntathons.', worker.index, worker.shard_ids, exitcode, delay)
+
+    def run(self) -> None:
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        try:
+            for worker in self.workers:
+                self._start(worker)
+            while not all(worker.finished for worker in self.workers):
+                time.sleep(self.poll_interval)
+                for worker in self.workers:
+                    self._check(worker)
+        except KeyboardInterrupt:
+            self.logger.info('Stopping %i workers.', len(self.workers))
+        finally:
+            self.stop()
+
+    def stop(self, timeout=30.0) -> None:
+        processes = [worker.process for worker in self.workers if worker.process is not None]
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        for process in processes:
+            process.join(timeout)
+            if process.is_alive():
+                self.logger.warning('Worker %s did not stop within %.0fs, killing it.', process.name, timeout)
+                process.kill()
+                process.join()
+        for worker in self.workers:
+            worker.process = None
+            worker.finished = True
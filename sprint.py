@@ -1,161 +1,428 @@
 import logging
+from collections import namedtuple
 
 import sprintathon
-from dbo import Dbo
+from dbo import Dbo, IdentityMap, Repository, UnloadedRelationError
 import member
 import submission
 import server
+from queries import registry
+
+# word_counts is a list of (Member, word_count) pairs, ranked from most to fewest words. invalid holds
+# (Member, start_word_count, finish_word_count) for members whose FINISH was lower than their START, and bonus is the
+# (Member, word_count) pair awarded double points for the Spr*ntathon, if any.
+SprintResults = namedtuple('SprintResults', ['word_counts', 'missing', 'invalid', 'idle', 'bonus'])
+
+
+class ParticipantState:
+    # A member's check-ins to one sprint: the START and FINISH word counts that count towards it, and their latest
+    # check-in, which decides what the next one is and what !sprint same repeats.
+    __slots__ = ('member', 'start_word_count', 'finish_word_count', 'last_type', 'last_word_count')
+
+    def __init__(self, _member) -> None:
+        self.member = _member
+        self.start_word_count = None
+        self.finish_word_count = None
+        self.last_type = None
+        self.last_word_count = None
+
+    def record(self, submission_type, word_count) -> None:
+        # Only the first START and FINISH submissions count towards the sprint.
+        if submission_type == 'START' and self.start_word_count is None:
+            self.start_word_count = word_count
+        elif submission_type == 'FINISH' and self.finish_word_count is None:
+            self.finish_word_count = word_count
+        if submission_type is not None:
+            self.last_type = submission_type
+            self.last_word_count = word_count
+
+    @property
+    def next_submission_type(self) -> str:
+        return 'START' if self.last_type is None else 'FINISH'
+
+    def __repr__(self) -> str:
+        return f'ParticipantState{{member={self.member},start_word_count={self.start_word_count},' \
+               f'finish_word_count={self.finish_word_count},last_type={self.last_type}}}'
 
 
 class Sprint(Dbo):
-    def __init__(self, connection, _id=None, start=None, duration=0, _server=None, active=True, _sprintathon=None,
-                 discord_channel_id=None) -> None:
-        self.logger = logging.getLogger('sprintathon.Sprint')
-        super().__init__(connection)
+    __slots__ = ('id', 'start', 'duration', 'active', 'discord_channel_id', '_server', '_server_id', '_sprintathon',
+                 '_sprintathon_id')
+
+    def __init__(self, _id=None, start=None, duration=0, _server=None, active=True, _sprintathon=None,
+                 discord_channel_id=None, server_id=None, sprintathon_id=None) -> None:
         self.id = _id
         self.start = start
         self.duration = duration
-        self.server = _server
         self.active = active
-        self.sprintathon = _sprintathon
         self.discord_channel_id = discord_channel_id
+        # The Server and Sprintathon can be given by ID alone, until SprintRepository.load_relations() loads them.
+        self._server = _server
+        self._server_id = server_id
+        self._sprintathon = _sprintathon
+        self._sprintathon_id = sprintathon_id
 
-    def create(self) -> int:
+    @property
+    def server(self):
+        if self._server is None and self._server_id is not None:
+            raise UnloadedRelationError(f'Sprint {self.id} only has the ID of its Server, {self._server_id}.')
+        return self._server
+
+    @server.setter
+    def server(self, value) -> None:
+        self._server = value
+        self._server_id = None
+
+    @property
+    def server_id(self):
+        return self._server.id if self._server is not None else self._server_id
+
+    @property
+    def sprintathon(self):
+        if self._sprintathon is None and self._sprintathon_id is not None:
+            raise UnloadedRelationError(f'Sprint {self.id} only has the ID of its Sprintathon, '
+                                        f'{self._sprintathon_id}.')
+        return self._sprintathon
+
+    @sprintathon.setter
+    def sprintathon(self, value) -> None:
+        self._sprintathon = value
+        self._sprintathon_id = None
+
+    @property
+    def sprintathon_id(self):
+        return self._sprintathon.id if self._sprintathon is not None else self._sprintathon_id
+
+    def __repr__(self) -> str:
+        # IDs only, so logging a sprint never needs its Server or Sprintathon.
+        return f'Sprint{{id={self.id},start={self.start},duration={self.duration},server_id={self.server_id},' \
+               f'active={self.active},sprintathon_id={self.sprintathon_id},' \
+               f'discord_channel_id={self.discord_channel_id}}}'
+
+    def time_is_up_message(self, members) -> str:
+        current_sprint_members = ','.join([f'<@{_member.discord_user_id}>' for _member in members])
+        return f':alarm_clock: :alarm_clock: :alarm_clock: Time is up! You have 7 minutes to enter your word count. ' \
+               f'Type !sprint [word count] with your ending word count to conclude this sprint.  :alarm_clock: ' \
+               f':alarm_clock: :alarm_clock:\n    {current_sprint_members} - don\'t forget to check in with your ' \
+               f'ending word count! '
+
+
+class SprintRepository(Repository):
+    __slots__ = ()
+    logger = logging.getLogger('sprintathon.SprintRepository')
+    # Joins needed by SprintRepository.columns(), to hydrate a sprint's Server and Sprintathon from the same row.
+    JOINS = 'LEFT JOIN SERVER ON SPRINT.SERVER_ID=SERVER.ID ' \
+            'LEFT JOIN SPRINTATHON ON SPRINT.SPRINTATHON_ID=SPRINTATHON.ID ' \
+            'LEFT JOIN SERVER AS SPRINTATHON_SERVER ON SPRINTATHON.SERVER_ID=SPRINTATHON_SERVER.ID'
+
+    # Every member of a sprint with each of their START/FINISH submissions, as (SPRINT_ID, MEMBER.ID, MEMBER.NAME,
+    # MEMBER.DISCORD_USER_ID, SUBMISSION.TYPE, SUBMISSION.WORD_COUNT) rows. Members that haven't submitted anything get
+    # a single row with a NULL TYPE.
+    PARTICIPANTS_QUERY = 'SELECT SPRINT_MEMBER.SPRINT_ID, MEMBER.ID, MEMBER.NAME, MEMBER.DISCORD_USER_ID, ' \
+                         'SUBMISSION.TYPE, SUBMISSION.WORD_COUNT ' \
+                         'FROM SPRINT_MEMBER INNER JOIN MEMBER ON SPRINT_MEMBER.MEMBER_ID=MEMBER.ID ' \
+                         'LEFT JOIN (SPRINT_SUBMISSION ' \
+                         'INNER JOIN SUBMISSION ON SPRINT_SUBMISSION.SUBMISSION_ID=SUBMISSION.ID) ' \
+                         'ON SPRINT_SUBMISSION.SPRINT_ID=SPRINT_MEMBER.SPRINT_ID AND SUBMISSION.MEMBER_ID=MEMBER.ID ' \
+                         'AND SUBMISSION.TYPE IN (\'START\', \'FINISH\')'
+
+    CREATE = registry.register('sprint_create',
+                               'INSERT INTO SPRINT(START, DURATION, SERVER_ID, SPRINTATHON_ID, ACTIVE, '
+                               'DISCORD_CHANNEL_ID) '
+                               'VALUES(COALESCE(%s, NOW()), MAKE_INTERVAL(mins => %s), %s, %s, %s, %s) '
+                               'RETURNING ID, START')
+    UPDATE = registry.register('sprint_update',
+                               'UPDATE SPRINT SET START = COALESCE(%s, NOW()), DURATION = MAKE_INTERVAL(mins => %s), '
+                               'SERVER_ID = %s, SPRINTATHON_ID = %s, ACTIVE = %s, DISCORD_CHANNEL_ID = %s WHERE ID=%s '
+                               'RETURNING START')
+    # SprintRepository.columns() reaches into the Server and Sprintathon repositories, which may not be imported yet.
+    FETCH = registry.register('sprint_fetch',
+                              lambda: f'SELECT {SprintRepository.columns()} FROM SPRINT {SprintRepository.JOINS} '
+                                      f'WHERE SPRINT.ID=%s')
+    DELETE = registry.register('sprint_delete', 'DELETE FROM SPRINT WHERE ID=%s')
+    GET_MEMBERS = registry.register('sprint_get_members',
+                                    'SELECT MEMBER.ID, MEMBER.NAME, MEMBER.DISCORD_USER_ID FROM MEMBER '
+                                    'INNER JOIN SPRINT_MEMBER ON MEMBER.ID=SPRINT_MEMBER.MEMBER_ID '
+                                    'INNER JOIN SPRINT ON SPRINT_MEMBER.SPRINT_ID=SPRINT.ID WHERE SPRINT.ID=%s')
+    ADD_MEMBER = registry.register('sprint_add_member',
+                                   'INSERT INTO SPRINT_MEMBER(SPRINT_ID, MEMBER_ID) VALUES(%s, %s) '
+                                   'ON CONFLICT DO NOTHING')
+    GET_SUBMISSIONS = registry.register('sprint_get_submissions',
+                                        'SELECT SUBMISSION.ID, SUBMISSION.WORD_COUNT, SUBMISSION.TYPE, '
+                                        'SUBMISSION.DATETIME, MEMBER.ID, MEMBER.NAME, MEMBER.DISCORD_USER_ID '
+                                        'FROM SUBMISSION '
+                                        'INNER JOIN SPRINT_SUBMISSION ON SUBMISSION.ID=SPRINT_SUBMISSION.SUBMISSION_ID '
+                                        'INNER JOIN MEMBER ON SUBMISSION.MEMBER_ID=MEMBER.ID '
+                                        'WHERE SPRINT_SUBMISSION.SPRINT_ID=%s')
+    ADD_SUBMISSION = registry.register('sprint_add_submission',
+                                       'INSERT INTO SPRINT_SUBMISSION(SPRINT_ID, SUBMISSION_ID) VALUES(%s, %s)')
+    LINK_SUBMISSIONS = registry.register('sprint_link_submissions',
+                                         'INSERT INTO SPRINT_SUBMISSION(SPRINT_ID, SUBMISSION_ID) VALUES %s',
+                                         prepare=False)
+    LINK_MEMBERS = registry.register('sprint_link_members',
+                                     'INSERT INTO SPRINT_MEMBER(SPRINT_ID, MEMBER_ID) VALUES %s ON CONFLICT DO NOTHING',
+                                     prepare=False)
+    GET_PARTICIPANTS = registry.register('sprint_get_participants',
+                                         f'{PARTICIPANTS_QUERY} WHERE SPRINT_MEMBER.SPRINT_ID=%s '
+                                         f'ORDER BY SUBMISSION.DATETIME, SUBMISSION.ID')
+    # Only the given members, through the SPRINT_MEMBER primary key.
+    GET_PARTICIPANTS_FOR_MEMBERS = registry.register('sprint_get_participants_for_members',
+                                                     f'{PARTICIPANTS_QUERY} WHERE SPRINT_MEMBER.SPRINT_ID=%s '
+                                                     f'AND SPRINT_MEMBER.MEMBER_ID = ANY(%s) '
+                                                     f'ORDER BY SUBMISSION.DATETIME, SUBMISSION.ID')
+    GET_SPRINTATHON_ACTIVE = registry.register('sprint_get_sprintathon_active',
+                                               'SELECT ACTIVE FROM SPRINTATHON WHERE ID=%s')
+    DEACTIVATE = registry.register('sprint_deactivate', 'UPDATE SPRINT SET ACTIVE = FALSE WHERE ID=%s')
+    GET_ACTIVE = registry.register('sprint_get_active',
+                                   lambda: f'SELECT {SprintRepository.columns()} FROM SPRINT '
+                                           f'{SprintRepository.JOINS} WHERE SPRINT.ACTIVE=TRUE')
+    GET_ACTIVE_PARTICIPANTS = registry.register('sprint_get_active_participants',
+                                                f'{PARTICIPANTS_QUERY} '
+                                                f'INNER JOIN SPRINT ON SPRINT_MEMBER.SPRINT_ID=SPRINT.ID '
+                                                f'WHERE SPRINT.ACTIVE=TRUE ORDER BY SUBMISSION.DATETIME, SUBMISSION.ID')
+    GET_MOST_RECENT_ACTIVE = registry.register(
+        'sprint_get_most_recent_active',
+        lambda: f'SELECT {SprintRepository.columns()} FROM SPRINT {SprintRepository.JOINS} '
+                f'WHERE SPRINT.ACTIVE=TRUE AND SPRINT.SERVER_ID = %s AND SPRINT.DISCORD_CHANNEL_ID = %s '
+                f'ORDER BY SPRINT.START DESC LIMIT 1')
+
+    def create(self, _sprint) -> int:
         with self.connection.cursor() as cursor:
-            if not self.start:
-                start = 'NOW()'
-            else:
-                start = self.start
-            sprintathon_id = None
-            if self.sprintathon is not None:
-                sprintathon_id = self.sprintathon.id
-            cursor.execute(
-                'INSERT INTO SPRINT(START, DURATION, SERVER_ID, SPRINTATHON_ID, ACTIVE, DISCORD_CHANNEL_ID) '
-                'VALUES(%s, MAKE_INTERVAL(mins => %s), %s, %s, %s, %s) RETURNING ID, START',
-                [start, self.duration, self.server.id, sprintathon_id, self.active, self.discord_channel_id])
+            SprintRepository.CREATE.execute(cursor, [_sprint.start, _sprint.duration, _sprint.server_id,
+                                                     _sprint.sprintathon_id, _sprint.active,
+                                                     _sprint.discord_channel_id])
             result = cursor.fetchone()
-            self.id = result[0]
-            if not self.start:
-                self.start = result[1]
+            _sprint.id = result[0]
+            if not _sprint.start:
+                _sprint.start = result[1]
             self.connection.commit()
-            self.logger.debug('Inserting %s into database.', self)
-            return self.id
+            self.logger.debug('Inserting %s into database.', _sprint)
+            return _sprint.id
 
-    def update(self) -> None:
+    def update(self, _sprint) -> None:
         with self.connection.cursor() as cursor:
-            if not self.start:
-                start = 'NOW()'
-            else:
-                start = self.start
-            sprintathon_id = None
-            if self.sprintathon is not None:
-                sprintathon_id = self.sprintathon.id
-            cursor.execute(
-                'UPDATE SPRINT SET START = %s, DURATION = MAKE_INTERVAL(mins => %s), SERVER_ID = %s, '
-                'SPRINTATHON_ID = %s, ACTIVE = %s, DISCORD_CHANNEL_ID = %s WHERE ID=%s RETURNING START',
-                (start, self.duration, self.server.id, sprintathon_id, self.active, self.discord_channel_id, self.id))
+            SprintRepository.UPDATE.execute(cursor, (_sprint.start, _sprint.duration, _sprint.server_id,
+                                                     _sprint.sprintathon_id, _sprint.active,
+                                                     _sprint.discord_channel_id, _sprint.id))
             result = cursor.fetchone()
-            if not self.start:
-                self.start = result[0]
+            if not _sprint.start:
+                _sprint.start = result[0]
             self.connection.commit()
-            self.logger.debug('Updating %s in database.', self)
+            self.logger.debug('Updating %s in database.', _sprint)
 
-    def fetch(self) -> None:
-        with self.connection.cursor() as cursor:
-            cursor.execute('SELECT START, DURATION, SERVER_ID, SPRINTATHON_ID, ACTIVE, DISCORD_CHANNEL_ID FROM SPRINT '
-                           'WHERE ID=%s', [self.id])
-            result = cursor.fetchone()
-            self.start = result[0]
-            self.duration = int(result[1].total_seconds() // 60)
-            self.server = server.Server(self.connection).find_by_id(result[2])
-            self.sprintathon = sprintathon.Sprintathon(self.connection).find_by_id(result[3])
-            self.active = result[4]
-            self.discord_channel_id = result[5]
-
-    def delete(self) -> None:
+    def delete(self, _sprint) -> None:
         with self.connection.cursor() as cursor:
-            cursor.execute('DELETE FROM SPRINT WHERE ID=%s', [self.id])
+            SprintRepository.DELETE.execute(cursor, [_sprint.id])
             self.connection.commit()
-            self.logger.debug('Deleting %s from database.', self)
+            self.logger.debug('Deleting %s from database.', _sprint)
 
     def find_by_id(self, _id):
-        self.id = _id
-        self.fetch()
-        return self
+        # The sprint with its Server and Sprintathon, from one joined row.
+        with self.connection.cursor() as cursor:
+            SprintRepository.FETCH.execute(cursor, [_id])
+            result = cursor.fetchone()
+            if result is None:
+                return None
+            return SprintRepository.from_row(result)
 
-    def get_members(self):
+    def load_relations(self, _sprint):
+        # Loads whichever of the sprint's Server and Sprintathon were only given by ID, so they can be read anywhere.
+        if _sprint._server is None and _sprint._server_id is not None:
+            _sprint.server = server.ServerRepository(self.connection).find_by_id(_sprint._server_id)
+        if _sprint._sprintathon is None and _sprint._sprintathon_id is not None:
+            _sprint.sprintathon = sprintathon.SprintathonRepository(self.connection).find_by_id(
+                _sprint._sprintathon_id)
+        return _sprint
+
+    @staticmethod
+    def columns():
+        return f'SPRINT.ID, SPRINT.START, SPRINT.DURATION, SPRINT.ACTIVE, SPRINT.DISCORD_CHANNEL_ID, ' \
+               f'{server.ServerRepository.columns()}, ' \
+               f'{sprintathon.SprintathonRepository.columns("SPRINTATHON", "SPRINTATHON_SERVER")}'
+
+    @staticmethod
+    def from_row(row, identity_map=None):
+        if identity_map is None:
+            identity_map = IdentityMap()
+        return Sprint(row[0], row[1], int(row[2].total_seconds() // 60),
+                      server.ServerRepository.from_row(row[5:8], identity_map), row[3],
+                      sprintathon.SprintathonRepository.from_row(row[8:], identity_map), row[4])
+
+    def get_members(self, _sprint):
         with self.connection.cursor() as cursor:
-            cursor.execute(
-                'SELECT MEMBER.ID, MEMBER.NAME, MEMBER.DISCORD_USER_ID FROM MEMBER '
-                'INNER JOIN SPRINT_MEMBER ON MEMBER.ID=SPRINT_MEMBER.MEMBER_ID '
-                'INNER JOIN SPRINT ON SPRINT_MEMBER.SPRINT_ID=SPRINT.ID WHERE SPRINT.ID=%s',
-                [self.id])
+            SprintRepository.GET_MEMBERS.execute(cursor, [_sprint.id])
             result = cursor.fetchall()
-            return [member.Member(self.connection, item[0], item[1], item[2]) for item in result]
+            return [member.Member(item[0], item[1], item[2]) for item in result]
 
-    def add_member(self, _member):
+    def add_member(self, _sprint, _member):
+        # Don't add the same member to a sprint more than once. Returns whether the member was newly added.
         with self.connection.cursor() as cursor:
-            cursor.execute('SELECT * FROM SPRINT_MEMBER WHERE MEMBER_ID=%s AND SPRINT_ID=%s', (_member.id, self.id))
-            result = cursor.fetchall()
-            # Don't add the same member to a sprint more than once
-            if not result:
-                cursor.execute('INSERT INTO SPRINT_MEMBER(SPRINT_ID, MEMBER_ID) VALUES(%s, %s)', (self.id, _member.id))
-                self.connection.commit()
+            SprintRepository.ADD_MEMBER.execute(cursor, (_sprint.id, _member.id))
+            self.connection.commit()
+            return cursor.rowcount > 0
 
-    def get_submissions(self):
+    def get_submissions(self, _sprint, identity_map=None):
+        if identity_map is None:
+            identity_map = IdentityMap()
         with self.connection.cursor() as cursor:
-            cursor.execute(
-                'SELECT SUBMISSION.ID, SUBMISSION.MEMBER_ID, SUBMISSION.WORD_COUNT, SUBMISSION.TYPE FROM SUBMISSION '
-                'INNER JOIN SPRINT_SUBMISSION ON SUBMISSION.ID=SPRINT_SUBMISSION.SUBMISSION_ID '
-                'INNER JOIN SPRINT ON SPRINT_SUBMISSION.SPRINT_ID=SPRINT.ID WHERE SPRINT.ID=%s',
-                [self.id])
+            SprintRepository.GET_SUBMISSIONS.execute(cursor, [_sprint.id])
             result = cursor.fetchall()
-            return [submission.Submission(self.connection, item[0],
-                                          member.Member(connection=self.connection).find_by_id(item[1]), item[2],
-                                          item[3]) for item in result]
+            return [submission.Submission(
+                item[0],
+                identity_map.get_or_create(member.Member, item[4],
+                                           lambda item=item: member.Member(item[4], item[5], item[6])),
+                item[1], item[2], item[3]) for item in result]
 
-    def add_submission(self, _submission):
+    def add_submission(self, _sprint, _submission):
         with self.connection.cursor() as cursor:
             if not _submission.id:
-                _submission.create()
-            cursor.execute('INSERT INTO SPRINT_SUBMISSION(SPRINT_ID, SUBMISSION_ID) VALUES(%s, %s)',
-                           (self.id, _submission.id))
+                submission.SubmissionRepository(self.connection).create(_submission)
+            SprintRepository.ADD_SUBMISSION.execute(cursor, (_sprint.id, _submission.id))
             self.connection.commit()
-            if self.sprintathon is not None:
-                self.sprintathon.add_submission(_submission)
+            if _sprint.sprintathon_id is not None:
+                sprintathon.SprintathonRepository(self.connection).add_submission(_sprint.sprintathon_id, _submission)
+
+    def link_submissions(self, cursor, _sprint, submissions):
+        # Attaches already-created submissions with one multi-row INSERT on the caller's cursor.
+        if not submissions:
+            return
+        SprintRepository.LINK_SUBMISSIONS.execute_values(cursor, [(_sprint.id, item.id) for item in submissions])
+
+    def add_all_submissions(self, entries):
+        # Records (Sprint, Submission) pairs from any number of sprints in one transaction: the submissions themselves,
+        # their members' SPRINT_MEMBER rows, and their SPRINT_SUBMISSION/SPRINTATHON_SUBMISSION rows.
+        if not entries:
+            return
+        inserted = [item for _, item in entries if not item.id]
+        stamps = [item.datetime for item in inserted]
+        try:
+            with self.connection.cursor() as cursor:
+                submission.SubmissionRepository.insert_all(cursor, inserted)
+                SprintRepository.LINK_MEMBERS.execute_values(
+                    cursor, list({(_sprint.id, item.member.id) for _sprint, item in entries}))
+                SprintRepository.LINK_SUBMISSIONS.execute_values(cursor,
+                                                                 [(_sprint.id, item.id) for _sprint, item in entries])
+                sprintathon_rows = [(_sprint.sprintathon_id, item.id) for _sprint, item in entries
+                                    if _sprint.sprintathon_id is not None]
+                if sprintathon_rows:
+                    sprintathon.SprintathonRepository.LINK_SUBMISSIONS.execute_values(cursor, sprintathon_rows)
+                self.connection.commit()
+        except Exception:
+            # The IDs RETURNING handed out were rolled back with the transaction, so a retry has to insert these
+            # submissions again rather than link rows that no longer exist.
+            for item, stamp in zip(inserted, stamps):
+                item.id = None
+                item.datetime = stamp
+            raise
+        for sprintathon_id in {_sprint.sprintathon_id for _sprint, _ in entries if _sprint.sprintathon_id is not None}:
+            sprintathon.SprintathonRepository.invalidate_leaderboard(sprintathon_id)
 
     @staticmethod
-    def get_active(connection):
-        with connection.cursor() as cursor:
-            cursor.execute('SELECT ID, START, DURATION, SERVER_ID, ACTIVE, SPRINTATHON_ID, DISCORD_CHANNEL_ID '
-                           'FROM SPRINT WHERE ACTIVE=TRUE')
+    def participant_states(rows) -> dict:
+        # Folds PARTICIPANTS_QUERY rows, oldest submission first, into MEMBER.ID -> ParticipantState.
+        states = dict()
+        for item in rows:
+            state = states.get(item[1])
+            if state is None:
+                state = states[item[1]] = ParticipantState(member.Member(item[1], item[2], item[3]))
+            state.record(item[4], item[5])
+        return states
+
+    def get_participant_states(self, _sprint, members=None) -> dict:
+        # The state of every member of the sprint, or of just the given members, in one round trip.
+        with self.connection.cursor() as cursor:
+            if members is None:
+                SprintRepository.GET_PARTICIPANTS.execute(cursor, [_sprint.id])
+            else:
+                SprintRepository.GET_PARTICIPANTS_FOR_MEMBERS.execute(cursor,
+                                                                      (_sprint.id, [item.id for item in members]))
+            return SprintRepository.participant_states(cursor.fetchall())
+
+    def finalize(self, _sprint):
+        # Computes every member's DELTA from their START/FINISH submissions, records the DELTA (and Spr*ntathon BONUS)
+        # submissions, and deactivates the sprint, all in a single transaction.
+        with self.connection.cursor() as cursor:
+            SprintRepository.GET_PARTICIPANTS.execute(cursor, [_sprint.id])
+            states = SprintRepository.participant_states(cursor.fetchall())
+
+            word_counts = []
+            missing = []
+            invalid = []
+            idle = []
+            for state in states.values():
+                sprint_member = state.member
+                start_word_count = state.start_word_count
+                finish_word_count = state.finish_word_count
+                if start_word_count is None or finish_word_count is None:
+                    missing.append(sprint_member)
+                    continue
+                if finish_word_count < start_word_count:
+                    invalid.append((sprint_member, start_word_count, finish_word_count))
+                    continue
+                if finish_word_count == start_word_count:
+                    idle.append(sprint_member)
+                word_counts.append((sprint_member, finish_word_count - start_word_count))
+            word_counts.sort(key=lambda item: item[1], reverse=True)
+
+            deltas = [submission.Submission(member=sprint_member, word_count=word_count, _type='DELTA')
+                      for sprint_member, word_count in word_counts]
+            bonus = None
+            bonus_submissions = []
+            sprintathon_id = _sprint.sprintathon_id
+            sprintathon_active = False
+            if sprintathon_id is not None:
+                # The Spr*ntathon may have been stopped since this sprint was loaded.
+                SprintRepository.GET_SPRINTATHON_ACTIVE.execute(cursor, [sprintathon_id])
+                sprintathon_active = cursor.fetchone()[0]
+                if _sprint._sprintathon is not None:
+                    _sprint._sprintathon.active = sprintathon_active
+            # If there is a sprintathon currently active, award the 1st place member double points.
+            if sprintathon_active and word_counts:
+                bonus = word_counts[0]
+                bonus_submissions.append(submission.Submission(member=bonus[0], word_count=bonus[1], _type='BONUS'))
+
+            submission.SubmissionRepository.insert_all(cursor, deltas + bonus_submissions)
+            self.link_submissions(cursor, _sprint, deltas)
+            if sprintathon_id is not None:
+                sprintathon.SprintathonRepository.link_submissions(cursor, sprintathon_id, deltas + bonus_submissions)
+
+            SprintRepository.DEACTIVATE.execute(cursor, [_sprint.id])
+            _sprint.active = False
+            self.connection.commit()
+            if sprintathon_id is not None and (deltas or bonus_submissions):
+                sprintathon.SprintathonRepository.invalidate_leaderboard(sprintathon_id)
+            self.logger.debug('Finalized %s with %i DELTA submissions.', _sprint, len(deltas))
+            return SprintResults(word_counts, missing, invalid, idle, bonus)
+
+    def get_active(self, identity_map=None):
+        if identity_map is None:
+            identity_map = IdentityMap()
+        with self.connection.cursor() as cursor:
+            SprintRepository.GET_ACTIVE.execute(cursor)
             result = cursor.fetchall()
-            return [Sprint(connection, item[0], item[1], int(item[2].total_seconds() // 60),
-                           server.Server(connection).find_by_id(item[3]), item[4],
-                           sprintathon.Sprintathon(connection).find_by_id(item[5]), item[6]) for item in result]
+            return [SprintRepository.from_row(item, identity_map) for item in result]
 
-    @staticmethod
-    def get_most_recent_active(connection, _server, channel_id):
-        with connection.cursor() as cursor:
-            cursor.execute('SELECT ID, START, DURATION, SPRINTATHON_ID FROM SPRINT '
-                           'WHERE ACTIVE=TRUE AND SERVER_ID = %s AND DISCORD_CHANNEL_ID = %s '
-                           'ORDER BY START DESC LIMIT 1', [_server.id, channel_id])
+    def get_active_participants(self):
+        # Returns (SPRINT_ID, Member, TYPE, WORD_COUNT) for every member of every active sprint, oldest submission
+        # first, in one query.
+        with self.connection.cursor() as cursor:
+            SprintRepository.GET_ACTIVE_PARTICIPANTS.execute(cursor)
+            result = cursor.fetchall()
+            identity_map = IdentityMap()
+            return [(item[0], identity_map.get_or_create(
+                member.Member, item[1], lambda item=item: member.Member(item[1], item[2], item[3])),
+                     item[4], item[5]) for item in result]
+
+    def get_most_recent_active(self, _server, channel_id):
+        with self.connection.cursor() as cursor:
+            SprintRepository.GET_MOST_RECENT_ACTIVE.execute(cursor, [_server.id, channel_id])
             result = cursor.fetchone()
             if result is None:
                 return None
-            return Sprint(connection, result[0], result[1], int(result[2].total_seconds() // 60), _server, True,
-                          sprintathon.Sprintathon(connection).find_by_id(result[3]), channel_id)
-
-    def __repr__(self) -> str:
-        return f'Sprint{{id={self.id},start={self.start},duration={self.duration},server={self.server},' \
-               f'active={self.active},sprintathon={self.sprintathon},discord_channel_id={self.discord_channel_id}}}'
+            _sprint = SprintRepository.from_row(result)
+            _sprint.server = _server
+            return _sprint
 
-    def time_is_up_message(self) -> str:
-        current_sprint_members = ','.join([f'<@{_member.discord_user_id}>' for _member in self.get_members()])
-        return f':alarm_clock: :alarm_clock: :alarm_clock: Time is up! You have 7 minutes to enter your word count. ' \
-               f'Type !sprint [word count] with your ending word count to conclude this sprint.  :alarm_clock: ' \
-               f':alarm_clock: :alarm_clock:\n    {current_sprint_members} - don\'t forget to check in with your ' \
-               f'ending word count! '
     # def get_word_count(self, member, count_type):
     #     with self.connection.cursor() as cursor:
     #         cursor.execute(
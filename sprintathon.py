@@ -1,151 +1,295 @@
 import logging
+from collections import namedtuple
 
-from dbo import Dbo
+from dbo import Dbo, IdentityMap, Repository, UnloadedRelationError
+from leaderboard import LeaderboardCache
 from member import Member
+from queries import registry
 import server
 
+LeaderboardEntry = namedtuple('LeaderboardEntry', ['member', 'word_count', 'bonus_word_count', 'wpm'])
+# entries holds (rank, LeaderboardEntry) pairs, and total the number of members on the whole leaderboard.
+LeaderboardPage = namedtuple('LeaderboardPage', ['entries', 'total'])
+
 
 class Sprintathon(Dbo):
-    def __init__(self, connection, _id=None, start=None, duration=0, _server=None, active=True,
-                 discord_channel_id=None) -> None:
-        self.logger = logging.getLogger('sprintathon.Sprintathon')
-        super().__init__(connection)
-        self.connection = connection
+    __slots__ = ('id', 'start', 'duration', 'active', 'discord_channel_id', '_server', '_server_id')
+
+    def __init__(self, _id=None, start=None, duration=0, _server=None, active=True, discord_channel_id=None,
+                 server_id=None) -> None:
         self.id = _id
         self.start = start
         self.duration = duration
-        self.server = _server
         self.active = active
         self.discord_channel_id = discord_channel_id
+        # As with Sprint, a Server given by ID alone has to be loaded by SprintathonRepository.load_relations().
+        self._server = _server
+        self._server_id = server_id
+
+    @property
+    def server(self):
+        if self._server is None and self._server_id is not None:
+            raise UnloadedRelationError(f'Sprintathon {self.id} only has the ID of its Server, {self._server_id}.')
+        return self._server
+
+    @server.setter
+    def server(self, value) -> None:
+        self._server = value
+        self._server_id = None
 
-    def create(self) -> int:
+    @property
+    def server_id(self):
+        return self._server.id if self._server is not None else self._server_id
+
+    def __repr__(self) -> str:
+        return f'Sprintathon{{id={self.id},start={self.start},duration={self.duration},server_id={self.server_id},' \
+               f'discord_channel_id={self.discord_channel_id}}}'
+
+
+class SprintathonRepository(Repository):
+    __slots__ = ()
+    logger = logging.getLogger('sprintathon.SprintathonRepository')
+    # The number of columns selected by SprintathonRepository.columns() (its own five, plus those of
+    # ServerRepository.columns()), for slicing joined rows.
+    COLUMN_COUNT = 8
+    leaderboard_cache = LeaderboardCache()
+
+    CREATE = registry.register('sprintathon_create',
+                               'INSERT INTO SPRINTATHON(START, DURATION, SERVER_ID, ACTIVE, DISCORD_CHANNEL_ID) '
+                               'VALUES(COALESCE(%s, NOW()), MAKE_INTERVAL(hours => %s), %s, %s, %s) '
+                               'RETURNING ID, START')
+    UPDATE = registry.register('sprintathon_update',
+                               'UPDATE SPRINTATHON SET START = COALESCE(%s, NOW()), '
+                               'DURATION = MAKE_INTERVAL(hours => %s), SERVER_ID = %s, ACTIVE = %s, '
+                               'DISCORD_CHANNEL_ID = %s WHERE ID=%s RETURNING START')
+    DELETE = registry.register('sprintathon_delete', 'DELETE FROM SPRINTATHON WHERE ID=%s')
+    # SprintathonRepository.columns() reaches into ServerRepository, which may not be imported yet.
+    FETCH = registry.register('sprintathon_fetch',
+                              lambda: f'SELECT {SprintathonRepository.columns()} FROM SPRINTATHON '
+                                      f'LEFT JOIN SERVER ON SPRINTATHON.SERVER_ID=SERVER.ID WHERE SPRINTATHON.ID=%s')
+    ADD_SUBMISSION = registry.register('sprintathon_add_submission',
+                                       'INSERT INTO SPRINTATHON_SUBMISSION(SPRINTATHON_ID, SUBMISSION_ID) '
+                                       'VALUES(%s, %s)')
+    LINK_SUBMISSIONS = registry.register('sprintathon_link_submissions',
+                                         'INSERT INTO SPRINTATHON_SUBMISSION(SPRINTATHON_ID, SUBMISSION_ID) VALUES %s',
+                                         prepare=False)
+    GET_MEMBERS = registry.register('sprintathon_get_members',
+                                    'SELECT DISTINCT MEMBER.ID, MEMBER.NAME, MEMBER.DISCORD_USER_ID FROM MEMBER '
+                                    'INNER JOIN SUBMISSION ON MEMBER.ID=SUBMISSION.MEMBER_ID '
+                                    'INNER JOIN SPRINTATHON_SUBMISSION ON '
+                                    'SUBMISSION.ID=SPRINTATHON_SUBMISSION.SUBMISSION_ID '
+                                    'WHERE SPRINTATHON_SUBMISSION.SPRINTATHON_ID=%s')
+    GET_WORD_COUNT = registry.register('sprintathon_get_word_count',
+                                       'SELECT WORD_COUNT FROM SPRINTATHON_MEMBER_TOTALS '
+                                       'WHERE SPRINTATHON_ID=%s AND MEMBER_ID=%s')
+    GET_BONUS_WORD_COUNT = registry.register('sprintathon_get_bonus_word_count',
+                                             'SELECT BONUS_WORD_COUNT FROM SPRINTATHON_MEMBER_TOTALS '
+                                             'WHERE SPRINTATHON_ID=%s AND MEMBER_ID=%s')
+    GET_LEADERBOARD = registry.register(
+        'sprintathon_get_leaderboard',
+        'SELECT MEMBER.ID, MEMBER.NAME, MEMBER.DISCORD_USER_ID, TOTALS.WORD_COUNT, TOTALS.BONUS_WORD_COUNT, '
+        'CAST(COALESCE(CEIL(TOTALS.WORD_COUNT / NULLIF(%s * 60.0, 0)), 0) AS INTEGER) AS WPM '
+        'FROM SPRINTATHON_MEMBER_TOTALS AS TOTALS INNER JOIN MEMBER ON TOTALS.MEMBER_ID=MEMBER.ID '
+        'WHERE TOTALS.SPRINTATHON_ID=%s '
+        'ORDER BY TOTALS.WORD_COUNT + TOTALS.BONUS_WORD_COUNT DESC, MEMBER.ID')
+    GET_LEADERBOARD_PAGE = registry.register(
+        'sprintathon_get_leaderboard_page',
+        'SELECT RANK, MEMBER.ID, MEMBER.NAME, MEMBER.DISCORD_USER_ID, RANKED.WORD_COUNT, '
+        'RANKED.BONUS_WORD_COUNT, CAST(COALESCE(CEIL(RANKED.WORD_COUNT / NULLIF(%s * 60.0, 0)), 0) AS INTEGER), '
+        'TOTAL '
+        'FROM (SELECT MEMBER_ID, WORD_COUNT, BONUS_WORD_COUNT, COUNT(*) OVER () AS TOTAL, '
+        'ROW_NUMBER() OVER (ORDER BY WORD_COUNT + BONUS_WORD_COUNT DESC, MEMBER_ID) AS RANK '
+        'FROM SPRINTATHON_MEMBER_TOTALS WHERE SPRINTATHON_ID=%s) AS RANKED '
+        'INNER JOIN MEMBER ON RANKED.MEMBER_ID=MEMBER.ID '
+        'WHERE RANKED.RANK <= %s OR MEMBER.DISCORD_USER_ID=%s ORDER BY RANKED.RANK')
+    # Only run by hand, so there's no point preparing it. SQLite has no stored functions, so it runs the body of
+    # REBUILD_SPRINTATHON_MEMBER_TOTALS() itself, and needs no lock as it only ever has one writer.
+    REBUILD_TOTALS = registry.register(
+        'sprintathon_rebuild_totals', 'SELECT REBUILD_SPRINTATHON_MEMBER_TOTALS(%s)', prepare=False,
+        dialects={'sqlite': (
+            'DELETE FROM SPRINTATHON_MEMBER_TOTALS WHERE ?1 IS NULL OR SPRINTATHON_ID = ?1',
+            'INSERT INTO SPRINTATHON_MEMBER_TOTALS(SPRINTATHON_ID, MEMBER_ID, WORD_COUNT, BONUS_WORD_COUNT) '
+            'SELECT SPRINTATHON_SUBMISSION.SPRINTATHON_ID, SUBMISSION.MEMBER_ID, '
+            'COALESCE(SUM(SUBMISSION.WORD_COUNT) FILTER (WHERE SUBMISSION.TYPE = \'DELTA\'), 0), '
+            'COALESCE(SUM(SUBMISSION.WORD_COUNT) FILTER (WHERE SUBMISSION.TYPE = \'BONUS\'), 0) '
+            'FROM SPRINTATHON_SUBMISSION '
+            'INNER JOIN SUBMISSION ON SPRINTATHON_SUBMISSION.SUBMISSION_ID = SUBMISSION.ID '
+            'WHERE SUBMISSION.MEMBER_ID IS NOT NULL AND SPRINTATHON_SUBMISSION.SPRINTATHON_ID IS NOT NULL '
+            'AND (?1 IS NULL OR SPRINTATHON_SUBMISSION.SPRINTATHON_ID = ?1) '
+            'GROUP BY SPRINTATHON_SUBMISSION.SPRINTATHON_ID, SUBMISSION.MEMBER_ID')})
+    GET_ACTIVE = registry.register('sprintathon_get_active',
+                                   lambda: f'SELECT {SprintathonRepository.columns()} FROM SPRINTATHON '
+                                           f'LEFT JOIN SERVER ON SPRINTATHON.SERVER_ID=SERVER.ID '
+                                           f'WHERE SPRINTATHON.ACTIVE=TRUE')
+    GET_ACTIVE_FOR_CHANNEL = registry.register('sprintathon_get_active_for_channel',
+                                               lambda: f'SELECT {SprintathonRepository.columns()} FROM SPRINTATHON '
+                                                       f'LEFT JOIN SERVER ON SPRINTATHON.SERVER_ID=SERVER.ID '
+                                                       f'WHERE SPRINTATHON.ACTIVE=TRUE '
+                                                       f'AND SPRINTATHON.DISCORD_CHANNEL_ID=%s '
+                                                       f'ORDER BY SPRINTATHON.START DESC LIMIT 1')
+    GET_MOST_RECENT_FOR_CHANNEL = registry.register('sprintathon_get_most_recent_for_channel',
+                                                    lambda: f'SELECT {SprintathonRepository.columns()} '
+                                                            f'FROM SPRINTATHON '
+                                                            f'LEFT JOIN SERVER ON SPRINTATHON.SERVER_ID=SERVER.ID '
+                                                            f'WHERE SPRINTATHON.DISCORD_CHANNEL_ID=%s '
+                                                            f'ORDER BY SPRINTATHON.START DESC LIMIT 1')
+
+    def create(self, _sprintathon) -> int:
         with self.connection.cursor() as cursor:
-            if not self.start:
-                start = 'NOW()'
-            else:
-                start = self.start
-            cursor.execute(
-                'INSERT INTO SPRINTATHON(START, DURATION, SERVER_ID, ACTIVE, DISCORD_CHANNEL_ID) '
-                'VALUES(%s, MAKE_INTERVAL(hours => %s), %s, %s, %s) RETURNING ID, START',
-                [start, self.duration, self.server.id, self.active, self.discord_channel_id])
+            SprintathonRepository.CREATE.execute(cursor, [_sprintathon.start, _sprintathon.duration,
+                                                          _sprintathon.server_id, _sprintathon.active,
+                                                          _sprintathon.discord_channel_id])
             result = cursor.fetchone()
-            self.id = result[0]
-            if not self.start:
-                self.start = result[1]
+            _sprintathon.id = result[0]
+            if not _sprintathon.start:
+                _sprintathon.start = result[1]
             self.connection.commit()
-            self.logger.debug('Inserting %s into database.', self)
-            return self.id
+            self.logger.debug('Inserting %s into database.', _sprintathon)
+            return _sprintathon.id
 
-    def update(self) -> None:
+    def update(self, _sprintathon) -> None:
         with self.connection.cursor() as cursor:
-            if not self.start:
-                start = 'NOW()'
-            else:
-                start = self.start
-            cursor.execute('UPDATE SPRINTATHON SET START = %s, DURATION = MAKE_INTERVAL(hours => %s), SERVER_ID = %s, '
-                           'ACTIVE = %s, DISCORD_CHANNEL_ID = %s WHERE ID=%s RETURNING START',
-                           (start, self.duration, self.server.id, self.active, self.discord_channel_id, self.id))
+            SprintathonRepository.UPDATE.execute(cursor, (_sprintathon.start, _sprintathon.duration,
+                                                          _sprintathon.server_id, _sprintathon.active,
+                                                          _sprintathon.discord_channel_id, _sprintathon.id))
             result = cursor.fetchone()
-            if not self.start:
-                self.start = result[0]
+            if not _sprintathon.start:
+                _sprintathon.start = result[0]
             self.connection.commit()
-            self.logger.debug('Updating %s in database.', self)
+            self.logger.debug('Updating %s in database.', _sprintathon)
 
-    def delete(self) -> None:
+    def delete(self, _sprintathon) -> None:
         with self.connection.cursor() as cursor:
-            cursor.execute('DELETE FROM SPRINTATHON WHERE ID=%s', [self.id])
+            SprintathonRepository.DELETE.execute(cursor, [_sprintathon.id])
             self.connection.commit()
-            self.logger.debug('Deleting %s from database.', self)
+            self.logger.debug('Deleting %s from database.', _sprintathon)
 
-    def fetch(self):
+    def find_by_id(self, _id):
+        # The Spr*ntathon with its Server, from one joined row.
+        if _id is None:
+            return None
         with self.connection.cursor() as cursor:
-            cursor.execute('SELECT START, DURATION, SERVER_ID, ACTIVE, DISCORD_CHANNEL_ID '
-                           'FROM SPRINTATHON WHERE ID=%s', [self.id])
+            SprintathonRepository.FETCH.execute(cursor, [_id])
             result = cursor.fetchone()
-            self.start = result[0]
-            self.duration = int(result[1].total_seconds() // 3600)
-            self.server = server.Server(self.connection).find_by_id(result[2])
-            self.active = result[3]
-            self.discord_channel_id = result[4]
+            if result is None:
+                return None
+            return SprintathonRepository.from_row(result)
 
-    def find_by_id(self, _id):
-        if _id is None:
+    def load_relations(self, _sprintathon):
+        # Loads the Server if it was only given by ID, so it can be read anywhere.
+        if _sprintathon._server is None and _sprintathon._server_id is not None:
+            _sprintathon.server = server.ServerRepository(self.connection).find_by_id(_sprintathon._server_id)
+        return _sprintathon
+
+    @staticmethod
+    def columns(alias='SPRINTATHON', server_alias='SERVER'):
+        return f'{alias}.ID, {alias}.START, {alias}.DURATION, {alias}.ACTIVE, {alias}.DISCORD_CHANNEL_ID, ' \
+               f'{server.ServerRepository.columns(server_alias)}'
+
+    @staticmethod
+    def from_row(row, identity_map=None):
+        if row[0] is None:
             return None
-        self.id = _id
-        self.fetch()
-        return self
+        if identity_map is None:
+            identity_map = IdentityMap()
+        return identity_map.get_or_create(
+            Sprintathon, row[0],
+            lambda: Sprintathon(row[0], row[1], int(row[2].total_seconds() // 3600),
+                                server.ServerRepository.from_row(row[5:], identity_map), row[3], row[4]))
 
-    def add_submission(self, submission):
+    def add_submission(self, sprintathon_id, submission):
         with self.connection.cursor() as cursor:
-            cursor.execute('INSERT INTO SPRINTATHON_SUBMISSION(SPRINTATHON_ID, SUBMISSION_ID) '
-                           'VALUES(%s, %s)', (self.id, submission.id))
+            SprintathonRepository.ADD_SUBMISSION.execute(cursor, (sprintathon_id, submission.id))
             self.connection.commit()
+            # Even a START puts its member on the leaderboard.
+            SprintathonRepository.invalidate_leaderboard(sprintathon_id)
+
+    @staticmethod
+    def invalidate_leaderboard(sprintathon_id) -> None:
+        # Called once new submissions have been committed.
+        SprintathonRepository.leaderboard_cache.invalidate(sprintathon_id)
 
-    def get_members(self):
+    @staticmethod
+    def link_submissions(cursor, sprintathon_id, submissions):
+        # Attaches already-created submissions with one multi-row INSERT on the caller's cursor. The caller has to call
+        # invalidate_leaderboard() after committing.
+        if not submissions:
+            return
+        SprintathonRepository.LINK_SUBMISSIONS.execute_values(cursor,
+                                                              [(sprintathon_id, item.id) for item in submissions])
+
+    def get_members(self, _sprintathon):
         with self.connection.cursor() as cursor:
-            cursor.execute(
-                'SELECT DISTINCT MEMBER.ID, MEMBER.NAME, MEMBER.DISCORD_USER_ID FROM MEMBER INNER JOIN SUBMISSION ON '
-                'MEMBER.ID=SUBMISSION.MEMBER_ID INNER JOIN SPRINTATHON_SUBMISSION ON '
-                'SUBMISSION.ID=SPRINTATHON_SUBMISSION.SUBMISSION_ID WHERE SPRINTATHON_SUBMISSION.SPRINTATHON_ID=%s',
-                [self.id])
+            SprintathonRepository.GET_MEMBERS.execute(cursor, [_sprintathon.id])
             result = cursor.fetchall()
-            return [Member(self.connection, item[0], item[1], item[2]) for item in result]
+            return [Member(item[0], item[1], item[2]) for item in result]
 
-    def get_word_count(self, member):
+    # The DELTA and BONUS totals below are read from SPRINTATHON_MEMBER_TOTALS, which triggers keep up to date as
+    # submissions are attached, so they cost the same no matter how many sprints the Spr*ntathon has had.
+    def get_word_count(self, _sprintathon, member):
         with self.connection.cursor() as cursor:
-            cursor.execute(
-                'SELECT COALESCE(SUM(SUBMISSION.WORD_COUNT), 0) FROM SUBMISSION INNER JOIN SPRINTATHON_SUBMISSION ON '
-                'SUBMISSION.ID=SPRINTATHON_SUBMISSION.SUBMISSION_ID WHERE SPRINTATHON_SUBMISSION.SPRINTATHON_ID=%s AND '
-                'SUBMISSION.MEMBER_ID=%s AND SUBMISSION.TYPE=%s',
-                (self.id, member.id, 'DELTA'))
-            return cursor.fetchone()[0]
-
-    def get_bonus_word_count(self, member):
+            SprintathonRepository.GET_WORD_COUNT.execute(cursor, (_sprintathon.id, member.id))
+            result = cursor.fetchone()
+            if result is None:
+                return 0
+            return result[0]
+
+    def get_bonus_word_count(self, _sprintathon, member):
         with self.connection.cursor() as cursor:
-            cursor.execute(
-                'SELECT COALESCE(SUM(SUBMISSION.WORD_COUNT), 0) FROM SUBMISSION INNER JOIN SPRINTATHON_SUBMISSION ON '
-                'SUBMISSION.ID=SPRINTATHON_SUBMISSION.SUBMISSION_ID WHERE SPRINTATHON_SUBMISSION.SPRINTATHON_ID=%s AND '
-                'SUBMISSION.MEMBER_ID=%s AND SUBMISSION.TYPE=%s',
-                (self.id, member.id, 'BONUS'))
+            SprintathonRepository.GET_BONUS_WORD_COUNT.execute(cursor, (_sprintathon.id, member.id))
             result = cursor.fetchone()
             if result is None:
                 return 0
             return result[0]
 
-    @staticmethod
-    def get_active(connection):
-        with connection.cursor() as cursor:
-            cursor.execute('SELECT ID, START, DURATION, SERVER_ID, DISCORD_CHANNEL_ID '
-                           'FROM SPRINTATHON WHERE ACTIVE=TRUE')
+    def get_leaderboard(self, _sprintathon):
+        # Ranks every member of the Spr*ntathon by their DELTA + BONUS word count in a single round trip.
+        with self.connection.cursor() as cursor:
+            SprintathonRepository.GET_LEADERBOARD.execute(cursor, (_sprintathon.duration, _sprintathon.id))
             result = cursor.fetchall()
-            return [
-                Sprintathon(connection, item[0], item[1], int(item[2].total_seconds() // 3600),
-                            server.Server(connection).find_by_id(item[3]), True, item[4]) for item in result]
+            return [LeaderboardEntry(Member(item[0], item[1], item[2]), item[3], item[4], item[5]) for item in result]
 
-    @staticmethod
-    def get_active_for_channel(connection, channel_id):
-        with connection.cursor() as cursor:
-            cursor.execute('SELECT ID, START, DURATION, SERVER_ID FROM SPRINTATHON '
-                           'WHERE ACTIVE=TRUE AND DISCORD_CHANNEL_ID=%s '
-                           'ORDER BY START DESC LIMIT 1', [channel_id])
+    def get_leaderboard_page(self, _sprintathon, top_n, discord_user_id=None):
+        # The top top_n members, plus the given member's own rank if they aren't among them, without fetching the rest
+        # of the standings.
+        with self.connection.cursor() as cursor:
+            SprintathonRepository.GET_LEADERBOARD_PAGE.execute(cursor, (_sprintathon.duration, _sprintathon.id, top_n,
+                                                                        discord_user_id))
+            result = cursor.fetchall()
+            return LeaderboardPage([(item[0], LeaderboardEntry(Member(item[1], item[2], item[3]), item[4], item[5],
+                                                               item[6])) for item in result],
+                                   result[0][7] if result else 0)
+
+    def rebuild_totals(self, sprintathon_id=None) -> None:
+        # Recomputes SPRINTATHON_MEMBER_TOTALS from the submissions themselves, for one Spr*ntathon or all of them.
+        with self.connection.cursor() as cursor:
+            SprintathonRepository.REBUILD_TOTALS.execute(cursor, [sprintathon_id])
+            self.connection.commit()
+        if sprintathon_id is None:
+            SprintathonRepository.leaderboard_cache.clear()
+        else:
+            SprintathonRepository.leaderboard_cache.invalidate(sprintathon_id)
+
+    def get_active(self, identity_map=None):
+        if identity_map is None:
+            identity_map = IdentityMap()
+        with self.connection.cursor() as cursor:
+            SprintathonRepository.GET_ACTIVE.execute(cursor)
+            result = cursor.fetchall()
+            return [SprintathonRepository.from_row(item, identity_map) for item in result]
+
+    def get_active_for_channel(self, channel_id):
+        with self.connection.cursor() as cursor:
+            SprintathonRepository.GET_ACTIVE_FOR_CHANNEL.execute(cursor, [channel_id])
             result = cursor.fetchone()
             if result is None:
                 return None
-            return Sprintathon(connection, result[0], result[1], int(result[2].total_seconds() // 3600),
-                               server.Server(connection).find_by_id(result[3]), True, channel_id)
+            return SprintathonRepository.from_row(result)
 
-    @staticmethod
-    def get_most_recent_for_channel(connection, channel_id):
-        with connection.cursor() as cursor:
-            cursor.execute('SELECT ID, START, DURATION, SERVER_ID, ACTIVE FROM SPRINTATHON '
-                           'WHERE DISCORD_CHANNEL_ID=%s '
-                           'ORDER BY START DESC LIMIT 1', [channel_id])
+    def get_most_recent_for_channel(self, channel_id):
+        with self.connection.cursor() as cursor:
+            SprintathonRepository.GET_MOST_RECENT_FOR_CHANNEL.execute(cursor, [channel_id])
             result = cursor.fetchone()
             if result is None:
                 return None
-            return Sprintathon(connection, result[0], result[1], int(result[2].total_seconds() // 3600),
-                               server.Server(connection).find_by_id(result[3]), result[4], channel_id)
-
-    def __repr__(self) -> str:
-        return f'Sprintathon{{id={self.id},start={self.start},duration={self.duration},server={self.server},' \
-               f'discord_channel_id={self.discord_channel_id}}}'
+            return SprintathonRepository.from_row(result)
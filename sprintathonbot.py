@@ -1,374 +1,551 @@
-import asyncio
-import logging
 import datetime
+import logging
 import math
+import tempfile
+import time
 
+import discord
 from discord.ext import commands
 
-from member import Member
-from server import Server
-from sprint import Sprint
-from sprintathon import Sprintathon
-from submission import Submission
-
-_debug_mode: bool
-_debug_guild: str
-
-
-def _should_handle_command(ctx):
-    return (_debug_mode and ctx.guild.name == _debug_guild) or (not _debug_mode and ctx.guild.name != _debug_guild)
+from dispatcher import MessageDispatcher
+import history
+from job import Job, JobRepository
+from leaderboard import CoalescingRateLimiter
+from messages import MessageBuilder, mention_list, ordinal
+from metrics import DRIFT_BUCKETS
+from member import Member, MemberRepository
+from registry import ActiveSprintRegistry
+from scheduler import Scheduler
+from server import Server, ServerRepository
+from sprint import Sprint, SprintRepository
+from sprintathon import Sprintathon, SprintathonRepository
+from submission import Submission, SubmissionRepository
+
+# How many members !leaderboard shows by default.
+_leaderboard_top_n = 10
+# How far ahead of time scheduled jobs are loaded into memory.
+_job_load_horizon = 60 * 60
+# Discord rejects attachments bigger than this from bots in unboosted guilds.
+_export_size_limit = 8 * 1024 * 1024
+# Exports bigger than this are spooled to a temporary file rather than kept in memory.
+_export_spool_size = 1024 * 1024
 
 
 class SprintathonBot(commands.Cog):
-    def __init__(self, _bot, connection, debug_mode, debug_guild, _version):
+    def __init__(self, _bot, database, router, _version, submission_buffer=None, leaderboard_rate_limit=10.0,
+                 metrics=None):
         self.bot = _bot
-        self.connection = connection
+        self.database = database
+        self.connection = database.connection
+        # Only ever used through self.database.run(), on the thread holding the connection.
+        self.members = MemberRepository(self.connection)
+        self.servers = ServerRepository(self.connection)
+        self.sprints = SprintRepository(self.connection)
+        self.sprintathons = SprintathonRepository(self.connection)
+        self.submissions = SubmissionRepository(self.connection)
+        self.jobs = JobRepository(self.connection)
         self.logger = logging.getLogger('sprintathon.SprintathonBot')
-        global _debug_mode
-        _debug_mode = debug_mode
-        global _debug_guild
-        _debug_guild = debug_guild
+        # Decides which guilds' commands this instance handles.
+        self.router = router
+        self.debug_mode = router.debug_mode
         self._version = _version
+        # Holds the deadline of every running sprint and Spr*ntathon.
+        self.scheduler = Scheduler()
+        # Every running sprint and Spr*ntathon, so commands don't have to look them up in the database.
+        self.registry = ActiveSprintRegistry()
+        # The last Spr*ntathon to finish in each channel, for !leaderboard once nothing is running there.
+        self._recent_sprintathons = dict()
+        self._leaderboard_limiter = CoalescingRateLimiter(leaderboard_rate_limit)
+        # Every outgoing message goes through here, so nothing waits on Discord's rate limits.
+        self.dispatcher = MessageDispatcher(_bot)
+        # Optional write-behind buffer for check-in submissions.
+        self.submission_buffer = submission_buffer
+        if metrics is not None:
+            self._instrument(metrics)
+
+    def _instrument(self, metrics):
+        # Only hooked in with metrics enabled, so commands and timers otherwise run without any instrumentation.
+        self._command_seconds = metrics.histogram('sprintathon_command_duration_seconds',
+                                                  'Time taken to handle each command, not counting sending replies.',
+                                                  ['command'])
+        self._command_errors = metrics.counter('sprintathon_command_errors_total',
+                                               'Commands which raised an exception.', ['command'])
+        self.bot.before_invoke(self._before_command)
+        self.bot.after_invoke(self._after_command)
+        timer_drift = metrics.histogram('sprintathon_timer_drift_seconds',
+                                        'How late each sprint and Spr*ntathon phase ran, compared to its deadline.',
+                                        ['kind'], DRIFT_BUCKETS)
+        self.scheduler.drift_observer = lambda entry, drift: timer_drift.observe(drift, entry.key[0])
+        metrics.callback('sprintathon_scheduled_timers', 'Sprint and Spr*ntathon phases waiting on a timer.', 'gauge',
+                         lambda: len(self.scheduler))
+        metrics.callback('sprintathon_active_sprints', 'Sprints running on this instance.', 'gauge',
+                         lambda: self.registry.sprint_count)
+        metrics.callback('sprintathon_active_sprintathons', 'Spr*ntathons running on this instance.', 'gauge',
+                         lambda: self.registry.sprintathon_count)
+        metrics.callback('sprintathon_outbound_queue_depth', 'Messages waiting to be sent to Discord.', 'gauge',
+                         lambda: self.dispatcher.stats.depth)
+        metrics.callback('sprintathon_outbound_messages_total', 'Messages sent to Discord, by outcome.', 'counter',
+                         lambda: {('sent',): self.dispatcher.stats.sent,
+                                  ('coalesced',): self.dispatcher.stats.coalesced,
+                                  ('failed',): self.dispatcher.stats.failed}, ['outcome'])
+
+    async def _before_command(self, ctx):
+        ctx.started_at = time.perf_counter()
+
+    async def _after_command(self, ctx):
+        name = ctx.command.qualified_name
+        self._command_seconds.observe(time.perf_counter() - ctx.started_at, name)
+        if ctx.command_failed:
+            self._command_errors.inc(name)
+
+    def _reply(self, ctx, content, priority=MessageDispatcher.PRIORITY_NORMAL):
+        self.dispatcher.send(ctx.channel.id, content, priority)
+
+    def cog_check(self, ctx):
+        return self.router.should_handle(ctx.guild)
+
+    async def cog_command_error(self, ctx, error):
+        if isinstance(error, commands.CheckFailure):
+            # Commands for guilds routed away from this instance.
+            return
+        self.logger.error('Command %s failed in channel %s.', ctx.command, ctx.channel,
+                          exc_info=(type(error), error, error.__traceback__))
 
     @commands.Cog.listener()
     async def on_ready(self):
+        self.router.resolve_all(self.bot.guilds)
         self.logger.info('Sprintathon is started and ready to handle requests.')
-        # Find and handle any orphaned sprints/spr*ntathons
-        await self._handle_orphaned_sprintathons()
-        await self._handle_orphaned_sprints()
+        self.scheduler.start()
+        if self.submission_buffer is not None:
+            self.submission_buffer.start()
+        if not self.registry.loaded:
+            await self.database.run(self.registry.load, self.connection, self.router.handles_guild_id)
+        # Pick up any sprints/spr*ntathons whose next phase is due soon. on_ready fires again on every reconnect, which
+        # _load_due_jobs() is safe against.
+        await self._load_due_jobs()
+
+    @commands.Cog.listener()
+    async def on_guild_join(self, guild):
+        self.router.resolve(guild)
+
+    @commands.Cog.listener()
+    async def on_guild_update(self, before, after):
+        # Debug and disabled guilds can be configured by name.
+        if before.name != after.name:
+            self.router.resolve(after)
+
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild):
+        self.router.forget(guild)
 
     @commands.command(name='help', brief='Command help', help='Use this command to print this help message.',
                       pass_context=True)
-    @commands.check(_should_handle_command)
     async def print_help(self, ctx, *args: str):
         if ctx.message.content.startswith('!'):
             return
-        await ctx.send(":robot: Hi, I'm Spr\\*ntathon Bot! Beep boop! :robot:\n"
-                       "Here is a list of all the commands I know:\n"
-                       "`   Help: Just mention my name and send \"help\", I'll print this message!`\n"
-                       "`   !about (or !info): Use this command to get detailed information about me, "
-                       "the Spr\\*ntathon Bot!`\n"
-                       "`   !start_sprintathon [duration]: Use this command to create (and start) a new "
-                       "Spr\\*ntathon, given a duration in hours. Leave the duration blank for a 24hr Spr\\*ntathon.`\n"
-                       "`   !stop_sprintathon: Use this command to stop the currently running Spr\\*ntathon, "
-                       "if one is running. If there is not a Spr\\*ntathon currently running, this command does "
-                       "nothing.`\n"
-                       "`   !start_sprint [duration]: Use this command to create (and start) a new Sprint, given a "
-                       "duration in minutes. Leave the duration blank for a 15min Sprint.`\n"
-                       "`   !stop_sprint: Use this command to stop the currently running Sprint, if one is running. "
-                       "If there is not a Sprint currently running, this command does nothing.`\n"
-                       "`   !sprint [word_count]: Use this command to check into the currently running Sprint, "
-                       "given a word count, or the keyword 'same' to use your previously submitted word count.`\n"
-                       "`   !leaderboard: Use this command to print out the current Spr\\*ntathon's leaderboard.`\n"
-                       "`   !version: Use this command to print out the current application version.`")
-
-    @print_help.error
-    async def print_help_error(self, ctx, error):
-        if isinstance(error, commands.CheckFailure):
-            # Ignore errors from _should_handle_command check
-            return
-        raise error
+        self._reply(ctx, ":robot: Hi, I'm Spr\\*ntathon Bot! Beep boop! :robot:\n"
+                         "Here is a list of all the commands I know:\n"
+                         "`   Help: Just mention my name and send \"help\", I'll print this message!`\n"
+                         "`   !about (or !info): Use this command to get detailed information about me, "
+                         "the Spr\\*ntathon Bot!`\n"
+                         "`   !start_sprintathon [duration]: Use this command to create (and start) a new "
+                         "Spr\\*ntathon, given a duration in hours. Leave the duration blank for a 24hr "
+                         "Spr\\*ntathon.`\n"
+                         "`   !stop_sprintathon: Use this command to stop the currently running Spr\\*ntathon, "
+                         "if one is running. If there is not a Spr\\*ntathon currently running, this command does "
+                         "nothing.`\n"
+                         "`   !start_sprint [duration]: Use this command to create (and start) a new Sprint, given a "
+                         "duration in minutes. Leave the duration blank for a 15min Sprint.`\n"
+                         "`   !stop_sprint: Use this command to stop the currently running Sprint, if one is running. "
+                         "If there is not a Sprint currently running, this command does nothing.`\n"
+                         "`   !sprint [word_count]: Use this command to check into the currently running Sprint, "
+                         "given a word count, or the keyword 'same' to use your previously submitted word count.`\n"
+                         "`   !leaderboard [count|all]: Use this command to print out the current Spr\\*ntathon's "
+                         "leaderboard. Shows the top 10 and your own rank, unless given a count or 'all'.`\n"
+                         "`   !stats: Use this command to print out your lifetime words, best sprint, average WPM and "
+                         "daily sprint streaks.`\n"
+                         "`   !export [csv|json]: Use this command to get your whole submission history as a file, in "
+                         "CSV unless given 'json'.`\n"
+                         "`   !version: Use this command to print out the current application version.`")
 
     @commands.command(name='about', brief='About Spr*ntathon', aliases=['info'],
                       help='Use this command to get detailed information about the Spr*ntathon bot.')
-    @commands.check(_should_handle_command)
     async def print_about(self, ctx):
-        self.logger.info(f'User {ctx.message.author.name} requested about.')
-        await ctx.send(
-            ':robot: Hi! I\'m the Spr\\*ntathon bot! Beep boop :robot:\nIt\'s really nice to meet you!\n I\'m so '
-            'happy to help my fiancée and her friends track their Sprints! :heart:\n*If you have any questions, '
-            'feel free to drop me an email at zach@zachpuls.com, or check out my source code on '
-            'https://github.com/ZacharyPuls/sprintathon! If you find any issues, please do create an Issue '
-            '(or even a PR) on GitHub, so I can get to fixing it! Thanks again for using Spr\\*ntathon bot!*')
-
-    @print_about.error
-    async def print_about_error(self, ctx, error):
-        if isinstance(error, commands.CheckFailure):
-            # Ignore errors from _should_handle_command check
-            return
-        raise error
+        self.logger.info('User %s requested about.', ctx.message.author.name)
+        self._reply(
+            ctx, ':robot: Hi! I\'m the Spr\\*ntathon bot! Beep boop :robot:\nIt\'s really nice to meet you!\n I\'m so '
+                 'happy to help my fiancée and her friends track their Sprints! :heart:\n*If you have any questions, '
+                 'feel free to drop me an email at zach@zachpuls.com, or check out my source code on '
+                 'https://github.com/ZacharyPuls/sprintathon! If you find any issues, please do create an Issue '
+                 '(or even a PR) on GitHub, so I can get to fixing it! Thanks again for using Spr\\*ntathon bot!*')
 
     @commands.command(name='start_sprintathon', brief='Starts a new Spr*ntathon',
                       help='Use this command to create (and start) a new Spr*ntathon, given a duration in hours. '
                            'Leave the duration blank for a 24hr Spr*ntathon.')
-    @commands.check(_should_handle_command)
     async def start_sprintathon(self, ctx, sprintathon_time_in_hours: int = 24):
-        if Sprintathon.get_active_for_channel(self.connection, ctx.channel.id) is not None:
-            await ctx.send(f'There is already a Spr*ntathon active for this channel! Use `!start_sprint [duration]` '
-                           f'to start a new Sprint, or if there is already one active, `!sprint [word_count]` to join '
-                           f'the currently running Sprint.')
+        if self.registry.get_sprintathon(ctx.guild.id, ctx.channel.id) is not None:
+            self._reply(ctx, f'There is already a Spr*ntathon active for this channel! Use '
+                             f'`!start_sprint [duration]` to start a new Sprint, or if there is already one active, '
+                             f'`!sprint [word_count]` to join the currently running Sprint.')
             return
         self.logger.info('Starting sprintathon with duration of %i hours.', sprintathon_time_in_hours)
         _sprintathon = await self.start_new_sprintathon(ctx, sprintathon_time_in_hours)
         await self.run_sprintathon(_sprintathon)
 
-    @start_sprintathon.error
-    async def start_sprintathon_error(self, ctx, error):
-        if isinstance(error, commands.CheckFailure):
-            # Ignore errors from _should_handle_command check
-            return
-        raise error
-
     @commands.command(name='stop_sprintathon', brief='Stops the current Spr*ntathon',
                       help='Use this command to stop the currently running Spr*ntathon, if one is running. If there '
                            'is not a Spr*ntathon currently running, this command does nothing.')
-    @commands.check(_should_handle_command)
     async def stop_sprintathon(self, ctx):
         await self.kill_sprintathon(ctx)
 
-    @stop_sprintathon.error
-    async def stop_sprintathon_error(self, ctx, error):
-        if isinstance(error, commands.CheckFailure):
-            # Ignore errors from _should_handle_command check
-            return
-        raise error
-
     @commands.command(name='start_sprint', brief='Starts a new Sprint',
                       help='Use this command to create (and start) a new Sprint, given a duration in minutes. Leave '
                            'the duration blank for a 15min Sprint.')
-    @commands.check(_should_handle_command)
     async def start_sprint(self, ctx, sprint_time_in_minutes: int = 15):
-        _server = await self._get_or_create_server(ctx.guild.name, ctx.guild.id)
-        if Sprint.get_most_recent_active(self.connection, _server, ctx.channel.id) is not None:
-            await ctx.send(f'There is already a Sprint active for this channel! Use `!sprint [word_count]` to join '
-                           f'the currently running Sprint.')
+        if self.registry.get_sprint(ctx.guild.id, ctx.channel.id) is not None:
+            self._reply(ctx, f'There is already a Sprint active for this channel! Use `!sprint [word_count]` to join '
+                             f'the currently running Sprint.')
             return
         self.logger.info('Starting sprint with duration of %i minutes.', sprint_time_in_minutes)
         _sprint = await self.start_new_sprint(ctx, sprint_time_in_minutes)
         await self.run_sprint(_sprint)
 
-    @start_sprint.error
-    async def start_sprint_error(self, ctx, error):
-        if isinstance(error, commands.CheckFailure):
-            # Ignore errors from _should_handle_command check
-            return
-        raise error
-
     @commands.command(name='stop_sprint', brief='Stops the current Sprint',
                       help='Use this command to stop the currently running Sprint, if one is running. If there is not '
                            'a Sprint currently running, this command does nothing.')
-    @commands.check(_should_handle_command)
     async def stop_sprint(self, ctx):
         await self.kill_sprint(ctx)
 
-    @stop_sprint.error
-    async def stop_sprint_error(self, ctx, error):
-        if isinstance(error, commands.CheckFailure):
-            # Ignore errors from _should_handle_command check
-            return
-        raise error
-
     @commands.command(name='sprint', brief='Checks into the current Sprint',
                       help='Use this command to check into the currently running Sprint, given a word count, '
                            'or the keyword \'same\' to use your previously submitted word count.')
-    @commands.check(_should_handle_command)
     async def sprint(self, ctx, word_count_str: str):
         user_id = ctx.message.author.id
         user_name = ctx.message.author.name
 
-        member = Member(connection=self.connection).find_by_name(user_name)
-        if not member:
-            member = Member(connection=self.connection, name=user_name, discord_user_id=user_id)
-            member.create()
+        member = await self.database.run(self.members.find_or_create, Member(name=user_name, discord_user_id=user_id))
 
         _server = await self._get_or_create_server(ctx.guild.name, ctx.guild.id)
-        _server.add_member(member)
+        await self.database.run(self.servers.add_member, _server, member)
 
+        state = self.registry.get_sprint(ctx.guild.id, ctx.channel.id)
         if word_count_str.lower() != 'same':
             if not word_count_str.isnumeric():
-                await ctx.send(f':four: :zero: :four: Something went wrong. Try again! :four: :zero: :four:')
+                self._reply(ctx, f':four: :zero: :four: Something went wrong. Try again! :four: :zero: :four:')
                 return
             word_count = int(word_count_str)
         else:
-            member_last_submission = Submission.get_last_for_member(self.connection, member)
-            if member_last_submission is not None:
-                word_count = member_last_submission.word_count
+            # A check-in to this sprint is the member's latest, and is already in memory. Only their first check-in
+            # needs to look further back.
+            participant = state.participant(member) if state is not None else None
+            if participant is not None and participant.last_word_count is not None:
+                word_count = participant.last_word_count
             else:
-                await ctx.send(f'<@{user_id}>, you can\'t use ```!sprint same``` without having a previous submission.')
-                return
+                member_last_submission = None
+                if self.submission_buffer is not None:
+                    member_last_submission = self.submission_buffer.get_last_for_member(member)
+                if member_last_submission is None:
+                    member_last_submission = await self.database.run(self.submissions.get_last_for_member, member)
+                if member_last_submission is None:
+                    self._reply(ctx, f'<@{user_id}>, you can\'t use ```!sprint same``` without having a previous '
+                                     f'submission.')
+                    return
+                word_count = member_last_submission.word_count
 
         self.logger.info('Member %s is checking in with a word_count of %i.', user_name, word_count)
         response = f'{user_name} checked in with {word_count} words!'
 
-        _sprint = Sprint.get_most_recent_active(self.connection, _server, ctx.channel.id)
-        if _sprint is None:
-            await ctx.send('There isn\'t a Sprint active! Make sure to start one with !start_sprint [duration] before '
-                           'submitting your word count. ')
+        if state is None:
+            self._reply(ctx, 'There isn\'t a Sprint active! Make sure to start one with !start_sprint [duration] '
+                             'before submitting your word count. ')
             return
-        _sprint.add_member(member)
+        _sprint = state.sprint
 
-        submission = Submission(connection=self.connection, member=member, word_count=word_count)
-        if submission.member.has_submission_in(_sprint):
-            submission.type = 'FINISH'
-        else:
-            submission.type = 'START'
-        submission.create()
+        submission = Submission(member=member, word_count=word_count, _type=state.submission_type_for(member))
+        state.record(member, submission.type, word_count)
 
-        _sprint.add_submission(submission)
-
-        await ctx.send(response)
+        if self.submission_buffer is not None:
+            # Written to the database (along with the sprint membership) by the buffer's next flush.
+            self.submission_buffer.add(_sprint, submission)
+        else:
+            await self.database.run(self.sprints.add_member, _sprint, member)
+            await self.database.run(self.sprints.add_submission, _sprint, submission)
 
-    @sprint.error
-    async def sprint_error(self, ctx, error):
-        if isinstance(error, commands.CheckFailure):
-            # Ignore errors from _should_handle_command check
-            return
-        raise error
+        self._reply(ctx, response)
 
     @commands.command(name='leaderboard', brief='Spr*ntathon Leaderboard',
-                      help='Use this command to print out the current Spr*ntathon\'s leaderboard.')
-    @commands.check(_should_handle_command)
-    async def print_leaderboard(self, ctx):
-        _sprintathon = Sprintathon.get_active_for_channel(self.connection, ctx.channel.id)
+                      help='Use this command to print out the current Spr*ntathon\'s leaderboard: the top 10 members '
+                           'and your own rank, the top [count] members given a count, or everyone given \'all\'.')
+    async def print_leaderboard(self, ctx, view: str = ''):
+        _sprintathon = self.registry.get_sprintathon(ctx.guild.id, ctx.channel.id)
         if not _sprintathon:
             # If no Spr*ntathon is currently active, print the previous Spr*ntathon's leaderboard
-            _sprintathon = Sprintathon.get_most_recent_for_channel(self.connection, ctx.channel.id)
+            _sprintathon = self._recent_sprintathons.get(ctx.channel.id)
+        if not _sprintathon:
+            _sprintathon = await self.database.run(self.sprintathons.get_most_recent_for_channel, ctx.channel.id)
+            if _sprintathon:
+                self._recent_sprintathons[ctx.channel.id] = _sprintathon
         if not _sprintathon:
-            await ctx.send(f'No Spr\\*ntathons have been run yet, so I can\'t calculate a leaderboard. Go ahead and '
-                           f'start a new Spr\\*ntathon, and check back later!')
+            self._reply(ctx, f'No Spr\\*ntathons have been run yet, so I can\'t calculate a leaderboard. Go ahead and '
+                             f'start a new Spr\\*ntathon, and check back later!')
+        elif view.lower() == 'all':
+            # Repeated requests in the same channel get a single response until the leaderboard changes.
+            await self._leaderboard_limiter.run(ctx.channel.id,
+                                                SprintathonRepository.leaderboard_cache.generation(_sprintathon.id),
+                                                lambda: self._print_sprintathon_leaderboard(_sprintathon))
         else:
-            await self._print_sprintathon_leaderboard(_sprintathon)
-
-    @print_leaderboard.error
-    async def print_leaderboard_error(self, ctx, error):
-        if isinstance(error, commands.CheckFailure):
-            # Ignore errors from _should_handle_command check
+            top_n = int(view) if view.isdecimal() and int(view) > 0 else _leaderboard_top_n
+            await self._leaderboard_limiter.run((ctx.channel.id, ctx.message.author.id, top_n),
+                                                SprintathonRepository.leaderboard_cache.generation(_sprintathon.id),
+                                                lambda: self._print_sprintathon_leaderboard_page(
+                                                    _sprintathon, top_n, ctx.message.author.id))
+
+    async def _find_member(self, ctx):
+        return await self.database.run(self.members.find_by_discord_user_id, ctx.message.author.id)
+
+    @commands.command(name='stats', brief='Your lifetime stats',
+                      help='Use this command to print out your lifetime words, best sprint, average WPM and daily '
+                           'sprint streaks.')
+    async def print_stats(self, ctx):
+        user_id = ctx.message.author.id
+        member = await self._find_member(ctx)
+        if member is None:
+            self._reply(ctx, f'<@{user_id}>, you haven\'t checked into any Sprints yet!')
+            return
+        await self._flush_submissions()
+        stats = await self.database.run(history.member_stats, self.submissions, member)
+        if stats.sprints == 0:
+            self._reply(ctx, f'<@{user_id}>, you haven\'t finished any Sprints yet!')
+            return
+        word_or_words = 'word' if stats.lifetime_words == 1 else 'words'
+        sprint_or_sprints = 'Sprint' if stats.sprints == 1 else 'Sprints'
+        builder = MessageBuilder()
+        builder.add_line(f':bar_chart: <@{user_id}>\'s lifetime stats :bar_chart:')
+        builder.add_line(f'    {stats.lifetime_words} {word_or_words} over {stats.sprints} {sprint_or_sprints}, '
+                         f'plus {stats.bonus_words} bonus words')
+        best_sprint_on = f' on {stats.best_sprint_at:%Y-%m-%d}' if stats.best_sprint_at is not None else ''
+        builder.add_line(f'    Best Sprint: {stats.best_sprint_words} words{best_sprint_on}')
+        builder.add_line(f'    Average: {stats.average_wpm:.1f} wpm')
+        current_streak = stats.current_streak()
+        current_day_or_days = 'day' if current_streak == 1 else 'days'
+        longest_day_or_days = 'day' if stats.longest_streak == 1 else 'days'
+        builder.add_line(f'    Current streak: {current_streak} {current_day_or_days}, longest streak: '
+                         f'{stats.longest_streak} {longest_day_or_days}')
+        builder.dispatch(self.dispatcher, ctx.channel.id)
+
+    @commands.command(name='export', brief='Export your submission history',
+                      help='Use this command to get your whole submission history as a file, in CSV unless given '
+                           '\'json\'.')
+    async def export_history(self, ctx, export_format: str = 'csv'):
+        user_id = ctx.message.author.id
+        export_format = export_format.lower()
+        if export_format not in history.EXPORT_FORMATS:
+            self._reply(ctx, f'<@{user_id}>, I can only export your history as {" or ".join(history.EXPORT_FORMATS)}.')
+            return
+        member = await self._find_member(ctx)
+        if member is None:
+            self._reply(ctx, f'<@{user_id}>, you haven\'t checked into any Sprints yet!')
             return
-        raise error
+        await self._flush_submissions()
+        self.logger.info('User %s requested an export of their history as %s.', ctx.message.author.name,
+                         export_format)
+        # Written a batch at a time on the database thread, so a long history is never all in memory at once.
+        with tempfile.SpooledTemporaryFile(max_size=_export_spool_size) as file:
+            count = await self.database.run(history.export_history, self.submissions, member, export_format, file)
+            if file.tell() > _export_size_limit:
+                self._reply(ctx, f'<@{user_id}>, your history is too big for me to send on Discord, sorry!')
+                return
+            file.seek(0)
+            submission_or_submissions = 'submission' if count == 1 else 'submissions'
+            # Attachments can't go through the dispatcher, which only sends text.
+            await ctx.channel.send(f'<@{user_id}>, here are your {count} {submission_or_submissions}!',
+                                   file=discord.File(file, f'sprintathon-history-{user_id}.{export_format}'))
 
     @commands.command(name='version', brief='Show Spr*ntathon version',
                       help='Use this command to print out the current application version.')
-    @commands.check(_should_handle_command)
     async def print_version(self, ctx):
-        await ctx.send(f'Spr*ntathon application v{self._version} © 2020 Zachary Puls - '
-                       f'https://github.com/ZacharyPuls/sprintathon')
-
-    @print_version.error
-    async def print_version_error(self, ctx, error):
-        if isinstance(error, commands.CheckFailure):
-            # Ignore errors from _should_handle_command check
-            return
-        raise error
+        self._reply(ctx, f'Spr*ntathon application v{self._version} © 2020 Zachary Puls - '
+                         f'https://github.com/ZacharyPuls/sprintathon')
 
     async def run_sprintathon(self, _sprintathon):
-        current_time = datetime.datetime.now().astimezone(datetime.timezone.utc)
-        sprintathon_start_time = _sprintathon.start.astimezone(datetime.timezone.utc)
-        time_elapsed = current_time - sprintathon_start_time
-        seconds_to_wait = _sprintathon.duration * 60 * 60 - time_elapsed.total_seconds()
-        self.logger.debug(f'[run_sprintathon] Time elapsed: {time_elapsed} | Current time: {current_time} | '
-                          f'Sprintathon start time: {sprintathon_start_time} | Seconds to wait: {seconds_to_wait}')
-
-        if seconds_to_wait > 0:
-            if _debug_mode:
-                await asyncio.sleep(90)
-            else:
-                if seconds_to_wait > 3600:
-                    await asyncio.sleep(seconds_to_wait - 3600)
-                    await self.bot.get_channel(_sprintathon.discord_channel_id).send(
-                        f':exclamation: :exclamation: :exclamation: We\'re getting close to the finale! Get any last '
-                        f'words in before your time is up!! :exclamation: :exclamation: :exclamation:')
-                    await asyncio.sleep(3600)
-                else:
-                    self.logger.debug(f'Zombie Spr*ntathon was revived < 3600 seconds before termination '
-                                      f'[{seconds_to_wait}], skipping 1hr warning message.')
-                    await asyncio.sleep(seconds_to_wait)
-
-        # If the Spr*ntathon was cancelled by the user while we were sleeping, stop running.
-        _sprintathon.fetch()
-        if not _sprintathon.active:
-            return
-
-        await self.bot.get_channel(_sprintathon.discord_channel_id).send(
+        # Schedules the Spr*ntathon's next phase. Every phase handler schedules the one after it, so nothing waits on
+        # a coroutine in the meantime.
+        current_time = time.time()
+        end_time = _sprintathon.start.timestamp() + _sprintathon.duration * 60 * 60
+        seconds_to_wait = end_time - current_time
+        self.logger.debug('[run_sprintathon] Current time: %s | Sprintathon start time: %s | Seconds to wait: %s',
+                          current_time, _sprintathon.start, seconds_to_wait)
+
+        if self.debug_mode:
+            await self._schedule_job('SPRINTATHON', _sprintathon.id, 'END',
+                                     current_time + (90 if seconds_to_wait > 0 else 0), _sprintathon)
+        elif seconds_to_wait > 3600:
+            await self._schedule_job('SPRINTATHON', _sprintathon.id, 'WARNING', end_time - 3600, _sprintathon)
+        else:
+            if seconds_to_wait > 0:
+                self.logger.debug('Zombie Spr*ntathon was revived < 3600 seconds before termination [%s], skipping 1hr '
+                                  'warning message.', seconds_to_wait)
+            await self._schedule_job('SPRINTATHON', _sprintathon.id, 'END', end_time, _sprintathon)
+
+    async def _warn_sprintathon_ending(self, _sprintathon):
+        end_time = _sprintathon.start.timestamp() + _sprintathon.duration * 60 * 60
+        await self._schedule_job('SPRINTATHON', _sprintathon.id, 'END', end_time, _sprintathon)
+        self.dispatcher.send(
+            _sprintathon.discord_channel_id,
+            f':exclamation: :exclamation: :exclamation: We\'re getting close to the finale! Get any last '
+            f'words in before your time is up!! :exclamation: :exclamation: :exclamation:',
+            MessageDispatcher.PRIORITY_URGENT)
+
+    async def _end_sprintathon(self, _sprintathon):
+        self.dispatcher.send(
+            _sprintathon.discord_channel_id,
             ':clapper: :clapper: :clapper: And cut!! :clapper: :clapper: :clapper:\nThat’s a wrap for this '
             'Spr\\*ntathon! Congratulations to everyone that participated. Let’s see how everyone placed!')
         await self._print_sprintathon_leaderboard(_sprintathon)
         _sprintathon.active = False
-        _sprintathon.update()
+        await self.database.run(self.sprintathons.update, _sprintathon)
+        self.registry.remove_sprintathon(_sprintathon)
+        self._recent_sprintathons[_sprintathon.discord_channel_id] = _sprintathon
+        await self._complete_job('SPRINTATHON', _sprintathon.id)
 
     async def run_sprint(self, _sprint):
-        current_time = datetime.datetime.now().astimezone(datetime.timezone.utc)
-        sprint_start_time = _sprint.start.astimezone(datetime.timezone.utc)
-        time_elapsed = current_time - sprint_start_time
-        self.logger.info(f'Time elapsed: {time_elapsed} | Current time: {current_time} | '
-                         f'Sprint start time: {sprint_start_time}')
-        seconds_to_wait = _sprint.duration * 60 - time_elapsed.total_seconds()
-
-        if seconds_to_wait > 0:
-            if _debug_mode:
-                await asyncio.sleep(10)
-            else:
-                await asyncio.sleep(seconds_to_wait)
-
-        # If the sprint was cancelled by the user while we were sleeping, stop running.
-        _sprint.fetch()
-        if not _sprint.active:
-            return
-
-        await self.bot.get_channel(_sprint.discord_channel_id).send(_sprint.time_is_up_message())
-
-        if _debug_mode:
-            await asyncio.sleep(15)
+        # Schedules the sprint's next phase, like run_sprintathon().
+        current_time = time.time()
+        end_time = _sprint.start.timestamp() + _sprint.duration * 60
+        self.logger.info('Current time: %s | Sprint start time: %s | Seconds to wait: %s', current_time, _sprint.start,
+                         end_time - current_time)
+
+        if self.debug_mode:
+            end_time = current_time + (10 if end_time > current_time else 0)
+        await self._schedule_job('SPRINT', _sprint.id, 'END', end_time, _sprint)
+
+    async def _end_sprint(self, _sprint):
+        await self._flush_submissions()
+        # Members get a grace period after the sprint to check in with their final word count.
+        await self._schedule_job('SPRINT', _sprint.id, 'CHECKIN_END', time.time() + (15 if self.debug_mode else 7 * 60),
+                                 _sprint)
+        state = self.registry.get_sprint_by_id(_sprint.id)
+        if state is not None:
+            message = _sprint.time_is_up_message(state.members)
         else:
-            await asyncio.sleep(7 * 60)
-
-        # If the sprint was cancelled by the user while we were sleeping, stop running.
-        _sprint.fetch()
-        if not _sprint.active:
-            return
+            message = _sprint.time_is_up_message(await self.database.run(self.sprints.get_members, _sprint))
+        self.dispatcher.send(_sprint.discord_channel_id, message, MessageDispatcher.PRIORITY_URGENT)
 
+    async def _end_sprint_checkin(self, _sprint):
         await self._calculate_and_print_sprint_results(_sprint)
+        await self._complete_job('SPRINT', _sprint.id)
+
+    async def _schedule_job(self, kind, entity_id, phase, when, entity=None):
+        # Persists the job first, so it survives a restart. Jobs beyond the load horizon are picked up later by
+        # _load_due_jobs(), rather than being held in memory.
+        job = Job(kind=kind, entity_id=entity_id, phase=phase,
+                  fire_at=datetime.datetime.fromtimestamp(when, datetime.timezone.utc))
+        await self.database.run(self.jobs.create, job)
+        if when <= time.time() + _job_load_horizon:
+            self.scheduler.schedule((kind, entity_id), when, self._run_job, kind, entity_id, phase, entity)
+        else:
+            self.scheduler.cancel((kind, entity_id))
+
+    async def _complete_job(self, kind, entity_id):
+        self.scheduler.cancel((kind, entity_id))
+        await self.database.run(self.jobs.delete, Job(kind=kind, entity_id=entity_id))
 
-        _sprint.active = False
-        _sprint.update()
+    async def _run_job(self, kind, entity_id, phase, entity=None):
+        if entity is None:
+            if kind == 'SPRINT':
+                state = self.registry.get_sprint_by_id(entity_id)
+                entity = state.sprint if state is not None else None
+            else:
+                entity = self.registry.get_sprintathon_by_id(entity_id)
+        if entity is None:
+            # Not running in this process any more, so check the database for what happened to it.
+            if kind == 'SPRINT':
+                entity = await self.database.run(self.sprints.find_by_id, entity_id)
+            else:
+                entity = await self.database.run(self.sprintathons.find_by_id, entity_id)
+        if entity is None or not entity.active:
+            # Stopped while the bot was offline, or deleted from the database altogether.
+            await self._complete_job(kind, entity_id)
+            return
+        handlers = {
+            ('SPRINT', 'END'): self._end_sprint,
+            ('SPRINT', 'CHECKIN_END'): self._end_sprint_checkin,
+            ('SPRINTATHON', 'WARNING'): self._warn_sprintathon_ending,
+            ('SPRINTATHON', 'END'): self._end_sprintathon,
+        }
+        await handlers[(kind, phase)](entity)
+
+    async def _load_due_jobs(self):
+        # Only jobs due within the horizon are loaded, so this costs the same no matter how many sprints are running.
+        # Safe to call repeatedly, as anything already scheduled (or running) is left alone.
+        horizon = datetime.datetime.fromtimestamp(time.time() + _job_load_horizon, datetime.timezone.utc)
+        # A restarted shard picks its orphaned jobs back up here, including any that fell due while it was down.
+        for job in await self.database.run(self.jobs.find_due, horizon, self.router.shard_ids,
+                                           self.router.shard_count):
+            # The shard filter alone would let a debug instance sharing the database run production's jobs too.
+            if not self.router.handles_guild_id(job.discord_guild_id):
+                continue
+            key = (job.kind, job.entity_id)
+            if self.scheduler.get(key) is not None or self.scheduler.is_running(key):
+                continue
+            self.logger.info('Scheduling %s.', job)
+            self.scheduler.schedule(key, job.fire_at.timestamp(), self._run_job, job.kind, job.entity_id, job.phase)
+        self.scheduler.schedule_in(('JOBS', None), _job_load_horizon / 2, self._load_due_jobs)
 
     async def kill_sprintathon(self, ctx):
-        _server = await self._get_or_create_server(ctx.guild.name, ctx.guild.id)
-        _sprintathon = Sprintathon.get_active_for_channel(self.connection, ctx.channel.id)
+        _sprintathon = self.registry.get_sprintathon(ctx.guild.id, ctx.channel.id)
 
         if _sprintathon is not None:
             _sprintathon.active = False
-            _sprintathon.update()
+            await self.database.run(self.sprintathons.update, _sprintathon)
+            self.registry.remove_sprintathon(_sprintathon)
+            self._recent_sprintathons[_sprintathon.discord_channel_id] = _sprintathon
+            await self._complete_job('SPRINTATHON', _sprintathon.id)
             response = ':x: :x: :x: No problem. Spr\\*ntathon has been cancelled. Maybe next time. :x: :x: :x:'
             self.logger.info('User %s stopped sprintathon.', ctx.message.author.name)
         else:
             response = f':question: <@{ctx.message.author.id}>, there isn\'t an active Spr\\*ntathon for you to stop ' \
                        f':question: '
 
-        await ctx.send(response)
+        self._reply(ctx, response)
 
     async def kill_sprint(self, ctx):
-        _server = await self._get_or_create_server(ctx.guild.name, ctx.guild.id)
-        _sprint = Sprint.get_most_recent_active(self.connection, _server, ctx.channel.id)
-        if _sprint is not None:
+        state = self.registry.get_sprint(ctx.guild.id, ctx.channel.id)
+        if state is not None:
+            _sprint = state.sprint
             _sprint.active = False
-            _sprint.update()
+            await self.database.run(self.sprints.update, _sprint)
+            self.registry.remove_sprint(_sprint)
+            await self._complete_job('SPRINT', _sprint.id)
             response = ':x: :x: :x: No problem. The current sprint has been cancelled. Maybe next time. :x: :x: :x:'
             self.logger.info('User %s stopped sprint.', ctx.message.author.name)
         else:
             response = f':question: <@{ctx.message.author.id}>, there isn\'t an active Sprint for you to stop :question:'
 
-        await ctx.send(response)
+        self._reply(ctx, response)
 
     async def start_new_sprintathon(self, ctx, sprintathon_time_in_hours):
         _server = await self._get_or_create_server(ctx.guild.name, ctx.guild.id)
-        _sprintathon = Sprintathon(connection=self.connection, duration=sprintathon_time_in_hours, _server=_server,
+        _sprintathon = Sprintathon(duration=sprintathon_time_in_hours, _server=_server,
                                    discord_channel_id=ctx.channel.id)
-        _sprintathon.create()
+        await self.database.run(self.sprintathons.create, _sprintathon)
+        self.registry.add_sprintathon(_sprintathon)
         hour_or_hours = 'hour'
         if sprintathon_time_in_hours != 1:
             hour_or_hours = 'hours'
         response = f':loudspeaker: :loudspeaker: :loudspeaker: It\'s spr\\*ntathon time! Starting a timer for ' \
                    f'{sprintathon_time_in_hours} {hour_or_hours}. :loudspeaker: :loudspeaker: '
-        await ctx.send(response)
+        self._reply(ctx, response)
         return _sprintathon
 
     async def start_new_sprint(self, ctx, sprint_time_in_minutes):
         _server = await self._get_or_create_server(ctx.guild.name, ctx.guild.id)
         channel_id = ctx.channel.id
-        active_sprintathon = Sprintathon.get_active_for_channel(self.connection, channel_id)
-        _sprint = Sprint(connection=self.connection, duration=sprint_time_in_minutes, _server=_server, active=True,
-                         _sprintathon=active_sprintathon, discord_channel_id=channel_id)
-        _sprint.create()
+        active_sprintathon = self.registry.get_sprintathon(ctx.guild.id, channel_id)
+        _sprint = Sprint(duration=sprint_time_in_minutes, _server=_server, active=True, _sprintathon=active_sprintathon,
+                         discord_channel_id=channel_id)
+        await self.database.run(self.sprints.create, _sprint)
+        self.registry.add_sprint(_sprint)
         minute_or_minutes = 'minute'
 
         if sprint_time_in_minutes != 1:
@@ -381,107 +558,97 @@ class SprintathonBot(commands.Cog):
 
         # TODO: allow members to join for 5 minutes before actually starting the sprint
 
-        await ctx.send(response)
+        self._reply(ctx, response)
         return _sprint
 
-    async def _handle_orphaned_sprintathons(self):
-        for _sprintathon in Sprintathon.get_active(self.connection):
-            self.logger.warning('Reviving orphaned sprintathon %s.', _sprintathon)
-            asyncio.create_task(self.run_sprintathon(_sprintathon))
-
-    async def _handle_orphaned_sprints(self):
-        for _sprint in Sprint.get_active(self.connection):
-            self.logger.warning('Reviving orphaned sprint %s.', _sprint)
-            asyncio.create_task(self.run_sprint(_sprint))
+    async def _flush_submissions(self):
+        # Anything still in the write-behind buffer has to be in the database before reading the sprint's members or
+        # submissions back.
+        if self.submission_buffer is not None:
+            await self.submission_buffer.flush()
 
     async def _get_or_create_server(self, guild_name, guild_id):
-        return Server(self.connection, name=guild_name, discord_guild_id=guild_id).find_or_create()
+        return await self.database.run(self.servers.find_or_create, Server(name=guild_name, discord_guild_id=guild_id))
 
     @staticmethod
-    def _format_leaderboard_string(leaderboard, leaderboard_wpm):
+    def _add_leaderboard_lines(builder, leaderboard):
+        # leaderboard holds (rank, Discord user ID, word count, wpm) tuples.
         if len(leaderboard) == 0:
-            return 'No one joined this round!'
-        message = ''
-        for position, result in enumerate(leaderboard):
-            st_nd_or_th = ''
-            if position == 0:
-                st_nd_or_th = 'st'
-            elif position == 1:
-                st_nd_or_th = 'nd'
-            else:
-                st_nd_or_th = 'th'
-
-            word_or_words = 'words'
-
-            if result == 1:
-                word_or_words = 'word'
+            builder.add_line('No one joined this round!')
+        for rank, user_id, word_count, wpm in leaderboard:
+            word_or_words = 'word' if word_count == 1 else 'words'
+            builder.add_line(f'    {ordinal(rank)}: <@{user_id}> - {word_count} {word_or_words} [avg {wpm} wpm]')
 
-            message += f'    {str(position + 1)}{st_nd_or_th}: <@{result[0]}> - {result[1]} {word_or_words} ' \
-                       f'[avg {leaderboard_wpm[result[0]]} wpm]\n'
-
-        return message
+    @staticmethod
+    def _sprintathon_leaderboard_lines(ranked_entries):
+        return [(rank, entry.member.discord_user_id, entry.word_count + entry.bonus_word_count, entry.wpm)
+                for rank, entry in ranked_entries]
 
     async def _print_sprintathon_leaderboard(self, _sprintathon):
-        sprintathon_word_counts = dict()
-        sprintathon_wpm = dict()
-        for sprintathon_member in _sprintathon.get_members():
-            normal_word_count = _sprintathon.get_word_count(sprintathon_member)
-            sprintathon_word_counts[
-                sprintathon_member.discord_user_id] = normal_word_count + _sprintathon.get_bonus_word_count(
-                sprintathon_member)
-            sprintathon_wpm[sprintathon_member.discord_user_id] = int(
-                math.ceil(normal_word_count / (_sprintathon.duration * 60)))
-        sprintathon_leaderboard = sorted(sprintathon_word_counts.items(), key=lambda item: item[1], reverse=True)
-        await self.bot.get_channel(_sprintathon.discord_channel_id).send(
-            self._format_leaderboard_string(sprintathon_leaderboard, sprintathon_wpm))
+        # Served from the cache until a new submission is committed for the Spr*ntathon.
+        cached = SprintathonRepository.leaderboard_cache.get(_sprintathon.id)
+        if cached is None:
+            generation = SprintathonRepository.leaderboard_cache.generation(_sprintathon.id)
+            leaderboard = await self.database.run(self.sprintathons.get_leaderboard, _sprintathon)
+            builder = MessageBuilder()
+            self._add_leaderboard_lines(builder, self._sprintathon_leaderboard_lines(enumerate(leaderboard, 1)))
+            cached = SprintathonRepository.leaderboard_cache.set(_sprintathon.id, generation, leaderboard,
+                                                                 builder.messages())
+        for message in cached.messages:
+            self.dispatcher.send(_sprintathon.discord_channel_id, message, coalesce=False)
+
+    async def _print_sprintathon_leaderboard_page(self, _sprintathon, top_n, discord_user_id):
+        cached = SprintathonRepository.leaderboard_cache.get(_sprintathon.id)
+        if cached is not None:
+            ranked_entries = [(rank, entry) for rank, entry in enumerate(cached.entries, 1)
+                              if rank <= top_n or entry.member.discord_user_id == discord_user_id]
+            total = len(cached.entries)
+        else:
+            # Only fetches the rows on show, rather than the whole leaderboard.
+            ranked_entries, total = await self.database.run(self.sprintathons.get_leaderboard_page, _sprintathon,
+                                                           top_n, discord_user_id)
+
+        builder = MessageBuilder()
+        self._add_leaderboard_lines(builder, self._sprintathon_leaderboard_lines(
+            [item for item in ranked_entries if item[0] <= top_n]))
+        own_rank = [item for item in ranked_entries if item[0] > top_n]
+        if own_rank:
+            builder.add_line('    ...')
+            self._add_leaderboard_lines(builder, self._sprintathon_leaderboard_lines(own_rank))
+        if total > top_n:
+            builder.add_line(f'Showing the top {top_n} of {total} members. Use `!leaderboard all` to see everyone.')
+        builder.dispatch(self.dispatcher, _sprintathon.discord_channel_id)
 
     async def _calculate_and_print_sprint_results(self, _sprint):
-        channel = self.bot.get_channel(_sprint.discord_channel_id)
-        sprint_word_counts = dict()
-        for sprint_member in _sprint.get_members():
-            self.logger.debug(f'Performing Sprint leaderboard calculation for {sprint_member}')
-            submissions = Submission.find_all_by_member_and_sprint(self.connection, sprint_member, _sprint)
-            finish_word_count = next((item.word_count for item in submissions if item.type == 'FINISH'), None)
-            start_word_count = next((item.word_count for item in submissions if item.type == 'START'), None)
-            if start_word_count is None or finish_word_count is None:
-                await channel.send(
-                    f'Oh no! Sprint member <@{sprint_member.discord_user_id}> forgot to submit their final word '
-                    f'count! They will be excluded from this sprint.')
-                continue
-
-            if finish_word_count < start_word_count:
-                await channel.send(f'Sprint member <@{sprint_member.discord_user_id}> sent in a final word count of '
-                                   f'{finish_word_count}, which was less than their starting word count of '
-                                   f'{start_word_count}. This isn\'t possible! Skipping member for leaderboard '
-                                   f'calculations.')
-                continue
-
-            if finish_word_count == start_word_count:
-                await channel.send(f'Sprint member <@{sprint_member.discord_user_id}> didn\'t type at all...'
-                                   f'that makes me a sad robot :(')
-
-            word_count = finish_word_count - start_word_count
-            self.logger.info(f'Creating DELTA Submission for {sprint_member.name} with a word_count of {word_count}.')
-            submission = Submission(connection=self.connection, member=sprint_member, word_count=word_count,
-                                    _type='DELTA')
-            submission.create()
-            _sprint.add_submission(submission)
-
-            sprint_word_counts[sprint_member.discord_user_id] = word_count
-        sprint_leaderboard = sorted(sprint_word_counts.items(), key=lambda item: item[1], reverse=True)
-        message = '**Sprint is done! Here are the results:**\n'
-        sprint_wpm = {user_id: int(math.ceil(sprint_word_counts[user_id] / _sprint.duration)) for user_id in
-                      sprint_word_counts.keys()}
-        message += self._format_leaderboard_string(sprint_leaderboard, sprint_wpm)
-        await channel.send(message)
-        # If there is a sprintathon currently active, award the 1st place member double points.
-        if _sprint.sprintathon is not None and _sprint.sprintathon.active and len(sprint_leaderboard) > 0:
-            first_place_entry = sprint_leaderboard[0]
-            first_place_member = Member(self.connection).find_by_discord_user_id(first_place_entry[0])
-            submission = Submission(connection=self.connection, member=first_place_member,
-                                    word_count=first_place_entry[1],
-                                    _type='BONUS')
-            submission.create()
-            _sprint.sprintathon.add_submission(submission)
-            await channel.send(
-                f'**Member <@{first_place_entry[0]}> got first place, so they get double points for the Spr*ntathon!**')
+        # Finalizing the sprint's results also marks it as inactive.
+        await self._flush_submissions()
+        self.logger.debug('Performing Sprint leaderboard calculation for %s', _sprint)
+        results = await self.database.run(self.sprints.finalize, _sprint)
+        self.registry.remove_sprint(_sprint)
+        # Problems are summed up in one message rather than one per member, so big sprints don't run into rate limits.
+        builder = MessageBuilder()
+        if results.missing:
+            member_or_members = 'member' if len(results.missing) == 1 else 'members'
+            builder.add_line(f'Oh no! Sprint {member_or_members} {mention_list(results.missing)} forgot to submit '
+                             f'their final word count! They will be excluded from this sprint.')
+        for sprint_member, start_word_count, finish_word_count in results.invalid:
+            builder.add_line(f'Sprint member <@{sprint_member.discord_user_id}> sent in a final word count of '
+                             f'{finish_word_count}, which was less than their starting word count of '
+                             f'{start_word_count}. This isn\'t possible! Skipping member for leaderboard '
+                             f'calculations.')
+        if results.idle:
+            member_or_members = 'member' if len(results.idle) == 1 else 'members'
+            builder.add_line(f'Sprint {member_or_members} {mention_list(results.idle)} didn\'t type at all...'
+                             f'that makes me a sad robot :(')
+        builder.end_message()
+
+        builder.add_line('**Sprint is done! Here are the results:**')
+        self._add_leaderboard_lines(builder, [
+            (rank, sprint_member.discord_user_id, word_count, int(math.ceil(word_count / _sprint.duration)))
+            for rank, (sprint_member, word_count) in enumerate(results.word_counts, 1)])
+        if results.bonus is not None:
+            builder.end_message()
+            builder.add_line(f'**Member <@{results.bonus[0].discord_user_id}> got first place, so they get double '
+                             f'points for the Spr*ntathon!**')
+        # Queued rather than awaited, so finalizing never waits on Discord's rate limits.
+        builder.dispatch(self.dispatcher, _sprint.discord_channel_id)
@@ -0,0 +1,325 @@
+import datetime
+import itertools
+import json
+import logging
+import math
+import re
+import sqlite3
+import threading
+import weakref
+
+import psycopg2
+import psycopg2.extensions
+from psycopg2.extras import execute_values
+
+# Connection strings starting with this are opened with SqliteEngine, e.g. sqlite://:memory: or
+# sqlite://sprintathon.db. Anything else is handed to psycopg2.
+SQLITE_PREFIX = 'sqlite://'
+
+# psycopg2 placeholders, and the escaped % signs that go with them.
+_placeholder_pattern = re.compile(r'%%|%s')
+
+
+class StorageEngine:
+    # Everything the connection pool and the query registry need to know about a database: how to connect to it, how
+    # to run the registered queries on it, and how to bring its schema up to date. Queries are registered in the
+    # Postgres dialect, with psycopg2 placeholders, and each engine runs them however it has to.
+    name = None
+    # The base class of every error the driver raises, and the ones which mean the connection itself is unusable.
+    error = Exception
+    connection_errors = ()
+    # How many connections the pool may open at once.
+    max_connections = None
+    # Whether the schema is created and upgraded by the files in db/migrations. Engines without migrations implement
+    # create_schema(connection, version) instead, which creates the schema or checks that it is up to date.
+    migrations = False
+
+    def connect(self):
+        raise NotImplementedError
+
+    def in_transaction(self, connection) -> bool:
+        raise NotImplementedError
+
+    def execute(self, cursor, query, params=None) -> None:
+        raise NotImplementedError
+
+    def execute_values(self, cursor, query, argslist, template=None, page_size=100, fetch=False):
+        raise NotImplementedError
+
+    def stream_cursor(self, connection, name):
+        # A cursor whose rows are only read from the database as they're fetched, for results too big to hold.
+        raise NotImplementedError
+
+    def is_disconnect(self, error) -> bool:
+        # Whether the error means the connection itself is unusable, so the pool has to replace it.
+        return isinstance(error, self.connection_errors)
+
+    def forget(self, connection) -> None:
+        pass
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}{{name={self.name}}}'
+
+
+class PostgresEngine(StorageEngine):
+    name = 'postgres'
+    error = psycopg2.Error
+    connection_errors = (psycopg2.OperationalError, psycopg2.InterfaceError)
+    migrations = True
+
+    def __init__(self, dsn=None, prepare=True) -> None:
+        self.logger = logging.getLogger('sprintathon.PostgresEngine')
+        self.dsn = dsn
+        # Statements are prepared the first time they're run on each connection, and executed by name from then on,
+        # so Postgres only parses and plans them once per connection. Session-level prepared statements don't work
+        # behind a transaction-pooling proxy like PgBouncer.
+        self.prepare = prepare
+        # The names prepared on each psycopg2 connection. Connections closed by the pool drop out on their own.
+        self._prepared = weakref.WeakKeyDictionary()
+        # Query name -> (PREPARE statement, EXECUTE statement).
+        self._statements = dict()
+        self._lock = threading.Lock()
+        # Server-side cursor names only have to be unique per connection, but this is simpler than tracking them.
+        self._cursor_ids = itertools.count()
+
+    def connect(self):
+        return psycopg2.connect(self.dsn)
+
+    def in_transaction(self, connection) -> bool:
+        return connection.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def _statements_for(self, query) -> tuple:
+        statements = self._statements.get(query.name)
+        if statements is None:
+            count = 0
+
+            def replace(match):
+                nonlocal count
+                if match.group(0) == '%%':
+                    return '%'
+                count += 1
+                return f'${count}'
+
+            prepare_sql = f'PREPARE {query.name} AS {_placeholder_pattern.sub(replace, query.sql)}'
+            execute_sql = f'EXECUTE {query.name}' if count == 0 else \
+                f'EXECUTE {query.name}({", ".join(["%s"] * count)})'
+            statements = self._statements[query.name] = (prepare_sql, execute_sql)
+        return statements
+
+    def execute(self, cursor, query, params=None) -> None:
+        if not (self.prepare and query.prepare):
+            cursor.execute(query.sql, params)
+            return
+
+        prepare_sql, execute_sql = self._statements_for(query)
+        connection = cursor.connection
+        with self._lock:
+            prepared = self._prepared.setdefault(connection, set())
+            needs_prepare = query.name not in prepared
+        if needs_prepare:
+            self.logger.debug('Preparing %s on connection %x.', query.name, id(connection))
+            cursor.execute(prepare_sql)
+            with self._lock:
+                prepared.add(query.name)
+        cursor.execute(execute_sql, params)
+
+    def execute_values(self, cursor, query, argslist, template=None, page_size=100, fetch=False):
+        return execute_values(cursor, query.sql, argslist, template=template, page_size=page_size, fetch=fetch)
+
+    def stream_cursor(self, connection, name):
+        # A named (server-side) cursor: the query runs as a DECLARE, and each fetchmany() is a FETCH, so only one batch
+        # is ever in memory. It only lives as long as the transaction, and can't DECLARE an EXECUTE, so its queries have
+        # to be registered with prepare=False.
+        return connection.cursor(f'{name}_{next(self._cursor_ids)}')
+
+    def forget(self, connection) -> None:
+        # For connections whose session was reset, e.g. by DISCARD ALL.
+        with self._lock:
+            self._prepared.pop(connection, None)
+
+    def __repr__(self) -> str:
+        return f'PostgresEngine{{prepare={self.prepare}}}'
+
+
+def _adapt_datetime(value) -> str:
+    # Stored as UTC ISO 8601 strings of a fixed width, so they sort and compare as text.
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=datetime.timezone.utc)
+    return value.astimezone(datetime.timezone.utc).isoformat(timespec='microseconds')
+
+
+sqlite3.register_adapter(datetime.datetime, _adapt_datetime)
+# For = ANY(%s), which becomes a JSON_EACH() over the list.
+sqlite3.register_adapter(list, json.dumps)
+sqlite3.register_converter('TIMESTAMPTZ', lambda value: datetime.datetime.fromisoformat(value.decode()))
+# Durations are stored in seconds.
+sqlite3.register_converter('INTERVAL', lambda value: datetime.timedelta(seconds=float(value)))
+sqlite3.register_converter('BOOLEAN', lambda value: bool(int(value)))
+
+# Rewrites the Postgres-only parts of the registered queries into SQLite, in order, before the placeholders are
+# converted. Queries these can't cover register their own SQLite SQL.
+_sqlite_rewrites = [
+    (re.compile(r'MAKE_INTERVAL\(mins => %s\)'), '(%s * 60)'),
+    (re.compile(r'MAKE_INTERVAL\(hours => %s\)'), '(%s * 3600)'),
+    (re.compile(r'CAST\((%s) AS TIMESTAMP WITH TIME ZONE\)'), r'\1'),
+    (re.compile(r'NOW\(\)'), "STRFTIME('%%Y-%%m-%%dT%%H:%%M:%%f000+00:00', 'now')"),
+    (re.compile(r'= ANY\((%s)\)'), r'IN (SELECT VALUE FROM JSON_EACH(\1))'),
+]
+
+
+def sqlite_dialect(sql) -> str:
+    for pattern, replacement in _sqlite_rewrites:
+        sql = pattern.sub(replacement, sql)
+    return _placeholder_pattern.sub(lambda match: '%' if match.group(0) == '%%' else '?', sql)
+
+
+class SqliteCursor:
+    # sqlite3 cursors aren't context managers, and every model uses its cursor as one.
+    def __init__(self, connection, cursor) -> None:
+        self.connection = connection
+        self._cursor = cursor
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self._cursor.close()
+
+    def execute(self, sql, params=None) -> None:
+        self._cursor.execute(sql, params or ())
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchmany(self, size) -> list:
+        return self._cursor.fetchmany(size)
+
+    def fetchall(self) -> list:
+        return self._cursor.fetchall()
+
+    @property
+    def rowcount(self) -> int:
+        return self._cursor.rowcount
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    def close(self) -> None:
+        self._cursor.close()
+
+
+class SqliteConnection:
+    def __init__(self, connection) -> None:
+        self.raw = connection
+        self.closed = False
+
+    def cursor(self) -> SqliteCursor:
+        return SqliteCursor(self, self.raw.cursor())
+
+    def commit(self) -> None:
+        self.raw.commit()
+
+    def rollback(self) -> None:
+        self.raw.rollback()
+
+    def close(self) -> None:
+        self.closed = True
+        self.raw.close()
+
+
+class SqliteEngine(StorageEngine):
+    # A database file, or with :memory: a database that only lasts as long as the process, for small guilds, CI and
+    # benchmarks that shouldn't measure a database server. SQLite only runs one writer at a time anyway, so the pool
+    # holds a single connection, which also keeps an in-memory database alive between checkouts.
+    name = 'sqlite'
+    error = sqlite3.Error
+    # There's no server to lose the connection to, see is_disconnect().
+    connection_errors = ()
+    max_connections = 1
+    schema_file = 'db/sqlite/schema.sql'
+
+    def __init__(self, path=':memory:') -> None:
+        self.logger = logging.getLogger('sprintathon.SqliteEngine')
+        self.path = path
+        # Query name -> its SQL (or statements) in the SQLite dialect. sqlite3 caches the compiled statements itself.
+        self._statements = dict()
+
+    def connect(self) -> SqliteConnection:
+        connection = sqlite3.connect(self.path, detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False)
+        # Not every SQLite build has the math functions.
+        connection.create_function('CEIL', 1, math.ceil, deterministic=True)
+        connection.execute('PRAGMA foreign_keys = ON')
+        return SqliteConnection(connection)
+
+    def in_transaction(self, connection) -> bool:
+        return connection.raw.in_transaction
+
+    def _statements_for(self, query) -> tuple:
+        statements = self._statements.get(query.name)
+        if statements is None:
+            override = query.dialects.get(self.name)
+            if override is None:
+                statements = (sqlite_dialect(query.sql),)
+            elif isinstance(override, str):
+                statements = (override,)
+            else:
+                # Run one after the other with the same parameters, so they have to use numbered ones (?1).
+                statements = tuple(override)
+            self._statements[query.name] = statements
+        return statements
+
+    def execute(self, cursor, query, params=None) -> None:
+        for statement in self._statements_for(query):
+            cursor.execute(statement, params)
+
+    def execute_values(self, cursor, query, argslist, template=None, page_size=100, fetch=False):
+        # One row at a time, as SQLite doesn't promise RETURNING rows come back in the order they were inserted. It's
+        # all in-process, so there's no round trip to save.
+        prefix, suffix = query.sql.split('VALUES %s')
+        statements = dict()
+        result = []
+        for row in argslist:
+            row_template = template or f'({", ".join(["%s"] * len(row))})'
+            statement = statements.get(row_template)
+            if statement is None:
+                statement = statements[row_template] = sqlite_dialect(f'{prefix}VALUES {row_template}{suffix}')
+            cursor.execute(statement, row)
+            if fetch:
+                result.extend(cursor.fetchall())
+        return result if fetch else None
+
+    def stream_cursor(self, connection, name):
+        # sqlite3 already steps through the results as they're fetched.
+        return connection.cursor()
+
+    def is_disconnect(self, error) -> bool:
+        # sqlite3 raises ProgrammingError for plain bugs too, like the wrong number of bindings, so only a closed
+        # database counts. An in-memory database only exists as long as its one connection, so that is never replaced.
+        return self.path != ':memory:' and isinstance(error, sqlite3.ProgrammingError) and \
+            'closed database' in str(error)
+
+    def create_schema(self, connection, version) -> bool:
+        # The schema file is always the current version, so there is nothing to migrate yet: a new database gets the
+        # whole thing, and an existing one has to match.
+        with open(self.schema_file) as schema_file:
+            connection.raw.executescript(schema_file.read())
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT MAJOR, MINOR, PATCH FROM _VERSION')
+            schema_version = list(cursor.fetchone())
+        if schema_version != list(version):
+            self.logger.critical('SQLite database schema is v%s, but the application is v%s, and SQLite databases '
+                                 'have no migrations.', '.'.join(map(str, schema_version)),
+                                 '.'.join(map(str, version)))
+            return False
+        self.logger.info('SQLite database %s is at schema v%s.', self.path, '.'.join(map(str, version)))
+        return True
+
+    def __repr__(self) -> str:
+        return f'SqliteEngine{{path={self.path}}}'
+
+
+def create_engine(connection_string, prepare=True) -> StorageEngine:
+    if connection_string is not None and connection_string.startswith(SQLITE_PREFIX):
+        return SqliteEngine(connection_string[len(SQLITE_PREFIX):] or ':memory:')
+    return PostgresEngine(connection_string, prepare)
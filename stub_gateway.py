@@ -0,0 +1,69 @@
+import asyncio
+import logging
+
+
+class StubChannel:
+    def __init__(self, channel_id) -> None:
+        self.logger = logging.getLogger('sprintathon.StubChannel')
+        self.id = channel_id
+        self.messages = []
+
+    async def send(self, content=None, **kwargs):
+        self.messages.append(content)
+        self.logger.info('Message to channel %s: %s', self.id, content)
+
+    def __repr__(self) -> str:
+        return f'StubChannel{{id={self.id},messages={len(self.messages)}}}'
+
+
+class StubGuild:
+    def __init__(self, guild_id, name) -> None:
+        self.id = guild_id
+        self.name = name
+
+    def __repr__(self) -> str:
+        return f'StubGuild{{id={self.id},name={self.name}}}'
+
+
+class StubBot:
+    # Stands in for commands.Bot without connecting to Discord, so a (sharded) deployment can be run locally against
+    # a real database. Scheduled sprint and Spr*ntathon phases still run, and their messages are logged.
+    def __init__(self, guilds=None, shard_ids=None, shard_count=None) -> None:
+        self.logger = logging.getLogger('sprintathon.StubBot')
+        self.guilds = list(guilds or ())
+        self.shard_ids = shard_ids
+        self.shard_count = shard_count
+        self.cogs = []
+        self._channels = dict()
+        self._before_invoke = None
+        self._after_invoke = None
+
+    def add_cog(self, cog) -> None:
+        self.cogs.append(cog)
+
+    def before_invoke(self, coro):
+        self._before_invoke = coro
+        return coro
+
+    def after_invoke(self, coro):
+        self._after_invoke = coro
+        return coro
+
+    def get_channel(self, channel_id) -> StubChannel:
+        channel = self._channels.get(channel_id)
+        if channel is None:
+            channel = self._channels[channel_id] = StubChannel(channel_id)
+        return channel
+
+    def run(self, token=None) -> None:
+        try:
+            asyncio.run(self._run())
+        except KeyboardInterrupt:
+            pass
+
+    async def _run(self) -> None:
+        self.logger.info('Running against the stub gateway as shards %s of %s.', self.shard_ids, self.shard_count)
+        for cog in self.cogs:
+            await cog.on_ready()
+        # Runs until the process is interrupted or terminated.
+        await asyncio.Event().wait()
@@ -1,97 +1,145 @@
 import logging
 
-from dbo import Dbo
+from dbo import Dbo, Repository
 from member import Member
+from queries import registry
 
 
 class Submission(Dbo):
-    def __init__(self, connection, _id=None, member=None, word_count=0, _type='', datetime=None) -> None:
-        self.logger = logging.getLogger('sprintathon.Submission')
-        super().__init__(connection)
+    __slots__ = ('id', 'member', 'word_count', 'type', 'datetime')
+
+    def __init__(self, _id=None, member=None, word_count=0, _type='', datetime=None) -> None:
         self.id = _id
         self.member = member
         self.word_count = word_count
         self.type = _type
         self.datetime = datetime
 
-    def create(self) -> int:
+    def __repr__(self) -> str:
+        return f'Submission{{id={self.id},member={repr(self.member)},word_count={self.word_count},type={self.type},' \
+               f'datetime={self.datetime}}} '
+
+
+class SubmissionRepository(Repository):
+    __slots__ = ()
+    logger = logging.getLogger('sprintathon.SubmissionRepository')
+
+    CREATE = registry.register('submission_create',
+                               'INSERT INTO SUBMISSION(MEMBER_ID, WORD_COUNT, TYPE, DATETIME) '
+                               'VALUES(%s, %s, %s, NOW()) RETURNING ID, DATETIME')
+    CREATE_AT = registry.register('submission_create_at',
+                                  'INSERT INTO SUBMISSION(MEMBER_ID, WORD_COUNT, TYPE, DATETIME) '
+                                  'VALUES(%s, %s, %s, %s) RETURNING ID, DATETIME')
+    UPDATE = registry.register('submission_update',
+                               'UPDATE SUBMISSION SET MEMBER_ID = %s, WORD_COUNT = %s, TYPE = %s, DATETIME = NOW() '
+                               'WHERE ID=%s RETURNING DATETIME')
+    UPDATE_AT = registry.register('submission_update_at',
+                                  'UPDATE SUBMISSION SET MEMBER_ID = %s, WORD_COUNT = %s, TYPE = %s, DATETIME = %s '
+                                  'WHERE ID=%s RETURNING DATETIME')
+    DELETE = registry.register('submission_delete', 'DELETE FROM SUBMISSION WHERE ID=%s')
+    FIND_BY_ID = registry.register('submission_find_by_id',
+                                   'SELECT SUBMISSION.WORD_COUNT, SUBMISSION.TYPE, SUBMISSION.DATETIME, MEMBER.ID, '
+                                   'MEMBER.NAME, MEMBER.DISCORD_USER_ID FROM SUBMISSION '
+                                   'INNER JOIN MEMBER ON SUBMISSION.MEMBER_ID=MEMBER.ID WHERE SUBMISSION.ID=%s')
+    INSERT_ALL = registry.register('submission_insert_all',
+                                   'INSERT INTO SUBMISSION(MEMBER_ID, WORD_COUNT, TYPE, DATETIME) VALUES %s '
+                                   'RETURNING ID, DATETIME', prepare=False)
+    FIND_ALL_BY_MEMBER = registry.register('submission_find_all_by_member',
+                                           'SELECT ID, WORD_COUNT, TYPE, DATETIME FROM SUBMISSION WHERE MEMBER_ID=%s')
+    FIND_ALL_BY_MEMBER_AND_SPRINT = registry.register(
+        'submission_find_all_by_member_and_sprint',
+        'SELECT SUBMISSION.ID, SUBMISSION.WORD_COUNT, SUBMISSION.TYPE, SUBMISSION.DATETIME FROM SUBMISSION '
+        'INNER JOIN SPRINT_SUBMISSION ON SUBMISSION.ID=SPRINT_SUBMISSION.SUBMISSION_ID '
+        'INNER JOIN SPRINT ON SPRINT.ID=SPRINT_SUBMISSION.SPRINT_ID '
+        'WHERE SUBMISSION.MEMBER_ID=%s AND SPRINT.ID=%s')
+    GET_LAST_FOR_MEMBER = registry.register('submission_get_last_for_member',
+                                            'SELECT SUBMISSION.ID, SUBMISSION.WORD_COUNT, SUBMISSION.TYPE, '
+                                            'SUBMISSION.DATETIME FROM SUBMISSION WHERE SUBMISSION.MEMBER_ID=%s AND '
+                                            'SUBMISSION.TYPE<>%s ORDER BY SUBMISSION.DATETIME DESC, SUBMISSION.ID DESC '
+                                            'LIMIT 1')
+    # Read through a server-side cursor, which can't DECLARE a prepared statement.
+    STREAM_HISTORY = registry.register('submission_stream_history',
+                                       'SELECT SUBMISSION.ID, SUBMISSION.TYPE, SUBMISSION.WORD_COUNT, '
+                                       'SUBMISSION.DATETIME, SPRINT.ID, SPRINT.DURATION FROM SUBMISSION '
+                                       'LEFT JOIN SPRINT_SUBMISSION ON SUBMISSION.ID=SPRINT_SUBMISSION.SUBMISSION_ID '
+                                       'LEFT JOIN SPRINT ON SPRINT_SUBMISSION.SPRINT_ID=SPRINT.ID '
+                                       'WHERE SUBMISSION.MEMBER_ID=%s ORDER BY SUBMISSION.DATETIME, SUBMISSION.ID',
+                                       prepare=False)
+
+    def create(self, submission) -> int:
         with self.connection.cursor() as cursor:
-            if self.datetime is None:
-                cursor.execute(
-                    'INSERT INTO SUBMISSION(MEMBER_ID, WORD_COUNT, TYPE, DATETIME) VALUES(%s, %s, %s, NOW()) '
-                    'RETURNING ID, DATETIME', [self.member.id, self.word_count, self.type])
+            if submission.datetime is None:
+                SubmissionRepository.CREATE.execute(cursor, [submission.member.id, submission.word_count,
+                                                             submission.type])
             else:
-                cursor.execute(
-                    'INSERT INTO SUBMISSION(MEMBER_ID, WORD_COUNT, TYPE, DATETIME) VALUES(%s, %s, %s, %s) '
-                    'RETURNING ID, DATETIME', [self.member.id, self.word_count, self.type, self.datetime])
+                SubmissionRepository.CREATE_AT.execute(cursor, [submission.member.id, submission.word_count,
+                                                                submission.type, submission.datetime])
             result = cursor.fetchone()
-            self.id = result[0]
-            self.datetime = result[1]
+            submission.id = result[0]
+            submission.datetime = result[1]
             self.connection.commit()
-            self.logger.debug('Inserting %s into database.', self)
-            return self.id
+            self.logger.debug('Inserting %s into database.', submission)
+            return submission.id
 
-    def update(self) -> None:
+    def update(self, submission) -> None:
         with self.connection.cursor() as cursor:
-            if self.datetime is None:
-                cursor.execute('UPDATE SUBMISSION SET MEMBER_ID = %s, WORD_COUNT = %s, TYPE = %s, DATETIME = NOW() '
-                               'WHERE ID=%s RETURNING DATETIME', (self.member.id, self.word_count, self.type, self.id))
+            if submission.datetime is None:
+                SubmissionRepository.UPDATE.execute(cursor, (submission.member.id, submission.word_count,
+                                                             submission.type, submission.id))
             else:
-                cursor.execute(
-                    'UPDATE SUBMISSION SET MEMBER_ID = %s, WORD_COUNT = %s, TYPE = %s, DATETIME = %s WHERE ID=%s '
-                    'RETURNING DATETIME', (self.member.id, self.word_count, self.type, self.datetime, self.id))
-            self.datetime = cursor.fetchone()[0]
+                SubmissionRepository.UPDATE_AT.execute(cursor, (submission.member.id, submission.word_count,
+                                                                submission.type, submission.datetime, submission.id))
+            submission.datetime = cursor.fetchone()[0]
             self.connection.commit()
-            self.logger.debug('Updating %s in database.', self)
+            self.logger.debug('Updating %s in database.', submission)
 
-    def delete(self) -> None:
+    def delete(self, submission) -> None:
         with self.connection.cursor() as cursor:
-            cursor.execute('DELETE FROM SUBMISSION WHERE ID=%s', [self.id])
+            SubmissionRepository.DELETE.execute(cursor, [submission.id])
             self.connection.commit()
-            self.logger.debug('Deleting %s from database.', self)
+            self.logger.debug('Deleting %s from database.', submission)
 
     def find_by_id(self, _id):
-        self.id = _id
         with self.connection.cursor() as cursor:
-            cursor.execute('SELECT MEMBER_ID, WORD_COUNT, TYPE, DATETIME FROM SUBMISSION WHERE SUBMISSION.ID=%s',
-                           [self.id])
+            SubmissionRepository.FIND_BY_ID.execute(cursor, [_id])
             result = cursor.fetchone()
-            self.member = Member(connection=self.connection).find_by_id(result[0])
-            self.word_count = result[1]
-            self.type = result[2]
-            self.datetime = result[3]
-        return self
+            return Submission(_id, Member(result[3], result[4], result[5]), result[0], result[1], result[2])
 
     @staticmethod
-    def find_all_by_member(connection, member):
-        with connection.cursor() as cursor:
-            cursor.execute('SELECT ID, WORD_COUNT, TYPE, DATETIME FROM SUBMISSION WHERE MEMBER_ID=%s', [member.id])
+    def insert_all(cursor, submissions):
+        # Inserts every submission with one multi-row INSERT on the caller's cursor. The caller owns the transaction.
+        if not submissions:
+            return
+        result = SubmissionRepository.INSERT_ALL.execute_values(
+            cursor, [(item.member.id, item.word_count, item.type, item.datetime) for item in submissions],
+            template='(%s, %s, %s, COALESCE(CAST(%s AS TIMESTAMP WITH TIME ZONE), NOW()))',
+            page_size=len(submissions), fetch=True)
+        for item, row in zip(submissions, result):
+            item.id = row[0]
+            item.datetime = row[1]
+
+    def find_all_by_member(self, member):
+        with self.connection.cursor() as cursor:
+            SubmissionRepository.FIND_ALL_BY_MEMBER.execute(cursor, [member.id])
             result = cursor.fetchall()
-            return [Submission(connection, item[0], member, item[1], item[2], item[3]) for item in result]
+            return [Submission(item[0], member, item[1], item[2], item[3]) for item in result]
 
-    @staticmethod
-    def find_all_by_member_and_sprint(connection, member, sprint):
-        with connection.cursor() as cursor:
-            cursor.execute(
-                'SELECT SUBMISSION.ID, SUBMISSION.WORD_COUNT, SUBMISSION.TYPE, SUBMISSION.DATETIME FROM SUBMISSION '
-                'INNER JOIN SPRINT_SUBMISSION ON SUBMISSION.ID=SPRINT_SUBMISSION.SUBMISSION_ID '
-                'INNER JOIN SPRINT ON SPRINT.ID=SPRINT_SUBMISSION.SPRINT_ID '
-                'WHERE SUBMISSION.MEMBER_ID=%s AND SPRINT.ID=%s', (member.id, sprint.id))
+    def find_all_by_member_and_sprint(self, member, sprint):
+        with self.connection.cursor() as cursor:
+            SubmissionRepository.FIND_ALL_BY_MEMBER_AND_SPRINT.execute(cursor, (member.id, sprint.id))
             result = cursor.fetchall()
-            return [Submission(connection, item[0], member, item[1], item[2], item[3]) for item in result]
+            return [Submission(item[0], member, item[1], item[2], item[3]) for item in result]
 
-    @staticmethod
-    def get_last_for_member(connection, member):
-        with connection.cursor() as cursor:
-            cursor.execute(
-                'SELECT SUBMISSION.ID, SUBMISSION.WORD_COUNT, SUBMISSION.TYPE, SUBMISSION.DATETIME '
-                'FROM SUBMISSION WHERE SUBMISSION.MEMBER_ID=%s AND SUBMISSION.TYPE<>%s '
-                'ORDER BY SUBMISSION.DATETIME DESC LIMIT 1', (member.id, 'DELTA'))
+    def stream_history(self, member, batch_size=500):
+        # Every submission the member has made, oldest first, in lists of up to batch_size (ID, TYPE, WORD_COUNT,
+        # DATETIME, SPRINT.ID, SPRINT.DURATION) rows. Kept as plain rows, as a long history would otherwise mean
+        # building thousands of Submissions.
+        return SubmissionRepository.STREAM_HISTORY.stream(self.connection, [member.id], batch_size)
+
+    def get_last_for_member(self, member):
+        with self.connection.cursor() as cursor:
+            SubmissionRepository.GET_LAST_FOR_MEMBER.execute(cursor, (member.id, 'DELTA'))
             result = cursor.fetchone()
             if result is None:
                 return None
-            return Submission(connection, result[0], member, result[1], result[2], result[3])
-
-    def __repr__(self) -> str:
-        return f'Submission{{id={self.id},member={repr(self.member)},word_count={self.word_count},type={self.type},' \
-               f'datetime={self.datetime}}} '
+            return Submission(result[0], member, result[1], result[2], result[3])
@@ -0,0 +1,91 @@
+import asyncio
+import datetime
+import logging
+
+from sprint import SprintRepository
+
+
+class SubmissionBuffer:
+    # Write-behind buffer for check-ins: submissions are acknowledged as soon as they're queued, and written to the
+    # database in batches, every flush_interval seconds or max_batch_size submissions, whichever comes first.
+    def __init__(self, database, flush_interval=0.25, max_batch_size=50, max_attempts=5) -> None:
+        self.logger = logging.getLogger('sprintathon.SubmissionBuffer')
+        self.database = database
+        self.sprints = SprintRepository(database.connection)
+        self.flush_interval = flush_interval
+        self.max_batch_size = max_batch_size
+        self.max_attempts = max_attempts
+        # (Sprint, Submission) pairs, in the order they were submitted.
+        self._pending = []
+        # The last batch that failed to write, retried on its own before anything newer until max_attempts is reached.
+        self._failed = []
+        self._failed_attempts = 0
+        self._flush_lock = asyncio.Lock()
+        # Wakes the flush task early once a full batch is queued.
+        self._wake = asyncio.Event()
+        self._task = None
+
+    def start(self) -> None:
+        if self._task is not None and not self._task.done():
+            return
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def add(self, _sprint, submission) -> None:
+        if submission.datetime is None:
+            # Stamp the submission now, rather than when it happens to be flushed.
+            submission.datetime = datetime.datetime.now(datetime.timezone.utc)
+        self._pending.append((_sprint, submission))
+        if len(self._pending) >= self.max_batch_size:
+            self._wake.set()
+
+    def get_last_for_member(self, member):
+        return next((item for _, item in reversed(self._failed + self._pending) if item.member.id == member.id and
+                     item.type != 'DELTA'), None)
+
+    def __len__(self) -> int:
+        return len(self._failed) + len(self._pending)
+
+    async def flush(self) -> None:
+        async with self._flush_lock:
+            if self._failed:
+                batch, attempts, self._failed = self._failed, self._failed_attempts, []
+                await self._write(batch, attempts)
+            batch, self._pending = self._pending, []
+            if batch:
+                await self._write(batch, 0)
+
+    async def _write(self, batch, attempts) -> None:
+        try:
+            await self.database.run(self.sprints.add_all_submissions, batch)
+            self.logger.debug('Flushed %i submissions.', len(batch))
+        except Exception:
+            attempts += 1
+            if attempts >= self.max_attempts:
+                self.logger.exception('Dropping %i submissions after %i failed attempts: %s', len(batch), attempts,
+                                      [submission for _, submission in batch])
+            else:
+                self.logger.exception('Failed to flush %i submissions, they will be retried.', len(batch))
+                self._failed, self._failed_attempts = batch, attempts
+            raise
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+            except Exception:
+                pass
+
+    def close(self) -> None:
+        # Called on shutdown, once the event loop has stopped (and cancelled the flush task), to write out anything
+        # that is still queued.
+        self._task = None
+        batch, self._failed, self._pending = self._failed + self._pending, [], []
+        if batch:
+            with self.database.connection.connection():
+                self.sprints.add_all_submissions(batch)
+            self.logger.info('Flushed %i submissions on shutdown.', len(batch))
@@ -0,0 +1,72 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import main  # noqa: E402
+from cache import TTLCache  # noqa: E402
+from member import MemberRepository  # noqa: E402
+from server import ServerRepository  # noqa: E402
+from sprintathon import SprintathonRepository  # noqa: E402
+
+# A Postgres server to run the conformance tests against as well, e.g. postgresql://postgres@localhost/postgres. Each
+# test gets a throwaway database on it, like bench.py's.
+POSTGRES_DSN = os.environ.get('SPRINTATHON_TEST_DATABASE_URL')
+
+
+def _create_database(dsn, name) -> str:
+    import psycopg2
+    import psycopg2.extensions
+    connection = psycopg2.connect(dsn)
+    connection.autocommit = True
+    with connection.cursor() as cursor:
+        cursor.execute(f'DROP DATABASE IF EXISTS {name}')
+        cursor.execute(f'CREATE DATABASE {name}')
+    connection.close()
+    return psycopg2.extensions.make_dsn(dsn, dbname=name)
+
+
+def _drop_database(dsn, name) -> None:
+    import psycopg2
+    connection = psycopg2.connect(dsn)
+    connection.autocommit = True
+    with connection.cursor() as cursor:
+        cursor.execute(f'DROP DATABASE IF EXISTS {name}')
+    connection.close()
+
+
+@pytest.fixture(params=['sqlite', 'postgres'])
+def engine_name(request):
+    if request.param == 'postgres' and not POSTGRES_DSN:
+        pytest.skip('SPRINTATHON_TEST_DATABASE_URL is not set')
+    return request.param
+
+
+@pytest.fixture
+def connection(engine_name, monkeypatch):
+    # A freshly migrated database, checked out on the calling thread. The schema and migration files are read relative
+    # to the repository root.
+    monkeypatch.chdir(ROOT)
+    MemberRepository.cache = TTLCache()
+    ServerRepository.cache = TTLCache()
+    ServerRepository.members_cache = TTLCache()
+    SprintathonRepository.leaderboard_cache.clear()
+
+    name = None
+    dsn = 'sqlite://:memory:'
+    if engine_name == 'postgres':
+        name = f'sprintathon_test_{os.getpid()}'
+        dsn = _create_database(POSTGRES_DSN, name)
+    try:
+        assert main.initialize_database(dsn, min_size=1, max_size=1)
+        try:
+            with main.pool.connection() as _connection:
+                yield _connection
+        finally:
+            main.pool.close()
+    finally:
+        if name is not None:
+            _drop_database(POSTGRES_DSN, name)
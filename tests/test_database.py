@@ -0,0 +1,24 @@
+import sqlite3
+
+import pytest
+
+import main
+from conftest import ROOT
+
+
+def test_sqlite_errors_keep_the_in_memory_database(monkeypatch):
+    # A bad query must not make the pool replace the only connection, and with it the whole database.
+    monkeypatch.chdir(ROOT)
+    assert main.initialize_database('sqlite://:memory:')
+    try:
+        with pytest.raises(sqlite3.ProgrammingError):
+            with main.pool.connection() as connection:
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT ?', (1, 2))
+        with main.pool.connection() as connection:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT MAJOR, MINOR, PATCH FROM _VERSION')
+                assert list(cursor.fetchone()) == main.__version__
+        assert main.pool.stats.connects == 1
+    finally:
+        main.pool.close()
@@ -0,0 +1,348 @@
+import datetime
+import io
+import json
+
+import pytest
+
+import history
+from dbo import UnloadedRelationError
+from job import Job, JobRepository
+from member import Member, MemberRepository
+from queries import Query, registry
+from registry import ActiveSprintRegistry
+from server import Server, ServerRepository
+from sprint import Sprint, SprintRepository
+from sprintathon import Sprintathon, SprintathonRepository
+from submission import Submission, SubmissionRepository
+
+# Every registered query has to behave the same on each StorageEngine, so each test here runs against both (see
+# conftest.py).
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def _guild_on_shard(shard_id, shard_count):
+    # A Discord guild ID that router.shard_for_guild() puts on the given shard.
+    return (shard_count * 1000 + shard_id) << 22
+
+
+class Fixture:
+    def __init__(self, connection) -> None:
+        self.members = MemberRepository(connection)
+        self.servers = ServerRepository(connection)
+        self.sprints = SprintRepository(connection)
+        self.sprintathons = SprintathonRepository(connection)
+        self.submissions = SubmissionRepository(connection)
+        self.jobs = JobRepository(connection)
+
+    def member(self, discord_user_id, name=None):
+        return self.members.find_or_create(Member(name=name or f'member-{discord_user_id}',
+                                                  discord_user_id=discord_user_id))
+
+    def server(self, discord_guild_id=_guild_on_shard(0, 1)):
+        return self.servers.find_or_create(Server(name=f'guild-{discord_guild_id}', discord_guild_id=discord_guild_id))
+
+    def sprintathon(self, _server, duration=2, channel_id=100):
+        _sprintathon = Sprintathon(duration=duration, _server=_server, discord_channel_id=channel_id)
+        self.sprintathons.create(_sprintathon)
+        return _sprintathon
+
+    def sprint(self, _server, _sprintathon=None, duration=15, channel_id=100):
+        _sprint = Sprint(duration=duration, _server=_server, _sprintathon=_sprintathon, discord_channel_id=channel_id)
+        self.sprints.create(_sprint)
+        return _sprint
+
+    def check_in(self, _sprint, _member, submission_type, word_count):
+        self.sprints.add_member(_sprint, _member)
+        _submission = Submission(member=_member, word_count=word_count, _type=submission_type)
+        self.sprints.add_submission(_sprint, _submission)
+        return _submission
+
+
+@pytest.fixture
+def db(connection):
+    return Fixture(connection)
+
+
+def test_member_round_trip(db):
+    member = db.member(1, 'alice')
+    assert member.id is not None
+    assert db.members.find_by_id(member.id).name == 'alice'
+    assert db.members.find_by_discord_user_id(1).id == member.id
+    assert db.members.find_by_discord_user_id(2) is None
+
+    # Found again by DISCORD_USER_ID, under a new name.
+    renamed = db.member(1, 'alicia')
+    assert renamed.id == member.id
+    assert db.members.find_by_name('alicia').id == member.id
+
+    # The cache keeps its own copies, so callers changing theirs don't change what's cached.
+    renamed.name = 'changed'
+    db.members.find_by_discord_user_id(1).name = 'changed'
+    assert db.members.find_by_discord_user_id(1).name == 'alicia'
+
+    db.members.delete(member)
+    assert db.members.find_by_discord_user_id(1) is None
+
+
+def test_server_members(db):
+    server = db.server()
+    assert db.server().id == server.id
+    alice, bob = db.member(1), db.member(2)
+    assert db.servers.add_member(server, alice)
+    assert not db.servers.add_member(server, alice)
+    db.servers.add_member(server, bob)
+    assert sorted(item.id for item in db.servers.get_members(server)) == sorted([alice.id, bob.id])
+
+    # Deleting a member forgets their cached memberships too, once the rows themselves are gone.
+    remove_memberships = Query(registry, 'test_remove_memberships', 'DELETE FROM SERVER_MEMBER WHERE MEMBER_ID=%s',
+                               prepare=False)
+    with db.servers.connection.cursor() as cursor:
+        remove_memberships.execute(cursor, [bob.id])
+    db.members.delete(bob)
+    assert ServerRepository.members_cache.get((server.id, bob.id)) is None
+
+
+def test_defaults_and_durations(db):
+    # START defaults to NOW(), and durations go through MAKE_INTERVAL().
+    before = _now() - datetime.timedelta(seconds=5)
+    server = db.server()
+    sprintathon = db.sprintathon(server, duration=3)
+    sprint = db.sprint(server, sprintathon, duration=25)
+    after = _now() + datetime.timedelta(seconds=5)
+    assert before <= sprint.start <= after
+    assert before <= sprintathon.start <= after
+
+    loaded = db.sprints.find_by_id(sprint.id)
+    assert loaded.duration == 25
+    assert loaded.start == sprint.start
+    assert loaded.server.discord_guild_id == server.discord_guild_id
+    assert loaded.sprintathon.id == sprintathon.id
+    assert loaded.sprintathon.server.id == server.id
+    assert db.sprintathons.find_by_id(sprintathon.id).duration == 3
+
+    loaded.duration = 30
+    db.sprints.update(loaded)
+    assert db.sprints.find_by_id(sprint.id).duration == 30
+
+    submission = db.check_in(sprint, db.member(1), 'START', 10)
+    assert before <= submission.datetime <= _now() + datetime.timedelta(seconds=5)
+
+
+def test_relations_given_by_id_are_not_loaded_lazily(db):
+    server = db.server()
+    sprintathon = db.sprintathon(server)
+    db.sprint(server, sprintathon)
+    sprint = db.servers.get_sprints(server)[0]
+    with pytest.raises(UnloadedRelationError):
+        sprint.sprintathon
+    db.sprints.load_relations(sprint)
+    assert sprint.sprintathon.id == sprintathon.id
+
+
+def test_participant_states(db):
+    server = db.server()
+    sprint = db.sprint(server)
+    alice, bob, carol = db.member(1), db.member(2), db.member(3)
+    db.check_in(sprint, alice, 'START', 100)
+    db.check_in(sprint, alice, 'FINISH', 150)
+    db.check_in(sprint, bob, 'START', 20)
+    db.sprints.add_member(sprint, carol)
+
+    states = db.sprints.get_participant_states(sprint)
+    assert states[alice.id].start_word_count == 100
+    assert states[alice.id].finish_word_count == 150
+    assert states[bob.id].next_submission_type == 'FINISH'
+    assert states[carol.id].next_submission_type == 'START'
+
+    # Only the given members, through = ANY().
+    states = db.sprints.get_participant_states(sprint, [bob, carol])
+    assert sorted(states) == sorted([bob.id, carol.id])
+
+
+def test_finalize(db):
+    server = db.server()
+    sprintathon = db.sprintathon(server)
+    sprint = db.sprint(server, sprintathon)
+    alice, bob, carol, dave = db.member(1), db.member(2), db.member(3), db.member(4)
+    db.check_in(sprint, alice, 'START', 100)
+    db.check_in(sprint, alice, 'FINISH', 400)
+    db.check_in(sprint, bob, 'START', 50)
+    db.check_in(sprint, bob, 'FINISH', 50)
+    db.check_in(sprint, carol, 'START', 80)
+    db.check_in(sprint, carol, 'FINISH', 10)
+    db.check_in(sprint, dave, 'START', 5)
+
+    results = db.sprints.finalize(sprint)
+    assert [(item.id, word_count) for item, word_count in results.word_counts] == [(alice.id, 300), (bob.id, 0)]
+    assert [item.id for item in results.missing] == [dave.id]
+    assert [(item.id, start, finish) for item, start, finish in results.invalid] == [(carol.id, 80, 10)]
+    assert [item.id for item in results.idle] == [bob.id]
+    assert results.bonus[0].id == alice.id
+    assert not sprint.active
+    assert not db.sprints.find_by_id(sprint.id).active
+    assert db.sprints.get_active() == []
+    assert db.sprintathons.get_word_count(sprintathon, alice) == 300
+    assert db.sprintathons.get_bonus_word_count(sprintathon, alice) == 300
+
+
+def test_leaderboard(db):
+    server = db.server()
+    sprintathon = db.sprintathon(server, duration=1)
+    sprint = db.sprint(server, sprintathon)
+    alice, bob, carol = db.member(1), db.member(2), db.member(3)
+    db.check_in(sprint, alice, 'START', 0)
+    db.check_in(sprint, alice, 'FINISH', 600)
+    db.check_in(sprint, bob, 'START', 0)
+    db.check_in(sprint, bob, 'FINISH', 120)
+    # Checked in, but never finished, so still on the leaderboard with no words.
+    db.check_in(sprint, carol, 'START', 10)
+    db.sprints.finalize(sprint)
+
+    leaderboard = db.sprintathons.get_leaderboard(sprintathon)
+    assert [(item.member.id, item.word_count, item.bonus_word_count, item.wpm) for item in leaderboard] == \
+           [(alice.id, 600, 600, 10), (bob.id, 120, 0, 2), (carol.id, 0, 0, 0)]
+
+    page = db.sprintathons.get_leaderboard_page(sprintathon, 1, carol.discord_user_id)
+    assert page.total == 3
+    assert [(rank, entry.member.id) for rank, entry in page.entries] == [(1, alice.id), (3, carol.id)]
+    assert db.sprintathons.get_leaderboard_page(db.sprintathon(server), 10) == ([], 0)
+
+
+def _leaderboard_rows(db, sprintathon):
+    return [(item.member.id, item.word_count, item.bonus_word_count)
+            for item in db.sprintathons.get_leaderboard(sprintathon)]
+
+
+def test_rebuild_totals(db):
+    server = db.server()
+    sprintathon = db.sprintathon(server)
+    sprint = db.sprint(server, sprintathon)
+    alice, bob = db.member(1), db.member(2)
+    db.check_in(sprint, alice, 'START', 0)
+    db.check_in(sprint, alice, 'FINISH', 90)
+    db.check_in(sprint, bob, 'START', 0)
+    db.sprints.finalize(sprint)
+    expected = _leaderboard_rows(db, sprintathon)
+    assert expected == [(alice.id, 90, 90), (bob.id, 0, 0)]
+
+    db.sprintathons.rebuild_totals(sprintathon.id)
+    assert _leaderboard_rows(db, sprintathon) == expected
+    db.sprintathons.rebuild_totals()
+    assert _leaderboard_rows(db, sprintathon) == expected
+
+
+def test_add_all_submissions(db):
+    server = db.server()
+    sprintathon = db.sprintathon(server)
+    first, second = db.sprint(server, sprintathon, channel_id=1), db.sprint(server, channel_id=2)
+    alice, bob = db.member(1), db.member(2)
+    stamp = _now() - datetime.timedelta(minutes=1)
+    entries = [(first, Submission(member=alice, word_count=10, _type='START', datetime=stamp)),
+               (second, Submission(member=bob, word_count=20, _type='START')),
+               (first, Submission(member=alice, word_count=30, _type='FINISH'))]
+    db.sprints.add_all_submissions(entries)
+
+    assert all(item.id is not None and item.datetime is not None for _, item in entries)
+    assert entries[0][1].datetime == stamp
+    assert [item.id for item in db.sprints.get_members(first)] == [alice.id]
+    assert sorted(item.word_count for item in db.sprints.get_submissions(first)) == [10, 30]
+    assert [item.id for item in db.sprintathons.get_members(sprintathon)] == [alice.id]
+    assert [item.word_count for item in db.sprints.get_submissions(second)] == [20]
+
+
+def test_last_submission(db):
+    server = db.server()
+    sprint = db.sprint(server)
+    alice = db.member(1)
+    assert db.submissions.get_last_for_member(alice) is None
+    db.check_in(sprint, alice, 'START', 10)
+    db.check_in(sprint, alice, 'FINISH', 25)
+    db.sprints.finalize(sprint)
+    # DELTA submissions aren't word counts, so they're skipped.
+    assert db.submissions.get_last_for_member(alice).word_count == 25
+    assert len(db.submissions.find_all_by_member(alice)) == 3
+    assert len(db.submissions.find_all_by_member_and_sprint(alice, sprint)) == 3
+
+
+def test_jobs(db):
+    # Sharded lookups filter with = ANY().
+    shard_count = 4
+    first, second = db.server(_guild_on_shard(1, shard_count)), db.server(_guild_on_shard(3, shard_count))
+    first_sprint, second_sprintathon = db.sprint(first), db.sprintathon(second)
+    now = _now()
+    db.jobs.create(Job(kind='SPRINT', entity_id=first_sprint.id, phase='END', fire_at=now))
+    db.jobs.create(Job(kind='SPRINTATHON', entity_id=second_sprintathon.id, phase='WARNING', fire_at=now))
+    # Rescheduling replaces the pending job.
+    db.jobs.create(Job(kind='SPRINTATHON', entity_id=second_sprintathon.id, phase='END',
+                       fire_at=now + datetime.timedelta(minutes=5)))
+    horizon = now + datetime.timedelta(minutes=10)
+
+    due = db.jobs.find_due(horizon)
+    assert [(item.kind, item.phase) for item in due] == [('SPRINT', 'END'), ('SPRINTATHON', 'END')]
+    assert due[0].fire_at == now
+    # So the bot can skip jobs for guilds another instance handles.
+    assert [item.discord_guild_id for item in due] == [first.discord_guild_id, second.discord_guild_id]
+    assert [item.kind for item in db.jobs.find_due(now + datetime.timedelta(minutes=1))] == ['SPRINT']
+    assert [item.kind for item in db.jobs.find_due(horizon, [1], shard_count)] == ['SPRINT']
+    assert [item.kind for item in db.jobs.find_due(horizon, [0, 3], shard_count)] == ['SPRINTATHON']
+    assert db.jobs.find_due(horizon, [0, 2], shard_count) == []
+
+    db.jobs.delete(Job(kind='SPRINT', entity_id=first_sprint.id))
+    assert [item.kind for item in db.jobs.find_due(horizon)] == ['SPRINTATHON']
+
+
+def test_active(db):
+    server = db.server()
+    sprintathon = db.sprintathon(server, channel_id=7)
+    sprint = db.sprint(server, sprintathon, channel_id=7)
+    db.check_in(sprint, db.member(1), 'START', 10)
+    finished = db.sprintathon(server, channel_id=8)
+    finished.active = False
+    db.sprintathons.update(finished)
+
+    assert db.sprintathons.get_active_for_channel(7).id == sprintathon.id
+    assert db.sprintathons.get_active_for_channel(8) is None
+    assert db.sprintathons.get_most_recent_for_channel(8).id == finished.id
+    assert db.sprints.get_most_recent_active(server, 7).id == sprint.id
+    assert db.sprints.get_most_recent_active(server, 8) is None
+
+    registry = ActiveSprintRegistry()
+    registry.load(db.sprints.connection)
+    state = registry.get_sprint(server.discord_guild_id, 7)
+    assert state.sprint.sprintathon.id == sprintathon.id
+    assert [item.discord_user_id for item in state.members] == [1]
+    assert registry.get_sprintathon(server.discord_guild_id, 7).id == sprintathon.id
+
+
+def test_history(db):
+    server = db.server()
+    alice = db.member(1)
+    for index in range(3):
+        sprint = db.sprint(server, duration=10)
+        db.check_in(sprint, alice, 'START', index * 100)
+        db.check_in(sprint, alice, 'FINISH', index * 100 + 50 * (index + 1))
+        db.sprints.finalize(sprint)
+
+    batches = list(db.submissions.stream_history(alice, batch_size=4))
+    assert [len(rows) for rows in batches] == [4, 4, 1]
+    rows = [row for rows in batches for row in rows]
+    assert [row[0] for row in rows] == sorted(row[0] for row in rows)
+    assert all(row[5] == datetime.timedelta(minutes=10) for row in rows)
+
+    stats = history.member_stats(db.submissions, alice, batch_size=2)
+    assert (stats.submissions, stats.sprints, stats.lifetime_words, stats.best_sprint_words) == (9, 3, 300, 150)
+    assert stats.average_wpm == pytest.approx(10.0)
+    assert stats.current_streak() == 1
+
+    file = io.BytesIO()
+    assert history.export_history(db.submissions, alice, 'json', file, batch_size=2) == 9
+    exported = json.loads(file.getvalue())
+    assert [item['type'] for item in exported[:3]] == ['START', 'FINISH', 'DELTA']
+    assert exported[2]['sprint_minutes'] == 10
+
+    file = io.BytesIO()
+    assert history.export_history(db.submissions, alice, 'csv', file, batch_size=2) == 9
+    assert len(file.getvalue().decode().splitlines()) == 10